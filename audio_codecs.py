@@ -0,0 +1,73 @@
+import numpy as np
+
+SAMPLING_RATE = 16000
+
+# WebSocket subprotocols for the audio sent to /ws. A client offers the ones it can send, in the order it prefers,
+# and the server accepts the first one it can decode. A client that offers none sends float32.
+FLOAT32 = "float32"  # little-endian float32 PCM, 16 kHz mono (64 KB/s)
+INT16 = "int16"  # little-endian int16 PCM, 16 kHz mono (32 KB/s)
+OPUS = "opus"  # one Opus packet per message, mono, any Opus sample rate (e.g. 2-4 KB/s for speech)
+
+
+class Float32Decoder:
+    def decode(self, data):
+        return np.frombuffer(data, dtype="<f4").astype(np.float32, copy=False)
+
+
+class Int16Decoder:
+    def decode(self, data):
+        # a trailing odd byte cannot be a sample
+        pcm = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+        return pcm.astype(np.float32) * (1.0 / 32768.0)
+
+
+class OpusDecoder:
+    """Decodes raw Opus packets (no Ogg or WebM container), e.g. the chunks of the browser's WebCodecs AudioEncoder,
+    to float32 audio at 16 kHz. Uses PyAV (installed with aiortc).
+    """
+
+    def __init__(self):
+        import av
+
+        self.codec = av.CodecContext.create("opus", "r")
+        self.codec.sample_rate = 48000  # the decoder always runs at 48 kHz, the resampler takes it to 16 kHz
+        self.codec.layout = "mono"
+        self.resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLING_RATE)
+        self._av = av
+
+    def decode(self, data):
+        out = []
+        for frame in self.codec.decode(self._av.Packet(data)):
+            for resampled in self.resampler.resample(frame):
+                out.append(resampled.to_ndarray().reshape(-1))
+        if not out:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(out)
+
+
+def available_codecs():
+    """The codecs this server can decode, Opus only if PyAV is installed"""
+    codecs = [FLOAT32, INT16]
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return codecs
+    return codecs + [OPUS]
+
+
+def negotiate(offered):
+    """Picks the codec for a connection from the subprotocols the client offered. Returns (codec, subprotocol to accept)."""
+    supported = available_codecs()
+    for protocol in offered:
+        if protocol in supported:
+            return protocol, protocol
+    # legacy clients do not offer any subprotocol
+    return FLOAT32, None
+
+
+def create_decoder(codec):
+    if codec == OPUS:
+        return OpusDecoder()
+    if codec == INT16:
+        return Int16Decoder()
+    return Float32Decoder()
@@ -0,0 +1,110 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+
+from report_generator import update_outline
+
+
+def _count_sentences(text):
+    return len(re.findall(r"[.!?]+(?=\s|$)", text))
+
+
+class LiveOutline:
+    """Outline of a transcript that is kept up to date while it is being recorded.
+
+    add() takes the text that the session commits. run() updates the outline in the background with a small
+    incremental prompt (the outline so far and the new text) after every `every_sentences` committed sentences,
+    but not more often than every min_interval seconds, and only while it holds the shared limiter, so that the
+    live outlines of all sessions take at most a few LLM connections. current() catches up with the text
+    committed since the last update, so that the outline is ready right after the recording stops.
+    """
+
+    def __init__(self, llm_client, article_style="default", every_sentences=8, min_interval=30.0, limiter=None):
+        self.llm_client = llm_client
+        self.article_style = article_style
+        self.every_sentences = every_sentences
+        self.min_interval = min_interval
+        self.limiter = limiter if limiter is not None else asyncio.Semaphore(1)
+
+        self.parts = []
+        self.outline = ""
+        self.outlined_parts = 0  # number of parts that the outline covers
+        self.last_update = 0.0
+        self.new_text = asyncio.Event()
+        self.lock = asyncio.Lock()  # one update at a time
+
+    @property
+    def transcript(self):
+        return "".join(self.parts)
+
+    def add(self, text):
+        self.parts.append(text)
+        self.new_text.set()
+
+    def pending_text(self):
+        return "".join(self.parts[self.outlined_parts:])
+
+    async def run(self):
+        """Updates the outline as the text comes. Runs until cancelled."""
+        while True:
+            await self.new_text.wait()
+            self.new_text.clear()
+            if _count_sentences(self.pending_text()) < self.every_sentences:
+                continue
+            wait = self.last_update + self.min_interval - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self.limiter:
+                try:
+                    await self.update()
+                except Exception as e:
+                    print(f"Live outline update failed: {e}")
+                    self.last_update = time.time()
+
+    async def update(self):
+        """Brings the outline up to date with the committed text"""
+        async with self.lock:
+            end = len(self.parts)
+            new_text = "".join(self.parts[self.outlined_parts:end]).strip()
+            if not new_text:
+                return
+            self.outline = await update_outline(self.llm_client, self.outline, new_text, self.article_style)
+            self.outlined_parts = end
+            self.last_update = time.time()
+
+    async def current(self):
+        """The outline of the whole transcript so far"""
+        await self.update()
+        return self.outline
+
+    def matches(self, transcript, article_style):
+        """Whether this outline is for the transcript the client sent (up to whitespace) and the same style"""
+        return article_style == self.article_style and transcript.split() == self.transcript.split()
+
+
+class LiveOutlines:
+    """The live outlines by the id the client chose for its transcript. The outline is kept after the recording
+    stops, for the outline request that follows, and continued when the client records more into the same
+    transcript. Only the most recent max_kept are kept."""
+
+    def __init__(self, llm_client, every_sentences=8, min_interval=30.0, concurrency=2, max_kept=64):
+        self.llm_client = llm_client
+        self.every_sentences = every_sentences
+        self.min_interval = min_interval
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.max_kept = max_kept
+        self.outlines = OrderedDict()
+
+    def open(self, outline_id, article_style="default"):
+        live = self.outlines.get(outline_id)
+        if live is None or live.article_style != article_style:
+            live = LiveOutline(self.llm_client, article_style, self.every_sentences, self.min_interval, self.limiter)
+            self.outlines[outline_id] = live
+        self.outlines.move_to_end(outline_id)
+        while len(self.outlines) > self.max_kept:
+            self.outlines.popitem(last=False)
+        return live
+
+    def get(self, outline_id):
+        return self.outlines.get(outline_id) if outline_id else None
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+
+def cache_key(*parts):
+    """Content address of an LLM result: sha256 of everything the answer depends on"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One LLM call in progress. It runs as a task of its own, so it finishes (and fills the cache) even when the
+    client that started it disconnects, and every request for the same key reads the same pieces."""
+
+    def __init__(self, pieces, on_done):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.on_done = on_done
+        self.changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._run(pieces))
+
+    async def _run(self, pieces):
+        try:
+            async for piece in pieces:
+                self.pieces.append(piece)
+                async with self.changed:
+                    self.changed.notify_all()
+        except asyncio.CancelledError:
+            # the pieces so far are no answer, the followers fail instead of ending early
+            self.error = RuntimeError("the LLM call was cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            # before the followers wake up, so that the result is cached by the time they return it
+            self.on_done(self)
+            async with self.changed:
+                self.changed.notify_all()
+
+    async def follow(self):
+        i = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.done or len(self.pieces) > i)
+            while i < len(self.pieces):
+                yield self.pieces[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class LLMCache:
+    """Cache of generated outlines and reports, keyed by cache_key().
+
+    Two tiers: an in-memory LRU of max_entries results, and optionally a directory with one file per result,
+    evicting the least recently used files when they take more than max_disk_bytes. A disk hit is moved back
+    into memory. The files are read and written in the default executor, off the event loop. Concurrent
+    requests for the same key share one LLM call: the first one starts it, the others follow its pieces as they
+    arrive. Failed and cancelled calls are not cached, the next request for the key calls the LLM again.
+    """
+
+    def __init__(self, max_entries=256, directory=None, max_disk_bytes=512 * 2**20):
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.disk = OrderedDict()  # key -> file size, least recently used first
+        self.inflight = {}
+        self.writes = set()  # disk writes in progress
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "joined": 0}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            files = []
+            for name in os.listdir(directory):
+                if name.endswith(".txt"):
+                    stat = os.stat(os.path.join(directory, name))
+                    files.append((stat.st_mtime, name[:-len(".txt")], stat.st_size))
+            for _, key, size in sorted(files):
+                self.disk[key] = size
+
+    def stats(self):
+        return dict(self.counters, memory_entries=len(self.memory), disk_entries=len(self.disk),
+                    disk_bytes=sum(self.disk.values()), inflight=len(self.inflight))
+
+    async def get(self, key):
+        """The cached text, or None"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return self.memory[key]
+        text = await self._disk_get(key)
+        if text is not None:
+            self.counters["disk_hits"] += 1
+            self._memory_put(key, text)
+        return text
+
+    async def put(self, key, text):
+        self._memory_put(key, text)
+        await self._disk_put(key, text)
+
+    async def stream(self, key, make_pieces):
+        """Yields the text for key in pieces. make_pieces() returns the async iterator of pieces of the LLM answer,
+        it is only called on a cache miss without a call for the same key in flight. A hit yields the whole text."""
+        text = await self.get(key)
+        if text is not None:
+            yield text
+            return
+        flight = self.inflight.get(key)
+        # a failed call is never joined, even if it is still in flight
+        if flight is None or (flight.done and flight.error is not None):
+            self.counters["misses"] += 1
+            flight = _Flight(make_pieces(), lambda flight: self._land(key, flight))
+            self.inflight[key] = flight
+        else:
+            self.counters["joined"] += 1
+        async for piece in flight.follow():
+            yield piece
+
+    async def get_or_compute(self, key, make_pieces):
+        """Like stream(), but returns the whole text"""
+        return "".join([piece async for piece in self.stream(key, make_pieces)])
+
+    def _land(self, key, flight):
+        if self.inflight.get(key) is flight:
+            del self.inflight[key]
+        if flight.error is not None:  # also set when the call was cancelled
+            return
+        text = "".join(flight.pieces)
+        # in memory right away, so that no request misses between the flight and the disk write
+        self._memory_put(key, text)
+        write = asyncio.ensure_future(self._disk_put(key, text))
+        self.writes.add(write)
+        write.add_done_callback(self.writes.discard)
+
+    def _memory_put(self, key, text):
+        self.memory[key] = text
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".txt")
+
+    # the file operations run in the executor, the bookkeeping in self.disk stays on the event loop
+
+    async def _disk_get(self, key):
+        if not self.directory or key not in self.disk:
+            return None
+        text = await asyncio.get_running_loop().run_in_executor(None, _read, self._path(key))
+        if text is None:
+            self.disk.pop(key, None)
+            return None
+        if key in self.disk:
+            self.disk.move_to_end(key)
+        return text
+
+    async def _disk_put(self, key, text):
+        if not self.directory:
+            return
+        data = text.encode("utf-8")
+        if len(data) > self.max_disk_bytes:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, _write, self._path(key), data)
+        except OSError as e:
+            print(f"Could not write {key} to the LLM cache: {e}")
+            return
+        self.disk[key] = len(data)
+        self.disk.move_to_end(key)
+        total = sum(self.disk.values())
+        evicted = []
+        while total > self.max_disk_bytes:
+            old, size = self.disk.popitem(last=False)
+            total -= size
+            evicted.append(self._path(old))
+        if evicted:
+            await loop.run_in_executor(None, _remove, evicted)
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return text
+
+
+def _write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
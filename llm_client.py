@@ -0,0 +1,122 @@
+import asyncio
+import random
+
+import httpx
+import openai
+
+# errors worth another attempt: the request may succeed later
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMClient:
+    """Async chat completion client shared by all the report requests.
+
+    All requests go through one httpx connection pool of at most max_connections connections, further requests
+    wait for a free connection (up to pool_timeout seconds). Failed requests are retried up to max_retries times
+    with exponential backoff and full jitter, so that many clients that failed together do not retry together.
+    A stream is only retried until its first token, after that the partial answer is already with the user.
+
+    base_url: any OpenAI-compatible API, e.g. OpenRouter or a local stand-in server (see __main__)
+    timeout: seconds for connecting and for waiting on each read, not for the whole (streamed) answer
+    """
+
+    def __init__(self, base_url, api_key, max_connections=10, timeout=60.0, pool_timeout=30.0, max_retries=3,
+                 retry_base_delay=0.5, retry_max_delay=8.0):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0), pool=pool_timeout),
+        )
+        # the retries are done here, with jitter and also for opening streams
+        self.client = openai.AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=self.http_client, max_retries=0)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+    async def aclose(self):
+        await self.client.close()
+
+    async def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2**attempt))
+        print(f"LLM request failed ({error!r}), retry {attempt+1}/{self.max_retries} in {delay:.2f} s")
+        await asyncio.sleep(delay)
+
+    async def complete(self, model, messages):
+        """Returns the text of the answer"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.chat.completions.create(model=model, messages=messages)
+                return response.choices[0].message.content
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                await self._backoff(attempt, e)
+
+    async def stream(self, model, messages):
+        """Yields the text of the answer in pieces as the model generates it"""
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                stream = await self.client.chat.completions.create(model=model, messages=messages, stream=True)
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        started = True
+                        yield delta
+                return
+            except RETRYABLE_ERRORS as e:
+                if started or attempt == self.max_retries:
+                    raise
+                await self._backoff(attempt, e)
+
+
+if __name__ == "__main__":
+    # OpenAI-compatible stand-in server for testing without an API key or network:
+    #   python llm_client.py --port 8001 --delay 0.05 --fail-rate 0.2
+    #   LLM_BASE_URL=http://localhost:8001/v1 uvicorn stt_server:app
+    import argparse
+    import json
+    import time
+
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds between streamed tokens")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    answer = ("<thinking>Grouping the points of the transcript.</thinking>\n"
+              "```markdown\n# Outline\n\n## First point\n- what was said first\n\n## Second point\n- what was said next\n```")
+    stand_in = FastAPI()
+
+    @stand_in.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if random.random() < args.fail_rate:
+            return JSONResponse({"error": {"message": "overloaded"}}, status_code=503)
+        tokens = [answer[i:i+4] for i in range(0, len(answer), 4)]
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(args.delay * len(tokens))
+            return {"id": "stand-in", "object": "chat.completion", "created": created, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}]}
+
+        async def events():
+            for token in tokens:
+                await asyncio.sleep(args.delay)
+                chunk = {"id": "stand-in", "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    uvicorn.run(stand_in, host="127.0.0.1", port=args.port)
@@ -1,7 +1,158 @@
 import re
 import json
+import asyncio
 
-def generate_report_from_outline(llm_client, transcript_text, outline, article_style):
+LLM_MODEL = "google/gemini-2.0-flash-001"
+# part of the cache keys of outlines and reports, bump it when the prompts change
+PROMPT_VERSION = 1
+# transcripts longer than this many tokens are outlined with map-reduce: the chunks concurrently, then the merge
+MAP_REDUCE_TOKENS = 8000
+OUTLINE_CHUNK_TOKENS = 3000
+# the end of each chunk is repeated at the start of the next, so that no thought is cut in half
+OUTLINE_CHUNK_OVERLAP_TOKENS = 200
+
+
+class FencedBlockParser:
+    """Incrementally extracts the content of the first ``` code block from a streamed LLM answer.
+
+    feed() takes the text deltas as they arrive and returns the part of the block content that is certain by now.
+    Everything before the opening fence is dropped, including <thinking>...</thinking> sections (fences inside
+    them do not count), and so is the language tag on the fence line and everything after the closing fence.
+    Whitespace at the start and at the end of the block and a possibly incomplete closing fence are held back
+    until more text arrives, so the concatenated output equals the stripped block content.
+    If the answer has no code block, close() returns the whole answer without the thinking sections.
+    """
+
+    FENCE = "```"
+
+    def __init__(self):
+        self.state = "preamble"  # -> "fence_line" -> "body" -> "done"
+        self.pending = ""
+        self.in_thinking = False
+        self.preamble = []  # text outside of thinking, for answers without a code block
+        self.body_started = False
+
+    @property
+    def found(self):
+        """Whether the opening fence has been seen"""
+        return self.state != "preamble"
+
+    def feed(self, delta):
+        self.pending += delta
+        out = []
+        while True:
+            if self.state == "preamble":
+                if not self._preamble():
+                    break
+            elif self.state == "fence_line":
+                newline = self.pending.find("\n")
+                fence = self.pending.find(self.FENCE)
+                if fence >= 0 and (newline < 0 or fence < newline):
+                    # a one-line block like ```text```, the fence line is the content
+                    self.state = "body"
+                    continue
+                if newline < 0:
+                    break
+                line = self.pending[:newline]
+                # a language tag is dropped, anything else on the fence line is already content
+                self.pending = self.pending[newline+1:] if re.fullmatch(r"\s*[\w+#.-]*\s*", line) else self.pending
+                self.state = "body"
+            elif self.state == "body":
+                out.append(self._body())
+                break
+            else:
+                self.pending = ""
+                break
+        return "".join(out)
+
+    def close(self):
+        """Call after the last delta. Returns the rest of the output."""
+        if self.state == "preamble":
+            if not self.in_thinking:
+                self.preamble.append(self.pending)
+            self.pending = ""
+            self.state = "done"
+            return "".join(self.preamble).strip()
+        if self.state == "fence_line":
+            # no newline and no closing fence came, a lone language tag is no content
+            if re.fullmatch(r"\s*[\w+#.-]*\s*", self.pending):
+                self.pending = ""
+            self.state = "body"
+        rest = ""
+        if self.state == "body":
+            rest = self._body()
+            if self.state == "body":
+                # unterminated block, what was held back is content after all
+                rest += self.pending.rstrip()
+        self.pending = ""
+        self.state = "done"
+        return rest
+
+    def _preamble(self):
+        # returns True if the state changed and the rest of pending should be parsed again
+        if self.in_thinking:
+            end = self.pending.find("</thinking>")
+            if end < 0:
+                return False
+            self.pending = self.pending[end+len("</thinking>"):]
+            self.in_thinking = False
+            return True
+        thinking = self.pending.find("<thinking>")
+        fence = self.pending.find(self.FENCE)
+        if thinking >= 0 and (fence < 0 or thinking < fence):
+            self.preamble.append(self.pending[:thinking])
+            self.pending = self.pending[thinking+len("<thinking>"):]
+            self.in_thinking = True
+            return True
+        if fence >= 0:
+            self.preamble.append(self.pending[:fence])
+            self.pending = self.pending[fence+len(self.FENCE):]
+            self.state = "fence_line"
+            return True
+        # keep what could be the start of a tag or of a fence
+        keep = max(_partial_suffix(self.pending, "<thinking>"), _partial_suffix(self.pending, self.FENCE))
+        self.preamble.append(self.pending[:len(self.pending)-keep])
+        self.pending = self.pending[len(self.pending)-keep:]
+        return False
+
+    def _body(self):
+        if not self.body_started:
+            self.pending = self.pending.lstrip()
+            if not self.pending:
+                return ""
+            self.body_started = True
+        fence = self.pending.find(self.FENCE)
+        if fence >= 0:
+            out = self.pending[:fence].rstrip()
+            self.pending = ""
+            self.state = "done"
+            return out
+        # hold back trailing whitespace and what could be the start of the closing fence
+        keep = _partial_suffix(self.pending, self.FENCE)
+        text = self.pending[:len(self.pending)-keep]
+        emit = text.rstrip()
+        self.pending = text[len(emit):] + self.pending[len(self.pending)-keep:]
+        return emit
+
+
+def _partial_suffix(text, token):
+    """Length of the longest suffix of text that is a proper prefix of token"""
+    for n in range(min(len(token)-1, len(text)), 0, -1):
+        if text.endswith(token[:n]):
+            return n
+    return 0
+
+
+def extract_fenced_block(text):
+    """The stripped content of the first ``` block of a complete answer, or the answer without thinking sections"""
+    parser = FencedBlockParser()
+    text = parser.feed(text)
+    # close() always leaves the parser done, so found has to be read before
+    found = parser.found
+    return text + parser.close(), found
+
+
+def report_messages(transcript_text, outline, article_style):
     report_prompt = """
     You are given:
     - a transcript where the user has brain dumped their thoughts.
@@ -42,29 +193,34 @@ def generate_report_from_outline(llm_client, transcript_text, outline, article_s
     </outline>
     """
 
-    messages = [
+    return [
         {"role": "system", "content": report_prompt},
         {"role": "user", "content": user_prompt}
     ]
-    response = llm_client.chat.completions.create(
-        model="google/gemini-2.0-flash-001",
-        messages=messages
-    )
-    report = response.choices[0].message.content
+
+
+async def generate_report_from_outline(llm_client, transcript_text, outline, article_style):
+    messages = report_messages(transcript_text, outline, article_style)
+    report = await llm_client.complete(LLM_MODEL, messages)
     
     print(json.dumps(messages, indent=2))
     print("--"*50)
     print(report)
     
-    report_match = re.search(r'```\s*(.*?)\s*```', report, re.DOTALL)
-    if report_match:
-        report = report_match.group(1).strip()
-    else:
+    report, found = extract_fenced_block(report)
+    if not found:
         print("No report found between ``` tags")
     return {"report": report}
 
 
-def outline_report(llm_client, transcript_text, article_style):
+async def stream_report_from_outline(llm_client, transcript_text, outline, article_style):
+    """Like generate_report_from_outline, but yields the report text in pieces as the LLM generates it"""
+    stream = llm_client.stream(LLM_MODEL, report_messages(transcript_text, outline, article_style))
+    async for text in stream_fenced_block(stream):
+        yield text
+
+
+def outline_messages(transcript_text, article_style):
 
     outline_prompt = """
     You are given a transcript where the user has braindumped their thoughts. Your job is to identify the main points and come up with a outline for structuring and organizing the users thoughts into the form they want. You will be given the format style that the user has specified for the final article that you will need to use in creating the outline.
@@ -84,21 +240,214 @@ def outline_report(llm_client, transcript_text, article_style):
 
     """
 
-    response = llm_client.chat.completions.create(
-        model="google/gemini-2.0-flash-001",
-        messages=[
-            {"role": "system", "content": outline_prompt},
-            {"role": "user", "content": f"<transcript>\n{transcript_text}\n</transcript>\n\nRequested content style: {article_style}"}
-        ]
-    )
-    outline = response.choices[0].message.content
-    print(outline)
-    outline_match = re.search(r'```\s*(.*?)\s*```', outline, re.DOTALL)
-    if outline_match:
-        outline = outline_match.group(1).strip()
+    return [
+        {"role": "system", "content": outline_prompt},
+        {"role": "user", "content": f"<transcript>\n{transcript_text}\n</transcript>\n\nRequested content style: {article_style}"}
+    ]
+
+
+def estimate_tokens(text):
+    """Rough token count, about 4 characters per token for English"""
+    return len(text) // 4
+
+
+def split_sentences(text):
+    """Splits the transcript into sentences at sentence punctuation and line breaks (the transcript has one line
+    per committed segment). The pieces keep their trailing whitespace, so "".join() gives the text back."""
+    return [s for s in re.findall(r".*?(?:[.!?]+(?=\s)|\n|$)\s*", text, re.DOTALL) if s]
+
+
+def chunk_transcript(text, chunk_tokens=OUTLINE_CHUNK_TOKENS, overlap_tokens=OUTLINE_CHUNK_OVERLAP_TOKENS):
+    """Splits the transcript at sentence boundaries into chunks of at most about chunk_tokens tokens. Each chunk
+    starts with the last sentences of the previous one, up to overlap_tokens. A sentence longer than a chunk is
+    split at word boundaries."""
+    sentences = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) <= chunk_tokens:
+            sentences.append(sentence)
+            continue
+        words = re.findall(r"\S+\s*", sentence)
+        piece = ""
+        for word in words:
+            if piece and estimate_tokens(piece + word) > chunk_tokens:
+                sentences.append(piece)
+                piece = ""
+            piece += word
+        if piece:
+            sentences.append(piece)
+
+    chunks = []
+    current = []
+    size = 0
+    for sentence in sentences:
+        tokens = estimate_tokens(sentence)
+        if current and size + tokens > chunk_tokens:
+            chunks.append("".join(current).strip())
+            # carry the overlap over, if it leaves room for new text
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                t = estimate_tokens(previous)
+                if overlap_size + t > overlap_tokens or overlap_size + t + tokens > chunk_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += t
+            current, size = overlap, overlap_size
+        current.append(sentence)
+        size += tokens
+    if current:
+        chunks.append("".join(current).strip())
+    return [c for c in chunks if c]
+
+
+def chunk_outline_messages(chunk_text, index, count, article_style):
+    chunk_prompt = f"""
+    You are given part {index+1} of {count} of a long transcript where the user has braindumped their thoughts. The parts overlap by a few sentences. Your job is to list the points made in this part, so that they can later be merged with the notes of the other parts into one outline for the requested content style.
+
+    How to do this:
+    - Identify the topics that the user is talking about in this part and what they say about each one
+    - Keep the order in which they come up, and note when a topic continues one that seems to have started earlier
+    - Be faithful to the users views, do not add or change anything
+    - Use <thinking> tags to talk through the process of analyzing and grouping the users thoughts.
+
+    Output format:
+    - Output the notes in a codeblock with ```\n<notes_go_here>\n```
+    - The notes must always be in well formatted markdown between ``` ``` tags, as headings per topic with lists of points
+    - the thinking tags must be outside the ``` ``` tags
+    """
+
+    return [
+        {"role": "system", "content": chunk_prompt},
+        {"role": "user", "content": f"<transcript_part>\n{chunk_text}\n</transcript_part>\n\nRequested content style: {article_style}"}
+    ]
+
+
+def merge_outline_messages(partial_outlines, article_style):
+    merge_prompt = """
+    You are given notes on consecutive parts of a long transcript where the user has braindumped their thoughts. The parts overlapped, so the same point can appear at the end of one part and the start of the next. Your job is to merge them into a single outline for structuring and organizing the users thoughts into the form they want.
+
+    How to do this:
+    - Merge points that appear in several parts, and topics that the user came back to later
+    - Group the topics into sections that fits the requested content style
+    - Think about how the overall article should flow depending on the topics, their relationships, and how much and what is said about them
+    - Do not drop points, and do not add or change views.
+    - Use <thinking> tags to talk through the process of merging and structuring the users thoughts.
+
+    Output format:
+    - Output the outline in a codeblock with ```\n<outline_content_goes_here>\n```
+    - The outline must always be in well formatted markdown between ``` ``` tags
+    - the thinking tags must be outside the ``` ``` tags
+    """
+
+    parts = "\n\n".join(f"<part_{i+1}>\n{outline}\n</part_{i+1}>" for i, outline in enumerate(partial_outlines))
+    return [
+        {"role": "system", "content": merge_prompt},
+        {"role": "user", "content": f"{parts}\n\nRequested content style: {article_style}"}
+    ]
+
+
+async def _complete_fenced(llm_client, messages):
+    answer = await llm_client.complete(LLM_MODEL, messages)
+    return extract_fenced_block(answer)[0]
+
+
+async def _map_outlines(llm_client, transcript_text, article_style, chunk_tokens):
+    """Outlines the chunks of the transcript concurrently. While the notes are still too long for one merge,
+    neighbouring notes are merged in groups. Returns the notes for the final merge."""
+    chunks = chunk_transcript(transcript_text, chunk_tokens)
+    print(f"Outlining {estimate_tokens(transcript_text)} tokens of transcript in {len(chunks)} chunks")
+    outlines = await asyncio.gather(*[
+        _complete_fenced(llm_client, chunk_outline_messages(chunk, i, len(chunks), article_style))
+        for i, chunk in enumerate(chunks)
+    ])
+    while len(outlines) > 2 and estimate_tokens("".join(outlines)) > chunk_tokens:
+        groups = [[]]
+        for outline in outlines:
+            if groups[-1] and estimate_tokens("".join(groups[-1] + [outline])) > chunk_tokens:
+                groups.append([])
+            groups[-1].append(outline)
+        if len(groups) == len(outlines):
+            break  # every note is a chunk on its own already, merging in groups would not shrink them
+        merged = iter(await asyncio.gather(*[
+            _complete_fenced(llm_client, merge_outline_messages(group, article_style))
+            for group in groups if len(group) > 1
+        ]))
+        outlines = [next(merged) if len(group) > 1 else group[0] for group in groups]
+    return outlines
+
+
+async def outline_report(llm_client, transcript_text, article_style, map_reduce_tokens=MAP_REDUCE_TOKENS,
+                         chunk_tokens=OUTLINE_CHUNK_TOKENS):
+    if estimate_tokens(transcript_text) > map_reduce_tokens:
+        outlines = await _map_outlines(llm_client, transcript_text, article_style, chunk_tokens)
+        messages = merge_outline_messages(outlines, article_style)
     else:
+        messages = outline_messages(transcript_text, article_style)
+    outline = await llm_client.complete(LLM_MODEL, messages)
+    print(outline)
+    outline, found = extract_fenced_block(outline)
+    if not found:
         print("No outline found between ``` tags")
     return {"outline": outline}
 
+
+async def stream_outline(llm_client, transcript_text, article_style, map_reduce_tokens=MAP_REDUCE_TOKENS,
+                         chunk_tokens=OUTLINE_CHUNK_TOKENS):
+    """Like outline_report, but yields the outline text in pieces as the LLM generates it.
+    With map-reduce, the merge is streamed once the chunks are outlined."""
+    if estimate_tokens(transcript_text) > map_reduce_tokens:
+        outlines = await _map_outlines(llm_client, transcript_text, article_style, chunk_tokens)
+        messages = merge_outline_messages(outlines, article_style)
+    else:
+        messages = outline_messages(transcript_text, article_style)
+    stream = llm_client.stream(LLM_MODEL, messages)
+    async for text in stream_fenced_block(stream):
+        yield text
+
+
+def outline_update_messages(outline, new_text, article_style):
+    update_prompt = """
+    You are maintaining the outline of a transcript while the user is still braindumping their thoughts. You are given the outline of everything they said so far and the part of the transcript that came after it. Your job is to update the outline so that it also organizes the new part, in the form the user wants.
+
+    How to do this:
+    - Add the new points to the sections they belong to, or add sections for new topics
+    - Regroup and reorder the sections if the new part changes how the overall article should flow
+    - Keep every point that is already in the outline, the new part only adds to it
+    - You are only organizing and adding cohesiveness to the users braindump in the requested content style, not adding or changing views.
+    - Use <thinking> tags to talk through the process of updating the outline.
+
+    Output format:
+    - Output the whole updated outline in a codeblock with ```\n<outline_content_goes_here>\n```
+    - The outline must always be in well formatted markdown between ``` ``` tags
+    - the thinking tags must be outside the ``` ``` tags
+    """
+
+    return [
+        {"role": "system", "content": update_prompt},
+        {"role": "user", "content": f"<outline>\n{outline}\n</outline>\n\n<new_transcript>\n{new_text}\n</new_transcript>\n\nRequested content style: {article_style}"}
+    ]
+
+
+async def update_outline(llm_client, outline, new_text, article_style):
+    """Returns outline extended with new_text, the transcript that came after it. Without an outline yet,
+    outlines new_text from scratch."""
+    if outline:
+        messages = outline_update_messages(outline, new_text, article_style)
+    else:
+        messages = outline_messages(new_text, article_style)
+    return await _complete_fenced(llm_client, messages)
+
+
+async def stream_fenced_block(stream):
+    """Yields the content of the first ``` block of a stream of answer pieces as they arrive"""
+    parser = FencedBlockParser()
+    async for delta in stream:
+        text = parser.feed(delta)
+        if text:
+            yield text
+    text = parser.close()
+    if text:
+        yield text
+
 if __name__ == "__main__":
     print("No good")
\ No newline at end of file
@@ -0,0 +1,228 @@
+import asyncio
+import copy
+import sys
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+from whisper_streamer.whisper_online import VACOnlineASRProcessor, load_vad_model
+
+
+class SessionLimitError(Exception):
+    """Raised when opening a session would exceed the configured session cap."""
+
+
+def interim_diff(previous, text, committed=""):
+    """The change from the previous interim text to the new one, as {"drop": d, "keep": n, "text": suffix}:
+    without its first d characters, the first n characters of the previous text are kept and suffix follows them.
+    committed is the text committed since the previous interim. It is usually the front of the previous interim
+    text, then it is dropped, so that only the changed end of the interim text is sent again.
+    """
+    drop = len(committed) if committed and previous.startswith(committed) else 0
+    rest = previous[drop:]
+    keep = 0
+    n = min(len(rest), len(text))
+    while keep < n and rest[keep] == text[keep]:
+        keep += 1
+    return {"drop": drop, "keep": keep, "text": text[keep:]}
+
+
+class CadenceController:
+    """Decides how many seconds of new audio a session collects before its next process_iter.
+
+    This is the computation aware simultaneous mode of whisper_online.py applied per session: the next update
+    comes as soon as the previous one is done and enough audio has arrived, but not sooner than min_interval.
+    The expected decode time is the recent decode time (exponential moving average), scaled down when the buffer
+    is shorter than recently (after it was trimmed), and multiplied by the number of sessions sharing each
+    inference worker. The interval is chosen
+    so that the session keeps its worker share busy at most target_utilization of the time. On an idle machine
+    this means min_interval, under load more audio is coalesced into each call, up to max_interval, so that
+    the sessions do not build up a backlog of pending updates.
+    """
+
+    def __init__(self, min_interval=0.25, max_interval=2.0, target_utilization=0.7, smoothing=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_utilization = target_utilization
+        self.smoothing = smoothing
+
+        self.interval = min_interval
+        self.decode_time = None  # seconds, moving average
+        self.buffer_seconds = None  # seconds of audio per decode, moving average
+
+    def update(self, decode_time, buffer_seconds, sessions=1, workers=1):
+        """Records one decode of buffer_seconds of audio that took decode_time seconds. Returns the new interval."""
+        if self.decode_time is None:
+            self.decode_time = decode_time
+            self.buffer_seconds = buffer_seconds
+        else:
+            self.decode_time += self.smoothing * (decode_time - self.decode_time)
+            self.buffer_seconds += self.smoothing * (buffer_seconds - self.buffer_seconds)
+
+        expected = self.decode_time
+        if self.buffer_seconds > 0:
+            # a growing buffer is followed by the average, a trimmed one is much cheaper right away
+            expected *= min(1.0, buffer_seconds / self.buffer_seconds)
+        share = max(1, sessions) / max(1, workers)
+        self.interval = min(self.max_interval, max(self.min_interval, expected * share / self.target_utilization))
+        return self.interval
+
+
+class AudioQueue:
+    """Received audio waiting for a session's VAD stage, at most max_seconds of it.
+
+    put() waits while the queue is full, so a session that falls behind stops reading its socket instead of
+    buffering without bound. get() takes everything queued as one array, so that a backlog is inserted into the
+    VAC at once instead of packet by packet.
+    """
+
+    def __init__(self, max_seconds=10.0, sampling_rate=16000):
+        self.max_samples = int(max_seconds * sampling_rate)
+        self.chunks = deque()
+        self.samples = 0
+        self.changed = asyncio.Condition()
+
+    def qsize(self):
+        return len(self.chunks)
+
+    async def put(self, audio):
+        async with self.changed:
+            # a packet larger than the whole queue still goes in when the queue is empty
+            await self.changed.wait_for(lambda: self.samples < self.max_samples)
+            self.chunks.append(audio)
+            self.samples += len(audio)
+            self.changed.notify_all()
+
+    async def get(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.chunks)
+            chunks = list(self.chunks)
+            self.chunks.clear()
+            self.samples = 0
+            self.changed.notify_all()
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+class StreamingSession:
+    """State of one /ws connection: its own VAC + online processor (audio buffer, hypothesis buffer, VAD state)."""
+
+    def __init__(self, session_id, online, cadence=None):
+        self.id = session_id
+        self.online = online
+        self.cadence = cadence if cadence is not None else CadenceController()
+        self.created_at = time.time()
+        self.queues = {}  # name -> asyncio.Queue of the pipeline stages, for monitoring
+        # (samples received so far, time.time() when they were received), to measure the emission lag
+        self.arrivals = deque()
+        self.received_samples = 0
+        self.trims = 0  # buffer trims already counted in the metrics
+        self.inserted_samples = 0  # inserted into the VAC
+        self.processed_samples = 0  # seen by the last finished process_iter
+        self.commit_seq = 0  # commits numbered so far, when there is no journal to number them
+        self.degraded = False
+        self._normal = (online.online_chunk_size, self.cadence.min_interval)
+        # online is not thread safe: VAD insertion and process_iter must not run at the same time
+        self.lock = asyncio.Lock()
+
+    def buffer_seconds(self):
+        """Length of the audio buffer that the next process_iter transcribes"""
+        online = self.online.online
+        return len(online.audio_buffer) / online.SAMPLING_RATE
+
+    def mark_received(self, n_samples, now=None):
+        """Records that n_samples more samples of audio arrived"""
+        self.received_samples += n_samples
+        self.arrivals.append((self.received_samples, time.time() if now is None else now))
+
+    def arrival_time(self, seconds):
+        """When the audio at `seconds` into the stream arrived. Forgets the arrivals before it, so the calls must
+        come in the order of the stream."""
+        sample = seconds * self.online.SAMPLING_RATE
+        while len(self.arrivals) > 1 and self.arrivals[0][0] < sample:
+            self.arrivals.popleft()
+        return self.arrivals[0][1] if self.arrivals else None
+
+    def lag_seconds(self):
+        """Received audio that no finished process_iter has seen yet: the queued audio, the audio waiting for the
+        next update and the audio of the update in progress"""
+        return (self.received_samples - self.processed_samples) / self.online.SAMPLING_RATE
+
+    def update_degraded(self, max_lag, degraded_chunk_size):
+        """Switches to the degraded mode when the lag exceeds max_lag seconds, and back when it is below half of it.
+        Degraded, Whisper runs only after degraded_chunk_size seconds of voiced audio instead of on every partial
+        chunk, and the cadence stays at its maximum interval, so that each update covers more audio and the session
+        catches up. Returns whether the mode changed."""
+        lag = self.lag_seconds()
+        if not self.degraded and lag > max_lag:
+            self.degraded = True
+            self.online.online_chunk_size = max(self._normal[0], degraded_chunk_size)
+            self.cadence.min_interval = self.cadence.interval = self.cadence.max_interval
+            return True
+        if self.degraded and lag < max_lag / 2:
+            self.degraded = False
+            self.online.online_chunk_size, self.cadence.min_interval = self._normal
+            return True
+        return False
+
+    def will_decode(self):
+        """Whether the next process_iter runs Whisper, not only returns the VAD state"""
+        online = self.online
+        return online.is_currently_final or online.current_online_chunk_buffer_size > online.SAMPLING_RATE*online.online_chunk_size
+
+
+class SessionManager:
+    """Gives every WebSocket connection its own streaming state while all of them share one loaded ASR model.
+
+    asr: loaded ASR backend (e.g. FasterWhisperASR), shared by all the sessions
+    max_sessions: maximum number of concurrently open sessions. None means no limit.
+    online_chunk_size, tokenizer, buffer_trimming, logfile: passed to each session's VACOnlineASRProcessor
+    vad_model: preloaded silero VAD model. Every session gets its own copy because the model keeps recurrent state.
+    min_interval, max_interval: bounds of each session's CadenceController
+    """
+
+    def __init__(self, asr, max_sessions=4, online_chunk_size=0.5, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr, vad_model=None,
+                 min_interval=0.25, max_interval=2.0):
+        self.asr = asr
+        self.max_sessions = max_sessions
+        self.online_chunk_size = online_chunk_size
+        self.tokenizer = tokenizer
+        self.buffer_trimming = buffer_trimming
+        self.logfile = logfile
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        if vad_model is None:
+            vad_model = load_vad_model()
+        self.vad_model = vad_model
+
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def open(self):
+        """Creates a new session. Raises SessionLimitError if max_sessions are already open."""
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            raise SessionLimitError(f"session limit of {self.max_sessions} reached")
+
+        online = VACOnlineASRProcessor(
+            self.online_chunk_size,
+            self.asr,
+            self.tokenizer,
+            buffer_trimming=self.buffer_trimming,
+            logfile=self.logfile,
+            vad_model=copy.deepcopy(self.vad_model),
+        )
+        cadence = CadenceController(min_interval=self.min_interval, max_interval=self.max_interval)
+        session = StreamingSession(uuid.uuid4().hex, online, cadence)
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def close(self, session_id):
+        """Drops the session and its buffers. Closing an unknown or already closed session is a no-op."""
+        return self.sessions.pop(session_id, None)
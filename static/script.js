@@ -15,6 +15,7 @@ const settingsModal = document.getElementById('settingsModal');
 const toast = document.getElementById('toast');
 const toastMessage = document.getElementById('toastMessage');
 const transcript = document.getElementById('transcript');
+const interimText = document.getElementById('interimText');
 const articleStyle = document.getElementById('articleStyle');
 const customStyle = document.getElementById('customStyle');
 const reportContent = document.getElementById('reportContent');
@@ -46,14 +47,23 @@ let source;
 let processor;
 let stream;
 let analyser;
+let audioCodec = 'float32'; // Audio format negotiated with the server: 'opus', 'int16' or 'float32'
+let opusEncoder = null;
+let encodedSamples = 0;
 let isRecording = false;
 let visualizerInterval;
 let hasOutline = false; // Track if outline has been generated
+let liveOutlineId = null; // Identifies this transcript's live outline on the server, until it is cleared
+let sessionToken = null; // The server's journal of this transcript, to resume it after a dropped connection
+let lastSeq = 0; // Number of the last committed text received
+let reconnectTimer = null;
+let reconnectAttempts = 0;
 let settings = {
     language: 'en',
     transcriptionModel: 'distil-large-v3',
     reportModel: 'google/gemini-2.0-flash-001',
-    reportType: 'summary'
+    reportType: 'summary',
+    liveOutline: false
 };
 
 // Style descriptions for different report styles
@@ -77,6 +87,7 @@ function loadSettings() {
         document.getElementById('languageSelect').value = settings.language;
         document.getElementById('modelSelect').value = settings.transcriptionModel;
         document.getElementById('reportModelSelect').value = settings.reportModel;
+        document.getElementById('liveOutlineCheckbox').checked = !!settings.liveOutline;
         
         // Update report type selection
         reportTypeOptions.forEach(option => {
@@ -91,6 +102,7 @@ function loadSettings() {
 
 // Save settings to localStorage
 function saveSettings() {
+    settings.liveOutline = document.getElementById('liveOutlineCheckbox').checked;
     localStorage.setItem('voiceScribeSettings', JSON.stringify(settings));
     showToast('Settings saved successfully!', 'success');
     settingsModal.style.display = 'none';
@@ -145,80 +157,151 @@ function updateVisualizer() {
     visualizerInterval = setTimeout(updateVisualizer, 50);
 }
 
+// WebCodecs Opus encoder settings: 16 kHz mono speech at 24 kbit/s
+const opusConfig = { codec: 'opus', sampleRate: 16000, numberOfChannels: 1, bitrate: 24000 };
+
+// Audio formats this browser can send, in order of preference.
+// They are offered as WebSocket subprotocols and the server accepts the first one it can decode.
+async function offeredCodecs() {
+    const codecs = [];
+    if (typeof AudioEncoder !== 'undefined') {
+        try {
+            const support = await AudioEncoder.isConfigSupported(opusConfig);
+            if (support.supported) {
+                codecs.push('opus');
+            }
+        } catch (error) {
+            console.warn('Opus encoding is not supported:', error);
+        }
+    }
+    codecs.push('int16', 'float32');
+    return codecs;
+}
+
+// Opus packets go to the server one per message, as the encoder produces them
+function createOpusEncoder() {
+    const encoder = new AudioEncoder({
+        output: function(chunk) {
+            if (ws && ws.readyState === WebSocket.OPEN) {
+                const packet = new Uint8Array(chunk.byteLength);
+                chunk.copyTo(packet);
+                ws.send(packet.buffer);
+            }
+        },
+        error: function(error) {
+            console.error('Opus encoder error:', error);
+        }
+    });
+    encoder.configure(opusConfig);
+    return encoder;
+}
+
+// Send 16 kHz audio in the negotiated format
+function sendAudio(samples) {
+    if (audioCodec === 'opus') {
+        opusEncoder.encode(new AudioData({
+            format: 'f32',
+            sampleRate: 16000,
+            numberOfFrames: samples.length,
+            numberOfChannels: 1,
+            timestamp: Math.round(encodedSamples * 1e6 / 16000),
+            data: samples
+        }));
+        encodedSamples += samples.length;
+    } else if (audioCodec === 'int16') {
+        const pcm = new Int16Array(samples.length);
+        for (let i = 0; i < samples.length; i++) {
+            const s = Math.max(-1, Math.min(1, samples[i]));
+            pcm[i] = s < 0 ? s * 0x8000 : s * 0x7FFF;
+        }
+        ws.send(pcm.buffer);
+    } else {
+        ws.send(samples.buffer);
+    }
+}
+
 // Start audio streaming
-function startStreaming() {
+async function startStreaming() {
     if (isRecording) return;
     
+    const codecs = await offeredCodecs();
+    connect(codecs);
+}
+
+// Open the WebSocket, resuming this transcript's session if there is one
+function connect(codecs) {
+    reconnectTimer = null;
     // Create WebSocket connection with protocol matching page protocol (ws or wss)
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    ws = new WebSocket(`${wsProtocol}//${window.location.host}/ws`);
+    const params = new URLSearchParams({ session: sessionToken || '', seq: lastSeq });
+    if (settings.liveOutline) {
+        // The server outlines the transcript while it is recorded, recording more continues the same outline
+        if (!liveOutlineId) {
+            liveOutlineId = Date.now().toString(36) + Math.random().toString(36).slice(2);
+        }
+        params.set('outline_id', liveOutlineId);
+        params.set('style', customStyle.value);
+    }
+    ws = new WebSocket(`${wsProtocol}//${window.location.host}/ws?${params}`, codecs);
     
     ws.onopen = function() {
-        // Request audio permissions
-        navigator.mediaDevices.getUserMedia({ audio: true })
-            .then(streamObj => {
-                stream = streamObj;
-                
-                // Create audio context
-                audioContext = new AudioContext();
-                source = audioContext.createMediaStreamSource(stream);
-                
-                // Create analyzer for visualizer
-                analyser = audioContext.createAnalyser();
-                analyser.fftSize = 256;
-                source.connect(analyser);
-                
-                // Create processor with desired chunk size
-                processor = audioContext.createScriptProcessor(4096, 1, 1);
-                source.connect(processor);
-                processor.connect(audioContext.destination);
-                
-                // Process audio data
-                processor.onaudioprocess = function(e) {
-                    if (ws.readyState === WebSocket.OPEN) {
-                        // Get original audio data
-                        const inputData = e.inputBuffer.getChannelData(0);
-                        
-                        // Resample to 16000Hz
-                        const resampleRatio = 16000 / audioContext.sampleRate;
-                        const resampledLength = Math.floor(inputData.length * resampleRatio);
-                        const resampledData = new Float32Array(resampledLength);
-                        
-                        for (let i = 0; i < resampledLength; i++) {
-                            const idx = i / resampleRatio;
-                            const idx1 = Math.floor(idx);
-                            const idx2 = Math.min(idx1 + 1, inputData.length - 1);
-                            const frac = idx - idx1;
-                            resampledData[i] = inputData[idx1] * (1 - frac) + inputData[idx2] * frac;
-                        }
-                        
-                        // Send resampled audio data to server
-                        ws.send(resampledData.buffer);
-                    }
-                };
-                
-                // Update UI
-                startButton.disabled = true;
-                stopButton.disabled = false;
-                recordingIndicator.style.display = 'flex';
-                isRecording = true;
-                
-                // Start visualizer update
-                visualizerInterval = setTimeout(updateVisualizer, 100);
-                
-                showToast('Recording started', 'success');
-            })
-            .catch(error => {
-                console.error('Error accessing microphone:', error);
-                showToast('Could not access microphone', 'error');
-                ws.close();
-            });
+        reconnectAttempts = 0;
+        // A server that does not negotiate the format expects float32
+        audioCodec = ws.protocol || 'float32';
+        if (opusEncoder && opusEncoder.state !== 'closed') {
+            opusEncoder.close();
+        }
+        opusEncoder = null;
+        if (audioCodec === 'opus') {
+            opusEncoder = createOpusEncoder();
+            encodedSamples = 0;
+        }
+        
+        // After a reconnect, the microphone is still running
+        if (!isRecording) {
+            startMicrophone();
+        } else {
+            showToast('Reconnected', 'success');
+        }
     };
     
     ws.onmessage = function(event) {
-        const content = document.createTextNode(event.data);
+        const message = JSON.parse(event.data);
+        if (message.type === 'session') {
+            if (message.session === null || message.session !== sessionToken) {
+                // A new session, e.g. the server lost the old one, or one without a journal, which numbers the
+                // commits of every connection from 1
+                sessionToken = message.session;
+                lastSeq = message.seq;
+            }
+            // A new connection starts without interim text
+            interimText.textContent = '';
+            return;
+        }
+        if (message.type === 'interim') {
+            // The words after the committed text, replaced on every update: drop the ones that were just committed,
+            // keep a prefix of the remaining ones, append the rest
+            interimText.textContent = interimText.textContent.slice(message.drop || 0).slice(0, message.keep) + message.text;
+            transcript.scrollTop = transcript.scrollHeight;
+            return;
+        }
+        if (message.type === 'lag') {
+            // The server fell behind and transcribes in larger steps until it catches up
+            if (message.degraded) {
+                showToast(`Transcription is ${Math.round(message.lag)} s behind, updating less often`, 'error');
+            } else {
+                showToast('Transcription caught up', 'success');
+            }
+            return;
+        }
+        if (message.type !== 'commit') return;
+        // Commits replayed after a reconnect may overlap what arrived before
+        if (message.seq <= lastSeq) return;
+        lastSeq = message.seq;
+        
+        const content = document.createTextNode(message.text);
         
-        transcript.appendChild(content);
+        transcript.insertBefore(content, interimText);
         
         // Auto-scroll to the bottom
         transcript.scrollTop = transcript.scrollHeight;
@@ -226,20 +309,106 @@ function startStreaming() {
     
     ws.onerror = function(error) {
         console.error('WebSocket error:', error);
-        showToast('Connection error', 'error');
-        stopStreaming();
+        if (!isRecording) {
+            showToast('Connection error', 'error');
+        }
     };
     
-    ws.onclose = function() {
+    ws.onclose = function(event) {
+        if (isRecording && event.code !== 4001) {
+            // Keep recording and resume the session, the audio spoken until then is lost
+            reconnectAttempts++;
+            const delay = Math.min(1000 * 2 ** (reconnectAttempts - 1), 10000);
+            if (reconnectAttempts === 1) {
+                showToast('Connection lost, reconnecting...', 'error');
+            }
+            reconnectTimer = setTimeout(() => connect(codecs), delay);
+            return;
+        }
+        if (event.code === 1013) {
+            showToast('Server is busy, please try again later', 'error');
+        } else if (event.code === 4001) {
+            showToast('This recording continues in another window', 'error');
+        }
         if (isRecording) {
             stopStreaming();
         }
     };
 }
 
+function startMicrophone() {
+    // Request audio permissions
+    navigator.mediaDevices.getUserMedia({ audio: true })
+        .then(streamObj => {
+            stream = streamObj;
+            
+            // Create audio context
+            audioContext = new AudioContext();
+            source = audioContext.createMediaStreamSource(stream);
+            
+            // Create analyzer for visualizer
+            analyser = audioContext.createAnalyser();
+            analyser.fftSize = 256;
+            source.connect(analyser);
+            
+            // Create processor with desired chunk size
+            processor = audioContext.createScriptProcessor(4096, 1, 1);
+            source.connect(processor);
+            processor.connect(audioContext.destination);
+            
+            // Process audio data
+            processor.onaudioprocess = function(e) {
+                if (ws.readyState === WebSocket.OPEN) {
+                    // Get original audio data
+                    const inputData = e.inputBuffer.getChannelData(0);
+                    
+                    // Resample to 16000Hz
+                    const resampleRatio = 16000 / audioContext.sampleRate;
+                    const resampledLength = Math.floor(inputData.length * resampleRatio);
+                    const resampledData = new Float32Array(resampledLength);
+                    
+                    for (let i = 0; i < resampledLength; i++) {
+                        const idx = i / resampleRatio;
+                        const idx1 = Math.floor(idx);
+                        const idx2 = Math.min(idx1 + 1, inputData.length - 1);
+                        const frac = idx - idx1;
+                        resampledData[i] = inputData[idx1] * (1 - frac) + inputData[idx2] * frac;
+                    }
+                    
+                    // Send resampled audio data to server
+                    sendAudio(resampledData);
+                }
+            };
+            
+            // Update UI
+            startButton.disabled = true;
+            stopButton.disabled = false;
+            recordingIndicator.style.display = 'flex';
+            isRecording = true;
+            
+            // Start visualizer update
+            visualizerInterval = setTimeout(updateVisualizer, 100);
+            
+            showToast('Recording started', 'success');
+        })
+        .catch(error => {
+            console.error('Error accessing microphone:', error);
+            showToast('Could not access microphone', 'error');
+            ws.close();
+        });
+}
+
 // Stop audio streaming
 function stopStreaming() {
     isRecording = false;
+    // The server does not commit the interim words of a closed connection
+    interimText.textContent = '';
+    
+    if (reconnectTimer) {
+        clearTimeout(reconnectTimer);
+        reconnectTimer = null;
+    }
+    reconnectAttempts = 0;
     
     // Clear visualizer interval
     if (visualizerInterval) {
@@ -260,6 +429,13 @@ function stopStreaming() {
         stream.getTracks().forEach(track => track.stop());
     }
     
+    if (opusEncoder) {
+        if (opusEncoder.state !== 'closed') {
+            opusEncoder.close();
+        }
+        opusEncoder = null;
+    }
+    
     if (ws && ws.readyState === WebSocket.OPEN) {
         ws.close();
     }
@@ -283,13 +459,26 @@ function stopStreaming() {
 function clearTranscript() {
     if (confirm('Are you sure you want to clear the transcript?')) {
         transcript.innerHTML = '';
+        interimText.textContent = '';
+        transcript.appendChild(interimText);
+        liveOutlineId = null;
+        sessionToken = null;
+        lastSeq = 0;
         showToast('Transcript cleared', 'success');
     }
 }
 
+// The transcript without the interim text, which may still change
+function committedText() {
+    return Array.from(transcript.childNodes)
+        .filter(node => node !== interimText)
+        .map(node => node.textContent)
+        .join('');
+}
+
 // Save transcript
 function saveTranscript() {
-    const text = transcript.innerText;
+    const text = committedText();
     if (!text.trim()) {
         showToast('No transcript to save', 'error');
         return;
@@ -320,6 +509,43 @@ tabs.forEach(tab => {
     });
 });
 
+// Read a Server-Sent Events response. onDelta gets the text pieces as they arrive,
+// the payload of the final "done" event is returned.
+async function readEventStream(response, onDelta) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            throw new Error('Stream ended before completion');
+        }
+        buffer += decoder.decode(value, { stream: true });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) >= 0) {
+            const rawEvent = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            const payload = JSON.parse(data);
+            if (event === 'done') {
+                return payload;
+            } else if (event === 'error') {
+                throw new Error(payload.error);
+            } else {
+                onDelta(payload.delta);
+            }
+        }
+    }
+}
+
 // Generate report
 async function generateReport() {
     document.querySelector('.tab[data-tab="outline"]').classList.remove('active');
@@ -328,7 +554,7 @@ async function generateReport() {
     document.querySelector('.tab[data-tab="report"]').classList.add('active');
     document.querySelector(`.tab-content[data-content="report"]`).classList.add('active');
     
-    const text = transcript.innerText;
+    const text = committedText();
     if (!text.trim()) {
         showToast('No transcript to generate report from', 'error');
         return;
@@ -346,8 +572,8 @@ async function generateReport() {
         
         reportContent.innerHTML = 'Generating final report...';
         
-        // Then generate the report using the outline
-        const reportResponse = await fetch(`${window.location.protocol}//${window.location.host}/generate_report`, {
+        // Then generate the report using the outline, rendering it as it is written
+        const reportResponse = await fetch(`${window.location.protocol}//${window.location.host}/generate_report/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -363,7 +589,11 @@ async function generateReport() {
             throw new Error('Failed to generate report');
         }
         
-        const report = await reportResponse.json();
+        let partialReport = '';
+        const report = await readEventStream(reportResponse, delta => {
+            partialReport += delta;
+            reportContent.innerHTML = marked.parse(partialReport);
+        });
         console.log(report.report);
         reportContent.innerHTML = marked.parse(report.report);
         showToast('Report generated successfully', 'success');
@@ -397,7 +627,7 @@ async function generateReport() {
 
 // Generate Outline
 async function generateOutline() {
-    const text = transcript.innerText;
+    const text = committedText();
     if (!text.trim()) {
         showToast('No transcript to generate outline from', 'error');
         return;
@@ -419,14 +649,15 @@ async function generateOutline() {
 
     try {
         // Make API call to generate outline
-        const response = await fetch(`${window.location.protocol}//${window.location.host}/generate_outline`, {
+        const response = await fetch(`${window.location.protocol}//${window.location.host}/generate_outline/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
                 transcript: text,
-                articleStyle: customStyle.value
+                articleStyle: customStyle.value,
+                liveOutlineId: liveOutlineId
             })
         });
         
@@ -434,7 +665,11 @@ async function generateOutline() {
             throw new Error('Failed to generate outline');
         }
         
-        const outline = await response.json();
+        let partialOutline = '';
+        const outline = await readEventStream(response, delta => {
+            partialOutline += delta;
+            outlineContent.innerHTML = marked.parse(partialOutline);
+        });
         
         // Create an editable div with the outline content
         outlineContent.innerHTML = `
@@ -1,14 +1,25 @@
 from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from whisper_streamer.whisper_online import *
+from whisper_streamer.whisper_online import FasterWhisperASR, load_audio, load_vad_model
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import json
 import numpy as np
 import time
-import openai
 from fastapi.middleware.cors import CORSMiddleware
 from secret_keys import OPENROUTER_KEY
-from report_generator import generate_report_from_outline, outline_report
+from llm_client import LLMClient
+from report_generator import generate_report_from_outline, outline_report, stream_report_from_outline, stream_outline, LLM_MODEL, PROMPT_VERSION
+from llm_cache import LLMCache, cache_key
+from live_outline import LiveOutlines
+from transcript_journal import TranscriptJournals
+from session_manager import SessionManager, SessionLimitError, AudioQueue, interim_diff
+from audio_codecs import negotiate, create_decoder
+from metrics import Registry
+from whisper_streamer.batch_scheduler import BatchScheduler
+from whisper_streamer.model_server import RemoteASR
 import os
 import base64
 import secrets
@@ -21,6 +32,71 @@ from starlette.status import HTTP_401_UNAUTHORIZED
 APP_USERNAME = os.environ.get("APP_USERNAME", "user")
 APP_PASSWORD = os.environ.get("APP_PASSWORD", secrets.token_urlsafe(16))  # Generates a secure random password if not set
 
+# Maximum number of concurrent /ws transcription sessions served by this process
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 4))
+# Number of threads running Whisper inference (process_iter) off the event loop. 0 means one per ASR_NUM_WORKERS.
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+# If > 0, transcriptions of all sessions arriving within this many milliseconds are decoded as one batch
+INFERENCE_BATCH_WINDOW_MS = float(os.environ.get("INFERENCE_BATCH_WINDOW_MS", 0))
+# Bounds of the adaptive processing cadence: every session is re-transcribed after at least this many seconds of
+# new audio, sooner when the machine is idle, later when it is loaded. Set both to the same value for a fixed cadence.
+PROCESS_INTERVAL_MIN_SECS = float(os.environ.get("PROCESS_INTERVAL_MIN_SECS", 0.25))
+PROCESS_INTERVAL_MAX_SECS = float(os.environ.get("PROCESS_INTERVAL_MAX_SECS", 2.0))
+# Flow control of each session: at most AUDIO_QUEUE_MAX_SECS of received audio wait for the VAD, then the socket is
+# not read until the session catches up. A session whose unprocessed audio exceeds SESSION_MAX_LAG_SECS (0 = never)
+# is degraded until it is below half of it: Whisper runs only after DEGRADED_CHUNK_SECS of speech, at the longest cadence.
+AUDIO_QUEUE_MAX_SECS = float(os.environ.get("AUDIO_QUEUE_MAX_SECS", 10))
+SESSION_MAX_LAG_SECS = float(os.environ.get("SESSION_MAX_LAG_SECS", 6))
+DEGRADED_CHUNK_SECS = float(os.environ.get("DEGRADED_CHUNK_SECS", 2))
+# OpenAI-compatible API for outlines and reports, e.g. a local stand-in server (python llm_client.py) for testing
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+# Connections to the LLM API shared by all report requests, further requests wait for a free one
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 10))
+# Seconds for connecting and for each read from the LLM API
+LLM_TIMEOUT_SECS = float(os.environ.get("LLM_TIMEOUT_SECS", 60))
+# Retries of failed LLM requests, with exponential backoff and jitter
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+# Generated outlines and reports are cached by content: LLM_CACHE_ENTRIES in memory, and if LLM_CACHE_DIR is set,
+# up to LLM_CACHE_DISK_MB in that directory
+LLM_CACHE_ENTRIES = int(os.environ.get("LLM_CACHE_ENTRIES", 256))
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR") or None
+LLM_CACHE_DISK_MB = float(os.environ.get("LLM_CACHE_DISK_MB", 512))
+# Transcripts longer than this many tokens (about 4 characters each) are outlined in chunks of OUTLINE_CHUNK_TOKENS
+# concurrently, and the partial outlines are then merged
+OUTLINE_MAP_REDUCE_TOKENS = int(os.environ.get("OUTLINE_MAP_REDUCE_TOKENS", 8000))
+OUTLINE_CHUNK_TOKENS = int(os.environ.get("OUTLINE_CHUNK_TOKENS", 3000))
+# Clients can opt in to an outline that is updated while they record, after every LIVE_OUTLINE_SENTENCES committed
+# sentences and at most every LIVE_OUTLINE_INTERVAL_SECS. At most LIVE_OUTLINE_CONCURRENCY of these updates run at once
+# across all sessions, 0 turns live outlines off.
+LIVE_OUTLINE_SENTENCES = int(os.environ.get("LIVE_OUTLINE_SENTENCES", 8))
+LIVE_OUTLINE_INTERVAL_SECS = float(os.environ.get("LIVE_OUTLINE_INTERVAL_SECS", 30))
+LIVE_OUTLINE_CONCURRENCY = int(os.environ.get("LIVE_OUTLINE_CONCURRENCY", 2))
+# The committed text of every session is journaled in this directory (empty turns it off), so that a client that lost
+# its connection can resume the session. Queued records are written and fsynced every TRANSCRIPT_JOURNAL_FSYNC_SECS,
+# and journals older than TRANSCRIPT_JOURNAL_MAX_AGE_HOURS are deleted at startup.
+TRANSCRIPT_JOURNAL_DIR = os.environ.get("TRANSCRIPT_JOURNAL_DIR", "journal")
+TRANSCRIPT_JOURNAL_FSYNC_SECS = float(os.environ.get("TRANSCRIPT_JOURNAL_FSYNC_SECS", 1.0))
+TRANSCRIPT_JOURNAL_MAX_AGE_HOURS = float(os.environ.get("TRANSCRIPT_JOURNAL_MAX_AGE_HOURS", 24))
+# faster-whisper device and quantization. CPU-only nodes: ASR_DEVICE=cpu (int8 by default)
+ASR_DEVICE = os.environ.get("ASR_DEVICE", "cuda")
+ASR_COMPUTE_TYPE = os.environ.get("ASR_COMPUTE_TYPE") or None
+# Threads per faster-whisper worker on CPU (0 = ctranslate2 default) and number of parallel transcriptions on the model
+ASR_CPU_THREADS = int(os.environ.get("ASR_CPU_THREADS", 0))
+ASR_NUM_WORKERS = int(os.environ.get("ASR_NUM_WORKERS", 1))
+# If set, benchmark a few ASR_CPU_THREADS/ASR_NUM_WORKERS splits at startup and use the fastest
+ASR_AUTOTUNE = os.environ.get("ASR_AUTOTUNE", "").lower() in ("1", "true", "yes")
+# Whisper model name, downloaded on first use, or ASR_MODEL_DIR: a local CTranslate2 model directory, for offline nodes
+ASR_MODEL = os.environ.get("ASR_MODEL", "distil-large-v3")
+ASR_MODEL_DIR = os.environ.get("ASR_MODEL_DIR") or None
+# Unix sockets of model servers (python -m whisper_streamer.model_server), comma separated. If set, this process loads
+# no Whisper model and transcribes on them instead, so several web workers share the models of the host.
+ASR_MODEL_SERVERS = [a for a in os.environ.get("ASR_MODEL_SERVERS", "").split(",") if a]
+MODEL_SERVER_AUTHKEY = os.environ.get("MODEL_SERVER_AUTHKEY") or None
+# TorchScript silero VAD model file. By default the model bundled with the silero-vad package.
+VAD_MODEL_PATH = os.environ.get("VAD_MODEL_PATH") or None
+# Audio file transcribed once at startup before /ready reports ready. By default one second of silence.
+WARMUP_AUDIO = os.environ.get("WARMUP_AUDIO") or None
+
 # If password is auto-generated, print it to console (for development only)
 if os.environ.get("APP_PASSWORD") is None:
     print("====== SECURITY NOTICE ======")
@@ -33,6 +109,10 @@ if os.environ.get("APP_PASSWORD") is None:
 # Custom middleware for HTTP Basic Authentication
 class BasicAuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
+        # the readiness probe of a load balancer or orchestrator has no credentials
+        if request.url.path == "/ready":
+            return await call_next(request)
+
         # Check if the Authorization header is present
         auth_header = request.headers.get("Authorization")
         
@@ -69,13 +149,34 @@ class BasicAuthMiddleware(BaseHTTPMiddleware):
             headers=headers
         )
 
-llm_client = openai.OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_KEY
-)
+# async, so that report generation never blocks the event loop and the live transcription sockets
+llm_client = LLMClient(LLM_BASE_URL, OPENROUTER_KEY, max_connections=LLM_MAX_CONNECTIONS,
+                       timeout=LLM_TIMEOUT_SECS, max_retries=LLM_MAX_RETRIES)
+live_outlines = LiveOutlines(llm_client, every_sentences=LIVE_OUTLINE_SENTENCES, min_interval=LIVE_OUTLINE_INTERVAL_SECS,
+                             concurrency=max(1, LIVE_OUTLINE_CONCURRENCY))
+llm_cache = LLMCache(LLM_CACHE_ENTRIES, LLM_CACHE_DIR, int(LLM_CACHE_DISK_MB * 2**20))
+transcript_journals = (TranscriptJournals(TRANSCRIPT_JOURNAL_DIR, fsync_interval=TRANSCRIPT_JOURNAL_FSYNC_SECS,
+                                          max_age=TRANSCRIPT_JOURNAL_MAX_AGE_HOURS * 3600)
+                       if TRANSCRIPT_JOURNAL_DIR else None)
 
 app = FastAPI()
 
+@app.on_event("startup")
+async def start_loading():
+    # the models load in the background, so that the process answers /ready (503) right away
+    startup["task"] = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, load_pipeline))
+    if transcript_journals is not None:
+        startup["journal_task"] = asyncio.ensure_future(transcript_journals.run())
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.aclose()
+    if transcript_journals is not None:
+        for journal in list(transcript_journals.active.values()):
+            await transcript_journals.close(journal)
+    if isinstance(asr, RemoteASR):
+        asr.close()
+
 # Add Basic Auth middleware
 app.add_middleware(BasicAuthMiddleware)
 
@@ -92,19 +193,91 @@ app.add_middleware(
 )
 
 log_file = open("log.txt", "w")
-model_size = "distil-large-v3"
-asr = FasterWhisperASR("en", model_size, logfile=log_file) 
-online = VACOnlineASRProcessor(online_chunk_size=0.5, asr=asr) 
-
 sample_rate = 16000
-chunk_ms = 500
-capture_duration_secs = 0.5
 
+# set by load_pipeline() once the models are loaded and warmed up
+asr = None
+sessions = None
+inference_executor = None
+vad_executor = None
+startup = {"state": "loading", "error": None, "seconds": None, "task": None}
 
-llm_client = openai.OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_KEY
-)
+def load_pipeline():
+    """Loads Whisper and the VAD model, runs a warmup transcription, and creates the sessions and executors.
+    Runs in a thread at startup, /ready and /ws wait for it."""
+    global asr, sessions, inference_executor, vad_executor, INFERENCE_WORKERS
+    t = time.time()
+    try:
+        if ASR_MODEL_SERVERS:
+            if not MODEL_SERVER_AUTHKEY:
+                raise ValueError("ASR_MODEL_SERVERS needs MODEL_SERVER_AUTHKEY, the authkey of the model servers")
+            whisper = RemoteASR(ASR_MODEL_SERVERS, authkey=MODEL_SERVER_AUTHKEY.encode("utf-8"))
+            # the sessions only wait for the model servers here, they queue and batch the requests of all web workers
+            workers = INFERENCE_WORKERS or MAX_SESSIONS
+        else:
+            whisper = FasterWhisperASR("en", ASR_MODEL, model_dir=ASR_MODEL_DIR, logfile=log_file, device=ASR_DEVICE,
+                                       compute_type=ASR_COMPUTE_TYPE, cpu_threads=ASR_CPU_THREADS,
+                                       num_workers=ASR_NUM_WORKERS, autotune=ASR_AUTOTUNE)
+            workers = INFERENCE_WORKERS or whisper.num_workers
+        if INFERENCE_BATCH_WINDOW_MS > 0 and not ASR_MODEL_SERVERS:
+            # every session blocks in its own inference thread while the scheduler decodes the batch
+            session_asr = BatchScheduler(whisper, max_batch_size=MAX_SESSIONS, batch_window=INFERENCE_BATCH_WINDOW_MS/1000)
+            workers = max(workers, MAX_SESSIONS)
+        else:
+            session_asr = whisper
+        # one loaded model, one VAC/online processor per websocket connection
+        # the VAC gate only has to skip updates without enough speech, the cadence itself is set by each session's CadenceController
+        manager = SessionManager(session_asr, max_sessions=MAX_SESSIONS, online_chunk_size=PROCESS_INTERVAL_MIN_SECS, logfile=log_file,
+                                 vad_model=load_vad_model(VAD_MODEL_PATH),
+                                 min_interval=PROCESS_INTERVAL_MIN_SECS, max_interval=PROCESS_INTERVAL_MAX_SECS)
+        loaded = time.time() - t
+
+        # the very first transcription and VAD call take much longer than the others, the first session should not wait for them
+        audio = load_audio(WARMUP_AUDIO)[:5*sample_rate] if WARMUP_AUDIO else np.zeros(sample_rate, dtype=np.float32)
+        whisper.transcribe(audio)
+        session = manager.open()
+        session.online.insert_audio_chunk(audio)
+        session.online.process_iter()
+        manager.close(session.id)
+
+        # Whisper and silero release the GIL while they compute, so threads are enough to keep
+        # the event loop free for I/O. VAD has its own threads so that it never waits behind a transcription, one per
+        # session so that a slow VAD call of one session does not hold up the others. Every session has its own VAD
+        # model and inserts its chunks one after another, so the sessions never share a model between threads.
+        inference_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        vad_executor = ThreadPoolExecutor(max_workers=MAX_SESSIONS, thread_name_prefix="vad")
+        asr, sessions, INFERENCE_WORKERS = whisper, manager, workers
+    except Exception as e:
+        startup.update(state="failed", error=repr(e), seconds=time.time() - t)
+        print(f"Loading the models failed: {e!r}")
+        raise
+    startup.update(state="ready", seconds=time.time() - t)
+    print(f"Models loaded in {loaded:.1f} s, ready after warmup in {startup['seconds']:.1f} s")
+
+# /metrics, see metrics.py. Only updated on the event loop, the executor work is timed with timed().
+metrics = Registry()
+VAD_SECONDS = metrics.histogram("pensieve_vad_seconds", "Time of VAD on one received audio chunk")
+TRANSCRIBE_SECONDS = metrics.histogram("pensieve_transcribe_seconds", "Time of one process_iter that ran Whisper, without the wait for an inference worker")
+FLUSH_SECONDS = metrics.histogram("pensieve_hypothesis_flush_seconds", "Time of inserting a transcription into the hypothesis buffer and flushing the committed words")
+SEND_SECONDS = metrics.histogram("pensieve_websocket_send_seconds", "Time of sending one committed text to the client")
+EMISSION_LAG_SECONDS = metrics.histogram("pensieve_emission_lag_seconds", "Time from receiving the audio at the end of a committed text to sending the text")
+COMMITTED_WORDS = metrics.counter("pensieve_committed_words", "Words committed and sent to the clients")
+BUFFER_TRIMS = metrics.counter("pensieve_buffer_trims", "Trims of a session's audio buffer (chunk_at)")
+DEGRADATIONS = metrics.counter("pensieve_session_degradations", "Switches of a session to the degraded mode because it fell behind")
+
+def open_sessions():
+    return list(sessions.sessions.values()) if sessions is not None else []
+
+metrics.gauge("pensieve_ready", "1 once the models are loaded and warmed up", lambda: int(startup["state"] == "ready"))
+metrics.gauge("pensieve_active_sessions", "Open transcription sessions", lambda: len(open_sessions()))
+metrics.gauge("pensieve_max_sessions", "Session limit of this process", lambda: MAX_SESSIONS)
+metrics.gauge("pensieve_session_buffer_seconds", "Audio in each session's buffer, transcribed again on every update",
+              lambda: [({"session": s.id}, s.buffer_seconds()) for s in open_sessions()])
+metrics.gauge("pensieve_session_lag_seconds", "Received audio of each session that no finished update has seen yet",
+              lambda: [({"session": s.id}, s.lag_seconds()) for s in open_sessions()])
+metrics.gauge("pensieve_degraded_sessions", "Sessions in the degraded mode", lambda: sum(s.degraded for s in open_sessions()))
+metrics.gauge("pensieve_queue_depth", "Items waiting in each session's pipeline queues",
+              lambda: [({"session": s.id, "queue": name}, q.qsize()) for s in open_sessions() for name, q in s.queues.items()])
 
 html = """
 <!DOCTYPE html>
@@ -283,6 +456,17 @@ async def get_html():
             file.write(html_content)
             return html_content
 
+@app.get("/ready")
+async def get_ready():
+    """Readiness probe, without authentication: 200 once the models are loaded and warmed up, 503 before or if loading failed"""
+    body = {k: startup[k] for k in ("state", "error", "seconds")}
+    return JSONResponse(body, status_code=200 if startup["state"] == "ready" else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics of this process"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 @app.post("/generate_outline")
 async def generate_outline(request: Request):
@@ -290,50 +474,278 @@ async def generate_outline(request: Request):
     print(json.dumps(transcript_data, indent=4))
     article_style = transcript_data.get("articleStyle", "default")
 
-    outline = outline_report(llm_client, transcript_data["transcript"], article_style)
-    return outline
+    live = live_outline_for(transcript_data, article_style)
+    if live is not None:
+        return {"outline": await live.current()}
+    key = outline_cache_key(transcript_data["transcript"], article_style)
+    outline = await llm_cache.get_or_compute(key, lambda: as_pieces(
+        outline_report(llm_client, transcript_data["transcript"], article_style,
+                       map_reduce_tokens=OUTLINE_MAP_REDUCE_TOKENS, chunk_tokens=OUTLINE_CHUNK_TOKENS), "outline"))
+    print(f"LLM cache: {llm_cache.stats()}")
+    return {"outline": outline}
 
 @app.post("/generate_report")
 async def generate_report(request: Request):
     transcript_data = await request.json()
     print(json.dumps(transcript_data, indent=4))
     article_style = transcript_data.get("articleStyle", "default")
-    report = generate_report_from_outline(llm_client, transcript_data["transcript"], transcript_data["outline"], article_style)
-    return report
+    key = report_cache_key(transcript_data["transcript"], transcript_data["outline"], article_style)
+    report = await llm_cache.get_or_compute(key, lambda: as_pieces(
+        generate_report_from_outline(llm_client, transcript_data["transcript"], transcript_data["outline"], article_style), "report"))
+    print(f"LLM cache: {llm_cache.stats()}")
+    return {"report": report}
+
+def live_outline_for(transcript_data, article_style):
+    """The live outline that was kept while this transcript was recorded, if there is one"""
+    live = live_outlines.get(transcript_data.get("liveOutlineId"))
+    if live is not None and live.matches(transcript_data["transcript"], article_style):
+        return live
+    return None
+
+async def live_outline_pieces(live):
+    yield await live.current()
+
+def outline_cache_key(transcript, article_style):
+    # the map-reduce settings change the outline of long transcripts
+    return cache_key("outline", transcript, article_style, LLM_MODEL, PROMPT_VERSION,
+                     OUTLINE_MAP_REDUCE_TOKENS, OUTLINE_CHUNK_TOKENS)
+
+def report_cache_key(transcript, outline, article_style):
+    return cache_key("report", transcript, outline, article_style, LLM_MODEL, PROMPT_VERSION)
+
+async def as_pieces(result, key):
+    """The text of a non-streamed result dict as one piece, for the cache"""
+    yield (await result)[key]
+
+def sse_event(data, event=None):
+    """One Server-Sent Event with a JSON payload"""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
+
+async def sse_stream(pieces, key):
+    """Sends the text pieces as they come as {"delta": ...} events, then a "done" event with {key: whole text}.
+    A failure of the LLM call ends the stream with an "error" event."""
+    text = []
+    try:
+        async for piece in pieces:
+            text.append(piece)
+            yield sse_event({"delta": piece})
+    except Exception as e:
+        print(f"Streaming {key} failed: {e}")
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    yield sse_event({key: "".join(text)}, event="done")
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.post("/generate_outline/stream")
+async def generate_outline_stream(request: Request):
+    transcript_data = await request.json()
+    article_style = transcript_data.get("articleStyle", "default")
+    live = live_outline_for(transcript_data, article_style)
+    if live is not None:
+        pieces = live_outline_pieces(live)
+        return StreamingResponse(sse_stream(pieces, "outline"), media_type="text/event-stream", headers=SSE_HEADERS)
+    key = outline_cache_key(transcript_data["transcript"], article_style)
+    pieces = llm_cache.stream(key, lambda: stream_outline(
+        llm_client, transcript_data["transcript"], article_style,
+        map_reduce_tokens=OUTLINE_MAP_REDUCE_TOKENS, chunk_tokens=OUTLINE_CHUNK_TOKENS))
+    return StreamingResponse(sse_stream(pieces, "outline"), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/generate_report/stream")
+async def generate_report_stream(request: Request):
+    transcript_data = await request.json()
+    article_style = transcript_data.get("articleStyle", "default")
+    key = report_cache_key(transcript_data["transcript"], transcript_data["outline"], article_style)
+    pieces = llm_cache.stream(key, lambda: stream_report_from_outline(
+        llm_client, transcript_data["transcript"], transcript_data["outline"], article_style))
+    return StreamingResponse(sse_stream(pieces, "report"), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def receive_stage(websocket: WebSocket, session, audio_queue: AudioQueue, decoder):
+    """Reads audio packets from the socket, decodes them to float32 and puts them into audio_queue. Waits while the queue is full.
+    Returns when the client disconnects."""
+    while True:
+        data = await websocket.receive_bytes()
+        if not data:
+            continue
+        audio = decoder.decode(data)
+        if len(audio):
+            session.mark_received(len(audio))
+            await audio_queue.put(audio)
+
+def timed(fn):
+    """Calls fn() and returns its result and how many seconds it took"""
+    t = time.time()
+    res = fn()
+    return res, time.time() - t
+
+async def vad_stage(session, audio_queue: AudioQueue, ready: asyncio.Event):
+    """Feeds queued audio through the session's VAC and wakes the inference stage after every cadence interval of audio.
+    All the audio queued meanwhile is inserted at once."""
+    loop = asyncio.get_running_loop()
+    received_samples = 0
+    while True:
+        chunk = await audio_queue.get()
+        async with session.lock:
+            _, vad_time = await loop.run_in_executor(vad_executor, timed, partial(session.online.insert_audio_chunk, chunk))
+            session.inserted_samples += len(chunk)
+        VAD_SECONDS.observe(vad_time)
+        received_samples += len(chunk)
+        if received_samples >= session.cadence.interval * sample_rate:
+            received_samples = 0
+            ready.set()
+
+async def inference_stage(session, ready: asyncio.Event, text_queue: asyncio.Queue, live_outline=None, journal=None, structured=False):
+    """Runs process_iter on the inference executor whenever the VAD stage has collected enough audio,
+    and adapts the session's cadence to how long the decoding took. The committed text also goes to the journal and the live outline.
+    Clients that use sessions also get the not yet committed rest of the transcription as {"type": "interim"} diffs."""
+    loop = asyncio.get_running_loop()
+    interim = ""  # as the client has it
+    while True:
+        await ready.wait()
+        ready.clear()
+        async with session.lock:
+            decoded = session.will_decode()
+            buffer_seconds = session.buffer_seconds()
+            online = session.online.online
+            online.flush_time = None
+            inserted = session.inserted_samples
+            time_start = time.time()
+            (st, end, text), decode_time = await loop.run_in_executor(inference_executor, timed, session.online.process_iter)
+            time_end = time.time()
+            flush_time = online.flush_time
+            trims = online.trims
+            new_interim = online.interim[2]
+            session.processed_samples = inserted
+        if flush_time is not None:
+            FLUSH_SECONDS.observe(flush_time)
+        if trims > session.trims:
+            BUFFER_TRIMS.inc(trims - session.trims)
+            session.trims = trims
+        if text != "":
+            if journal is not None:
+                commit = journal.append(st, end, text)
+            else:
+                session.commit_seq += 1
+                commit = {"seq": session.commit_seq, "beg": round(st, 3), "end": round(end, 3), "text": text}
+            await text_queue.put((commit, end))
+            COMMITTED_WORDS.inc(len(text.split()))
+            if live_outline is not None:
+                live_outline.add(text)
+        if structured and (new_interim != interim or text != ""):
+            # after the commit, which usually takes words from the front of the interim text
+            await text_queue.put((dict(interim_diff(interim, new_interim, committed=text), type="interim"), None))
+            interim = new_interim
+        if SESSION_MAX_LAG_SECS > 0 and session.update_degraded(SESSION_MAX_LAG_SECS, DEGRADED_CHUNK_SECS):
+            lag = session.lag_seconds()
+            print(f"Session {session.id} {'is' if session.degraded else 'is no longer'} degraded, {lag:.1f} s behind")
+            if session.degraded:
+                DEGRADATIONS.inc()
+            # end None: a status message, not a commit
+            await text_queue.put(({"type": "lag", "lag": round(lag, 2), "degraded": session.degraded}, None))
+        if decoded:
+            TRANSCRIBE_SECONDS.observe(decode_time)
+            # the time in the executor queue is not decode time, the cadence accounts for sharing the workers itself
+            interval = session.cadence.update(decode_time, buffer_seconds, sessions=len(sessions), workers=INFERENCE_WORKERS)
+            print(f"the latency is {time_end-time_start:.2f}, decoding {decode_time:.2f}, next update after {interval:.2f} s of audio")
+
+async def send_stage(websocket: WebSocket, session, text_queue: asyncio.Queue, structured=False):
+    """Sends the committed text, as plain text or, to clients that use sessions, as {"type": "commit", ...} JSON.
+    These clients also get the interim text and the lag status messages."""
+    while True:
+        commit, end = await text_queue.get()
+        if end is None:
+            if structured:
+                await websocket.send_text(json.dumps(commit))
+            continue
+        t = time.time()
+        await websocket.send_text(json.dumps(dict(commit, type="commit")) if structured else commit["text"])
+        now = time.time()
+        SEND_SECONDS.observe(now - t)
+        received = session.arrival_time(end)
+        if received is not None:
+            EMISSION_LAG_SECONDS.observe(now - received)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    sample_rate = 16000
-    
-    # Buffer to accumulate audio samples
-    audio_buffer = np.array([], dtype=np.float32)
-    
-    samples_per_chunk = capture_duration_secs * sample_rate
-    
-    while True:
-        try:
-            data = await websocket.receive_bytes()
-            if not data:
-                continue
-                
-            chunk = np.frombuffer(data, dtype=np.float32)
-            online.insert_audio_chunk(chunk)
-            # Add to buffer
-            audio_buffer = np.append(audio_buffer, chunk)
-            
-            # Process if we have enough data
-            if len(audio_buffer) >= samples_per_chunk:
-                # Transcribe
-                time_start = time.time()
-                st, end, text = online.process_iter()
-                time_end = time.time()
-                if text != "":
-                    await websocket.send_text(text)
-                print(f"the latency is {time_end-time_start:.2f}")
-
-                audio_buffer = np.array([], dtype=np.float32)
-                
-        except Exception as e:
-            print(f"WebSocket error: {e}")
-            break
+    # the audio codec is negotiated as a subprotocol: float32, int16 or opus (see audio_codecs.py)
+    codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    if sessions is None:
+        print("Rejecting WebSocket: the models are not loaded yet")
+        await websocket.close(code=1013, reason="Server is starting")
+        return
+    try:
+        session = sessions.open()
+    except SessionLimitError as e:
+        print(f"Rejecting WebSocket: {e}")
+        # 1013 = try again later
+        await websocket.close(code=1013, reason="Server is at capacity")
+        return
+
+    # opt-in: ?session=<token, empty for a new session>&seq=<last received seq>. The client first gets
+    # {"type": "session", "session": token, "seq": last seq}, then the commits it missed and the new ones as JSON.
+    token = websocket.query_params.get("session")
+    structured = token is not None
+    journal = None
+    stages = []
+    outline_task = None
+    try:
+        if transcript_journals is not None:
+            try:
+                seq = int(websocket.query_params.get("seq") or 0)
+            except ValueError:
+                seq = 0
+            journal, missed = await transcript_journals.open(token, seq)
+            if structured:
+                await websocket.send_text(json.dumps({"type": "session", "session": journal.token, "seq": journal.seq}))
+                for record in missed:
+                    await websocket.send_text(json.dumps(dict(record, type="commit")))
+                if missed:
+                    print(f"Resumed session {journal.token}, sent {len(missed)} missed commits")
+        elif structured:
+            await websocket.send_text(json.dumps({"type": "session", "session": None, "seq": 0}))
+
+        # opt-in: ?outline_id=<id chosen by the client for its transcript>&style=<article style>
+        live_outline = None
+        outline_id = websocket.query_params.get("outline_id")
+        if outline_id and LIVE_OUTLINE_CONCURRENCY > 0:
+            live_outline = live_outlines.open(outline_id, websocket.query_params.get("style") or "default")
+
+        # receive -> VAD -> inference -> send, each stage in its own task so that a slow
+        # transcription never stops the socket from being read
+        audio_queue = AudioQueue(AUDIO_QUEUE_MAX_SECS, sample_rate)
+        text_queue = asyncio.Queue()
+        ready = asyncio.Event()
+        session.queues = {"audio": audio_queue, "text": text_queue}
+        stages = [
+            asyncio.create_task(receive_stage(websocket, session, audio_queue, create_decoder(codec))),
+            asyncio.create_task(vad_stage(session, audio_queue, ready)),
+            asyncio.create_task(inference_stage(session, ready, text_queue, live_outline, journal, structured)),
+            asyncio.create_task(send_stage(websocket, session, text_queue, structured)),
+        ]
+        if journal is not None:
+            # a reconnect of the same session ends this connection
+            stages.append(asyncio.create_task(journal.superseded.wait()))
+        # in the background, not a stage: it never ends the connection
+        outline_task = asyncio.create_task(live_outline.run()) if live_outline is not None else None
+
+        done, pending = await asyncio.wait(stages, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                print(f"WebSocket error: {task.exception()}")
+        if journal is not None and journal.superseded.is_set():
+            print(f"Session {journal.token} was resumed by another connection")
+            # 4001: the client must not reconnect, the session goes on elsewhere
+            try:
+                await websocket.close(code=4001, reason="Session resumed elsewhere")
+            except Exception:
+                pass  # the old connection is usually dead already
+    finally:
+        for task in stages:
+            task.cancel()
+        if outline_task is not None:
+            outline_task.cancel()
+        sessions.close(session.id)
+        if journal is not None:
+            await transcript_journals.close(journal)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+SAMPLING_RATE = 16000
+# in the order of Whisper's language tokens
+WHISPER_LANGUAGES = ("en,zh,de,es,ru,ko,fr,ja,pt,tr,pl,ca,nl,ar,sv,it,id,hi,fi,vi,he,uk,el,ms,cs,ro,da,hu,ta,no,th,ur,hr,"
+                     "bg,lt,la,mi,ml,cy,sk,te,fa,lv,bn,sr,az,sl,kn,et,mk,br,eu,is,hy,ne,mn,bs,kk,sq,sw,gl,mr,pa,si,km,sn,"
+                     "yo,so,af,oc,ka,be,tg,sd,gu,am,yi,lo,uz,fo,ht,ps,tk,nn,mt,sa,lb,my,bo,tl,mg,as,tt,haw,ln,ha,ba,jw,su")
+
+
+def speechlike(seconds, seed=0):
+    """Noise shaped into syllable-like bursts, so that the VAD and Whisper see something that changes over time"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLING_RATE)
+    t = np.arange(n) / SAMPLING_RATE
+    envelope = np.clip(np.sin(2 * np.pi * 2.5 * t + rng.uniform(0, 6)), 0, None) ** 2
+    tone = np.sin(2 * np.pi * (150 + 50 * np.sin(2 * np.pi * 0.7 * t)) * t)
+    return ((0.3 * tone + 0.05 * rng.standard_normal(n)) * envelope).astype(np.float32)
+
+
+def voiced(seconds, seed=0):
+    """Vowels of a synthetic voice: a 100-140 Hz glottal pulse train through the formant resonances of a random
+    vowel every 250 ms. The silero VAD rates it around its thresholds, so it starts and ends speech now and then."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLING_RATE)
+    t = np.arange(n) / SAMPLING_RATE
+    phase = np.cumsum((120 + 20 * np.sin(2 * np.pi * 0.7 * t)) / SAMPLING_RATE)
+    source = _iir([1.0], [1.0, -0.97], np.diff(np.floor(phase), prepend=0))
+    vowels = [(730, 1090, 2440), (270, 2290, 3010), (300, 870, 2240), (530, 1840, 2480), (570, 840, 2410)]
+    out = np.zeros(n)
+    step = SAMPLING_RATE // 4
+    r = np.exp(-np.pi * 80 / SAMPLING_RATE)
+    for i in range(0, n, step):
+        x = source[i:i+step]
+        y = sum(_iir([1 - r], [1, -2 * r * np.cos(2 * np.pi * f / SAMPLING_RATE), r * r], x)
+                for f in vowels[rng.integers(len(vowels))])
+        out[i:i+step] = y * np.hanning(len(y))
+    return (out / np.abs(out).max() * 0.5).astype(np.float32)
+
+
+def _iir(b, a, x):
+    # scipy.signal.lfilter for short filters
+    y = np.zeros(len(x))
+    for i in range(len(x)):
+        acc = sum(b[k] * x[i-k] for k in range(len(b)) if i >= k)
+        acc -= sum(a[k] * y[i-k] for k in range(1, len(a)) if i >= k)
+        y[i] = acc
+    return y
+
+
+@pytest.fixture(scope="session")
+def tiny_whisper_dir(tmp_path_factory):
+    """A CTranslate2 Whisper model with 2 tiny layers of random weights, built offline. Its transcripts are
+    nonsense, but it runs every step of faster-whisper in about a second, which is what the equivalence tests need."""
+    pytest.importorskip("faster_whisper")
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    ctranslate2 = pytest.importorskip("ctranslate2")
+
+    root = tmp_path_factory.mktemp("tiny_whisper")
+    torch.manual_seed(0)
+    vocab = {c: i for i, c in enumerate(sorted(tokenizers.pre_tokenizers.ByteLevel.alphabet()))}
+    while len(vocab) < 50257:
+        vocab[f"<unused{len(vocab)}>"] = len(vocab)
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.BPE(vocab=vocab, merges=[]))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = tokenizers.decoders.ByteLevel()
+    specials = ["<|endoftext|>", "<|startoftranscript|>"] + [f"<|{lan}|>" for lan in WHISPER_LANGUAGES.split(",")]
+    specials += ["<|translate|>", "<|transcribe|>", "<|startoflm|>", "<|startofprev|>", "<|nocaptions|>", "<|notimestamps|>"]
+    specials += [f"<|{i * 0.02:.2f}|>" for i in range(1501)]
+    tokenizer.add_special_tokens([tokenizers.AddedToken(s, special=True) for s in specials])
+
+    config = transformers.WhisperConfig(
+        vocab_size=51865, num_mel_bins=80, encoder_layers=2, decoder_layers=2, encoder_attention_heads=2,
+        decoder_attention_heads=2, d_model=64, encoder_ffn_dim=128, decoder_ffn_dim=128, max_source_positions=1500,
+        max_target_positions=448, decoder_start_token_id=50258, eos_token_id=50257, pad_token_id=50257,
+        bos_token_id=50257)
+    hf = root / "hf"
+    transformers.WhisperForConditionalGeneration(config).save_pretrained(hf)
+    tokenizer.save(str(hf / "tokenizer.json"))
+    ct2 = root / "ct2"
+    ctranslate2.converters.TransformersConverter(str(hf)).convert(str(ct2), force=True)
+    tokenizer.save(str(ct2 / "tokenizer.json"))
+    return str(ct2)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from conftest import SAMPLING_RATE, speechlike
+from whisper_streamer.feature_cache import LogMelCache
+
+feature_extractor = pytest.importorskip("faster_whisper.feature_extractor")
+
+
+@pytest.fixture(scope="module")
+def fe():
+    return feature_extractor.FeatureExtractor()
+
+
+def check(cache, fe, audio):
+    cache.update(audio)
+    expected = fe(audio)
+    features = cache.features()
+    assert features.shape == expected.shape
+    np.testing.assert_allclose(features, expected, rtol=0, atol=1e-5)
+
+
+def test_appends(fe):
+    rng = np.random.default_rng(0)
+    audio = speechlike(12, seed=1)
+    cache = LogMelCache(fe)
+    end = 0
+    # from shorter than one FFT window to whole seconds, and not aligned to the hop length
+    for n in [100, 300, 50, 1000, 160, 3333] + list(rng.integers(1, 2*SAMPLING_RATE, 12)):
+        end = min(len(audio), end + int(n))
+        check(cache, fe, audio[:end])
+
+
+def test_trims(fe):
+    rng = np.random.default_rng(1)
+    audio = speechlike(40, seed=2)
+    cache = LogMelCache(fe)
+    start = end = 0
+    for _ in range(30):
+        end = min(len(audio), end + int(rng.integers(1000, SAMPLING_RATE)))
+        check(cache, fe, audio[start:end])
+        if rng.random() < 0.4:
+            # mostly at Whisper's 20 ms timestamps, sometimes off the 10 ms hop, which drops the cache
+            cut = int(rng.integers(0, (end-start)//320)) * 320 + (int(rng.integers(1, 160)) if rng.random() < 0.2 else 0)
+            cut = min(cut, end - start)
+            cache.trim_front(cut)
+            start += cut
+            if cut % fe.hop_length:
+                assert len(cache) == 0
+    check(cache, fe, audio[start:end])
+
+
+def test_clamp_to_the_maximum_of_the_whole_buffer(fe):
+    # the clamping at 8 below the maximum changes when the loudest part is appended and when it is trimmed away
+    quiet = speechlike(3, seed=3) * 1e-4
+    loud = speechlike(1, seed=4)
+    audio = np.concatenate((quiet, loud, quiet)).astype(np.float32)
+    cache = LogMelCache(fe)
+    check(cache, fe, audio[:len(quiet)])
+    check(cache, fe, audio[:len(quiet)+len(loud)])
+    check(cache, fe, audio)
+    cut = (len(quiet)+len(loud)) // fe.hop_length * fe.hop_length
+    cache.trim_front(cut)
+    check(cache, fe, audio[cut:])
+    assert cache.features().max() < fe(audio).max()
+
+
+def test_clear(fe):
+    cache = LogMelCache(fe)
+    check(cache, fe, speechlike(2, seed=5))
+    cache.clear()
+    check(cache, fe, speechlike(1, seed=6))
+
+
+@pytest.mark.parametrize("kargs", [
+    {"compression_ratio_threshold": None, "log_prob_threshold": None, "no_speech_threshold": None},
+    {"temperature": 0.0, "no_speech_threshold": 0.9},
+])
+def test_transcribe_features(tiny_whisper_dir, fe, kargs):
+    from whisper_streamer.whisper_online import FasterWhisperASR
+    asr = FasterWhisperASR("en", model_dir=tiny_whisper_dir, device="cpu", compute_type="float32")
+    asr.transcribe_kargs.update(kargs)
+    cache = asr.feature_cache()
+    if cache is None:
+        pytest.skip("the installed faster-whisper has other internals, there is no feature cache")
+    audio = speechlike(4, seed=7)
+    cache.update(audio)
+    result = lambda segments: [(s.start, s.end, s.text, [(w.start, w.end, w.word) for w in s.words]) for s in segments]
+    assert result(asr.transcribe_features(cache.features(), audio, init_prompt="a prompt")) == \
+        result(asr.transcribe(audio, init_prompt="a prompt"))
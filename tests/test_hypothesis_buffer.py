@@ -0,0 +1,201 @@
+"""Replays recorded insert/flush/pop_commited streams through the HypothesisBuffer from before it was made linear
+and through the current one, which must commit exactly the same words.
+
+The streams in data/hypothesis_streams.json were recorded with record() from OnlineASRProcessor runs on a simulated
+ASR that revises the end of its hypotheses like Whisper does. Run this file to record them again.
+"""
+import json
+import logging
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+from whisper_streamer.whisper_online import ASRBase, HypothesisBuffer, OnlineASRProcessor
+
+logger = logging.getLogger(__name__)
+
+STREAMS = os.path.join(os.path.dirname(__file__), "data", "hypothesis_streams.json")
+
+
+class BaselineHypothesisBuffer:
+    """HypothesisBuffer as it was before it was made linear in the stream length"""
+
+    def __init__(self, logfile=sys.stderr):
+        self.commited_in_buffer = []
+        self.buffer = []
+        self.new = []
+
+        self.last_commited_time = 0
+        self.last_commited_word = None
+
+        self.logfile = logfile
+
+    def insert(self, new, offset):
+        new = [(a+offset,b+offset,t) for a,b,t in new]
+        self.new = [(a,b,t) for a,b,t in new if a > self.last_commited_time-0.1]
+
+        if len(self.new) >= 1:
+            a,b,t = self.new[0]
+            if abs(a - self.last_commited_time) < 1:
+                if self.commited_in_buffer:
+                    cn = len(self.commited_in_buffer)
+                    nn = len(self.new)
+                    for i in range(1,min(min(cn,nn),5)+1):  # 5 is the maximum 
+                        c = " ".join([self.commited_in_buffer[-j][2] for j in range(1,i+1)][::-1])
+                        tail = " ".join(self.new[j-1][2] for j in range(1,i+1))
+                        if c == tail:
+                            words = []
+                            for j in range(i):
+                                words.append(repr(self.new.pop(0)))
+                            words_msg = " ".join(words)
+                            logger.debug(f"removing last {i} words: {words_msg}")
+                            break
+
+    def flush(self):
+        commit = []
+        while self.new:
+            na, nb, nt = self.new[0]
+
+            if len(self.buffer) == 0:
+                break
+
+            if nt == self.buffer[0][2]:
+                commit.append((na,nb,nt))
+                self.last_commited_word = nt
+                self.last_commited_time = nb
+                self.buffer.pop(0)
+                self.new.pop(0)
+            else:
+                break
+        self.buffer = self.new
+        self.new = []
+        self.commited_in_buffer.extend(commit)
+        return commit
+
+    def pop_commited(self, time):
+        while self.commited_in_buffer and self.commited_in_buffer[0][1] <= time:
+            self.commited_in_buffer.pop(0)
+
+    def complete(self):
+        return self.buffer
+
+
+TEXT = ("so the thing about streaming is that the model sees the same audio again and again and only the words "
+        "that two transcriptions in a row agree on are committed the end of the buffer keeps changing while the "
+        "speaker goes on and the buffer is trimmed at the end of a committed segment then it starts over from "
+        "there with the committed text as the prompt the the repeated words at the start are dropped").split()
+
+
+class SimulatedASR(ASRBase):
+    """Transcribes the processor's audio buffer from a script of timed words. Words near the end of the buffer are
+    revised at random, like Whisper does with cut off speech, and timestamps jitter between calls."""
+
+    sep = ""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.transcribe_kargs = {}
+        t = 0.0
+        self.script = []
+        for word in TEXT:
+            duration = self.rng.uniform(0.15, 0.5)
+            self.script.append((t, t + duration, " " + word))
+            t += duration + self.rng.choice([0.0, 0.02, 0.1, 0.4])
+        self.processor = None
+
+    def transcribe(self, audio, init_prompt=""):
+        offset = self.processor.buffer_time_offset
+        end = offset + len(audio) / OnlineASRProcessor.SAMPLING_RATE
+        words = []
+        for a, b, w in self.script:
+            # whisper often repeats a word or two from before the buffer start
+            if b <= offset - self.rng.choice([0.0, 0.0, 0.3, 0.8]) or a >= end:
+                continue
+            jitter = self.rng.choice([0.0, 0.0, 0.02, -0.02])
+            a, b = max(a + jitter - offset, 0.0), min(b + jitter - offset, end - offset)
+            if end - offset - b < 1.0 and self.rng.random() < 0.4:
+                w = self.rng.choice([w, w + ",", " " + self.rng.choice(TEXT), w.upper()])
+            words.append((round(a, 2), round(b, 2), w))
+        if words and self.rng.random() < 0.2:
+            words.pop()
+        return [words[i:i+4] for i in range(0, len(words), 4)]
+
+    def ts_words(self, segments):
+        return [w for s in segments for w in s]
+
+    def segments_end_ts(self, res):
+        return [s[-1][1] for s in res]
+
+
+class RecordingBuffer(HypothesisBuffer):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def insert(self, new, offset):
+        self.calls.append(["insert", [list(w) for w in new], offset, self.last_commited_time])
+        super().insert(new, offset)
+
+    def flush(self):
+        self.calls.append(["flush"])
+        return super().flush()
+
+    def pop_commited(self, time):
+        self.calls.append(["pop_commited", time])
+        super().pop_commited(time)
+
+
+def record(seed, chunk_seconds=0.5, trimming_seconds=4):
+    """The calls to the hypothesis buffer of a streaming run over the simulated ASR"""
+    asr = SimulatedASR(seed)
+    processor = OnlineASRProcessor(asr, buffer_trimming=("segment", trimming_seconds))
+    asr.processor = processor
+    buffer = processor.transcript_buffer = RecordingBuffer()
+    samples = int(chunk_seconds * OnlineASRProcessor.SAMPLING_RATE)
+    for _ in range(int((asr.script[-1][1] + 1) / chunk_seconds)):
+        processor.insert_audio_chunk(np.zeros(samples, dtype=np.float32))
+        processor.process_iter()
+    return buffer.calls
+
+
+def replay(buffer, calls):
+    """Every return value and the state after every call"""
+    out = []
+    for call in calls:
+        if call[0] == "insert":
+            # the processor may set last_commited_time after a restart
+            buffer.last_commited_time = call[3]
+            buffer.insert([tuple(w) for w in call[1]], call[2])
+            result = None
+        elif call[0] == "flush":
+            result = buffer.flush()
+        else:
+            result = buffer.pop_commited(call[1])
+        out.append((result, list(buffer.commited_in_buffer), list(buffer.buffer), list(buffer.new),
+                    buffer.last_commited_time, buffer.last_commited_word))
+    return out
+
+
+def test_recorded_streams():
+    with open(STREAMS) as f:
+        streams = json.load(f)
+    for calls in streams:
+        assert any(c[0] == "pop_commited" for c in calls)
+        assert replay(HypothesisBuffer(), calls) == replay(BaselineHypothesisBuffer(), calls)
+
+
+@pytest.mark.parametrize("seed", range(100, 130))
+def test_fresh_streams(seed):
+    calls = record(seed, chunk_seconds=random.Random(seed).choice([0.3, 0.5, 1.0]))
+    committed = [w for result, *_ in replay(HypothesisBuffer(), calls) if result for w in result]
+    assert committed
+    assert replay(HypothesisBuffer(), calls) == replay(BaselineHypothesisBuffer(), calls)
+
+
+if __name__ == "__main__":
+    with open(STREAMS, "w") as f:
+        json.dump([record(seed, chunk_seconds) for seed, chunk_seconds in [(0, 0.5), (1, 1.0), (2, 0.3), (3, 0.5)]], f)
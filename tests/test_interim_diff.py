@@ -0,0 +1,48 @@
+import numpy as np
+
+from session_manager import interim_diff
+from test_hypothesis_buffer import SimulatedASR
+from whisper_streamer.whisper_online import OnlineASRProcessor
+
+
+def apply(previous, diff):
+    # what static/script.js does with an interim message
+    return previous[diff["drop"]:][:diff["keep"]] + diff["text"]
+
+
+def test_commit_then_interim():
+    previous = " the cat sat on"
+    # the next transcription commits " the cat" and changes the end of the rest
+    diff = interim_diff(previous, " sat on the", committed=" the cat")
+    assert diff == {"drop": 8, "keep": 7, "text": " the"}
+    assert apply(previous, diff) == " sat on the"
+
+
+def test_commit_that_is_not_the_front_of_the_interim():
+    diff = interim_diff(" a b", " c", committed=" x")
+    assert diff == {"drop": 0, "keep": 1, "text": "c"}
+    assert interim_diff(" a b", " a b c") == {"drop": 0, "keep": 4, "text": " c"}
+
+
+def test_streaming_run():
+    # the interim updates of inference_stage over a simulated stream: the client always ends up with the
+    # processor's interim text, and after a commit less is sent than without dropping the committed words
+    asr = SimulatedASR(7)
+    processor = OnlineASRProcessor(asr, buffer_trimming=("segment", 4))
+    asr.processor = processor
+    client = ""
+    sent = resent_without_drop = commits = 0
+    for _ in range(int(asr.script[-1][1] / 0.5)):
+        processor.insert_audio_chunk(np.zeros(8000, dtype=np.float32))
+        committed = processor.process_iter()[2]
+        interim = processor.interim[2]
+        diff = interim_diff(client, interim, committed=committed)
+        if committed:
+            commits += 1
+            assert diff["drop"] == len(committed)
+            resent_without_drop += len(interim_diff(client, interim)["text"])
+            sent += len(diff["text"])
+        client = apply(client, diff)
+        assert client == interim
+    assert commits > 10
+    assert sent < resent_without_drop
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from llm_cache import LLMCache
+
+
+async def answer(pieces, started=None, release=None, error=None):
+    for i, piece in enumerate(pieces):
+        if i == 1 and started is not None:
+            started.set()
+            await release.wait()
+        yield piece
+    if error is not None:
+        raise error
+
+
+def test_concurrent_requests_share_one_call(tmp_path):
+    async def main():
+        cache = LLMCache(directory=str(tmp_path))
+        started, release = asyncio.Event(), asyncio.Event()
+        calls = []
+
+        def make_pieces():
+            calls.append(1)
+            return answer(["a", "b", "c"], started, release)
+
+        first = asyncio.ensure_future(cache.get_or_compute("k", make_pieces))
+        await started.wait()
+        second = asyncio.ensure_future(cache.get_or_compute("k", make_pieces))
+        await asyncio.sleep(0)
+        release.set()
+        assert await first == await second == "abc"
+        assert len(calls) == 1
+        await asyncio.gather(*cache.writes)
+
+        reopened = LLMCache(directory=str(tmp_path))
+        assert await reopened.get("k") == "abc"
+        assert reopened.stats()["disk_hits"] == 1
+    asyncio.run(main())
+
+
+def test_cancelled_call_is_not_cached():
+    async def main():
+        cache = LLMCache()
+        started, release = asyncio.Event(), asyncio.Event()
+        request = asyncio.ensure_future(cache.get_or_compute("k", lambda: answer(["a", "b"], started, release)))
+        await started.wait()
+        cache.inflight["k"].task.cancel()
+        with pytest.raises(RuntimeError):
+            await request
+        assert await cache.get("k") is None
+        assert await cache.get_or_compute("k", lambda: answer(["a", "b"])) == "ab"
+    asyncio.run(main())
+
+
+def test_failed_call_is_not_joined_or_cached():
+    async def main():
+        cache = LLMCache()
+        with pytest.raises(ValueError):
+            await cache.get_or_compute("k", lambda: answer(["a"], error=ValueError()))
+        assert "k" not in cache.inflight
+        assert await cache.get_or_compute("k", lambda: answer(["b"])) == "b"
+        assert await cache.get("k") == "b"
+
+        class Failed:
+            done, error = True, ValueError()
+        cache.inflight["j"] = Failed()
+        assert await cache.get_or_compute("j", lambda: answer(["c"])) == "c"
+        assert "j" not in cache.inflight
+    asyncio.run(main())
+
+
+def test_disk_eviction(tmp_path):
+    async def main():
+        cache = LLMCache(max_entries=1, directory=str(tmp_path), max_disk_bytes=10)
+        for key in "abc":
+            await cache.put(key, key * 4)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["b.txt", "c.txt"]
+        assert await cache.get("a") is None
+        assert await cache.get("b") == "bbbb"
+    asyncio.run(main())
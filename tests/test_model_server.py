@@ -0,0 +1,17 @@
+import pytest
+
+from whisper_streamer.model_server import ModelServer, RemoteASR
+
+
+@pytest.mark.parametrize("authkey", [None, b""])
+def test_model_server_requires_authkey(tmp_path, authkey):
+    # the requests are pickled, the socket must not be opened for unauthenticated clients
+    address = str(tmp_path / "asr.sock")
+    with pytest.raises(ValueError):
+        ModelServer(address, asr=None, authkey=authkey)
+    assert not (tmp_path / "asr.sock").exists()
+
+
+def test_remote_asr_requires_authkey(tmp_path):
+    with pytest.raises(ValueError):
+        RemoteASR([str(tmp_path / "asr.sock")], authkey=None)
@@ -0,0 +1,57 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import SAMPLING_RATE, voiced
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("silero_vad")
+
+from whisper_streamer.offline import pack_regions, speech_regions
+from whisper_streamer.silero_vad_iterator import VADIterator
+from whisper_streamer.whisper_online import load_vad_model
+
+
+@pytest.fixture(scope="module")
+def vad_model():
+    return load_vad_model()
+
+
+def reference_regions(audio, vad_model):
+    # one model call and one update per 512 samples, like silero's own get_speech_timestamps loop
+    vac = VADIterator(copy.deepcopy(vad_model))
+    regions = []
+    beg = None
+    for i in range(0, len(audio) - 511, 512):
+        r = vac(torch.from_numpy(audio[i:i+512]))
+        if r and "start" in r:
+            beg = max(0, r["start"])
+        elif r:
+            regions.append((beg, min(len(audio), r["end"])))
+            beg = None
+    if beg is not None:
+        regions.append((beg, len(audio)))
+    return regions
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLING_RATE), dtype=np.float32)
+
+
+def test_regions_with_short_pauses(vad_model):
+    # pauses just above the minimum silence of 500 ms: the end of one region and the start of the next one fall
+    # into the same block of windows
+    rng = np.random.default_rng(1)
+    parts = [silence(1)]
+    for k in range(5):
+        parts += [voiced(rng.uniform(0.8, 1.5), seed=10 + k), silence(rng.uniform(0.5, 0.8))]
+    audio = np.concatenate(parts)
+    expected = reference_regions(audio, vad_model)
+    assert len(expected) >= 4
+    for block in (1, 3, 16, 64):
+        assert speech_regions(audio, copy.deepcopy(vad_model), block=block) == expected
+
+
+def test_pack_regions():
+    assert pack_regions([(0, 10), (15, 30), (40, 100), (110, 120)], 50) == [(0, 30), (40, 100), (110, 120)]
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from report_generator import FencedBlockParser, extract_fenced_block
+
+ANSWERS = {
+    "no fence": ("<thinking>plan it, maybe ```md``` </thinking>\n  Just the outline,\nno block.  ", "Just the outline,\nno block.", False),
+    "one-line fence": ("Here it is: ```the whole report``` and some chatter", "the whole report", True),
+    "one-line fence at the end": ("```the whole report```", "the whole report", True),
+    "language tag": ("<thinking>```x```</thinking>Sure!\n```markdown\n\n# Title\n- a `b` c\n\n```\nDone.", "# Title\n- a `b` c", True),
+    "fence line content": ("```  # Title\nbody\n```", "# Title\nbody", True),
+    "unterminated fence": ("```md\n# Title\n\nbody  \n``", "# Title\n\nbody  \n``", True),
+    "unterminated fence line": ("intro ```markdown", "", True),
+}
+
+
+def feed_split(text, rng):
+    parser = FencedBlockParser()
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, min(12, len(text)-1))))
+    out = [parser.feed(text[a:b]) for a, b in zip([0] + cuts, cuts + [len(text)])]
+    found = parser.found
+    return "".join(out) + parser.close(), found
+
+
+@pytest.mark.parametrize("name", ANSWERS)
+def test_extract_fenced_block(name):
+    text, content, found = ANSWERS[name]
+    assert extract_fenced_block(text) == (content, found)
+
+
+@pytest.mark.parametrize("name", ANSWERS)
+def test_random_deltas_match_whole_text(name):
+    text = ANSWERS[name][0]
+    rng = random.Random(name)
+    for _ in range(300):
+        assert feed_split(text, rng) == extract_fenced_block(text)
+
+
+def test_single_character_deltas():
+    for text, content, found in ANSWERS.values():
+        parser = FencedBlockParser()
+        out = "".join(parser.feed(c) for c in text)
+        assert (out + parser.close(), parser.found or not found) == (content, True)
@@ -0,0 +1,84 @@
+import copy
+import logging
+
+import numpy as np
+import pytest
+
+from conftest import SAMPLING_RATE, voiced
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("silero_vad")
+
+from whisper_streamer.silero_vad_iterator import FixedVADIterator
+from whisper_streamer.whisper_online import load_vad_model
+
+
+@pytest.fixture(scope="module")
+def vad_model():
+    return load_vad_model()
+
+
+@pytest.fixture(scope="module")
+def audio():
+    silence = np.zeros(SAMPLING_RATE, dtype=np.float32)
+    return np.concatenate([silence, voiced(2, seed=0), silence, voiced(1.5, seed=1), silence, voiced(1, seed=2), silence])
+
+
+def events(iterator, audio, packets):
+    out = []
+    i = 0
+    for n in packets:
+        if i >= len(audio):
+            break
+        out.append(iterator(audio[i:i+n]))
+        i += n
+    return out
+
+
+class CountingIterator(FixedVADIterator):
+    MIN_BATCH = 1
+
+    def __init__(self, *a, **kw):
+        self.batches = 0
+        super().__init__(*a, **kw)
+
+    def _batched_probs(self, windows):
+        probs = super()._batched_probs(windows)
+        self.batches += probs is not None
+        return probs
+
+
+@pytest.mark.parametrize("packet", [320, 640, 1365, 1486, 4096, 16000, "random"])
+def test_batched_windows_give_the_events_of_single_windows(vad_model, audio, packet):
+    rng = np.random.default_rng(0)
+    packets = rng.integers(1, 6000, len(audio)) if packet == "random" else [packet] * len(audio)
+    single = FixedVADIterator(copy.deepcopy(vad_model))
+    single.batched = False
+    batched = CountingIterator(copy.deepcopy(vad_model))
+    assert batched.batched
+
+    expected = events(single, audio, packets)
+    assert any(e and "start" in e for e in expected) and any(e and "end" in e for e in expected)
+    # the recurrent state and the context carry over between the calls, so the events of every call must be equal
+    assert events(batched, audio, packets) == expected
+    if packet != 320:
+        assert batched.batches > 0
+    np.testing.assert_allclose(batched.model._state.detach().numpy(), single.model._state.detach().numpy(), atol=1e-4)
+    np.testing.assert_array_equal(batched.model._context.detach().numpy(), single.model._context.detach().numpy())
+
+
+def test_model_without_silero_internals(caplog, monkeypatch):
+    class Model:
+        def reset_states(self):
+            pass
+
+        def __call__(self, x, sr):
+            return torch.tensor(float(x.abs().max() > 0.1))
+
+    monkeypatch.setattr(FixedVADIterator, "_warned", False)
+    with caplog.at_level(logging.WARNING, logger="whisper_streamer.silero_vad_iterator"):
+        iterator = FixedVADIterator(Model())
+    assert not iterator.batched
+    assert "one by one" in caplog.text
+    chunk = np.concatenate([np.zeros(4096), np.ones(4096)]).astype(np.float32)
+    assert iterator(chunk) == {"start": 4096 + 512 - 1600}
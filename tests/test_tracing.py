@@ -0,0 +1,37 @@
+import json
+import threading
+
+from whisper_streamer.tracing import ChromeTraceExporter, span
+
+
+def test_keeps_the_newest_events(tmp_path):
+    tracer = ChromeTraceExporter(str(tmp_path / "trace.json"), max_events=5)
+    for i in range(12):
+        with span(tracer, "step", i=i):
+            pass
+    tracer.write()
+    with open(tmp_path / "trace.json") as f:
+        events = [e for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+    assert [e["args"]["i"] for e in events] == list(range(7, 12))
+
+
+def test_write_while_spans_are_recorded(tmp_path):
+    tracer = ChromeTraceExporter(str(tmp_path / "trace.json"), max_events=1000)
+    done = threading.Event()
+
+    def record():
+        while not done.is_set():
+            with span(tracer, "step"):
+                pass
+
+    threads = [threading.Thread(target=record) for _ in range(2)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(50):
+            tracer.write()
+    finally:
+        done.set()
+        for t in threads:
+            t.join()
+    assert len(tracer.events) == 1000
@@ -0,0 +1,68 @@
+"""FasterWhisperASR.transcribe_batch must give every buffer exactly what transcribe() gives it alone."""
+import pytest
+
+from conftest import speechlike
+
+# the tiny random model never passes the compression ratio and log probability checks, without them every
+# buffer is decoded at temperature 0
+NO_FALLBACK = {"compression_ratio_threshold": None, "log_prob_threshold": None, "no_speech_threshold": None}
+
+
+@pytest.fixture(scope="module")
+def asr(tiny_whisper_dir):
+    from whisper_streamer.whisper_online import FasterWhisperASR, faster_whisper_internals
+    if not faster_whisper_internals():
+        pytest.skip("the installed faster-whisper has other internals, transcribe_batch transcribes one by one")
+    asr = FasterWhisperASR("en", model_dir=tiny_whisper_dir, device="cpu", compute_type="float32")
+    yield asr
+    asr.transcribe_kargs.clear()
+
+
+def result(asr, segments):
+    return [(s.start, s.end, s.text, s.seek, s.temperature, [(w.start, w.end, w.word) for w in s.words]) for s in segments]
+
+
+AUDIOS = [speechlike(3, seed=1), speechlike(6.5, seed=2), speechlike(1.2, seed=3), speechlike(4, seed=4)]
+PROMPTS = ["", "a prompt of a few words", "another prompt of quite a few more words than the first one", "x"]
+
+
+def test_batch_equals_transcribe(asr):
+    asr.transcribe_kargs.update(NO_FALLBACK)
+    batch = asr.transcribe_batch(AUDIOS, PROMPTS)
+    for audio, prompt, got in zip(AUDIOS, PROMPTS, batch):
+        assert result(asr, got) == result(asr, asr.transcribe(audio, init_prompt=prompt))
+
+
+def test_batched_window_is_the_first_window_of_transcribe(asr):
+    # also for the buffers that transcribe() goes on with, which transcribe_batch hands over to transcribe()
+    from faster_whisper.tokenizer import Tokenizer
+    from faster_whisper.transcribe import get_suppressed_tokens
+    asr.transcribe_kargs.update(NO_FALLBACK)
+    tokenizer = Tokenizer(asr.model.hf_tokenizer, False, task="transcribe", language="en")
+    prompt = asr.model.get_prompt(tokenizer, tokenizer.encode(" " + PROMPTS[1]))
+    rows = asr._transcribe_rows(AUDIOS, [None]*len(AUDIOS), [prompt]*len(AUDIOS), tokenizer,
+                                get_suppressed_tokens(tokenizer, [-1]))
+    for audio, (segments, finished) in zip(AUDIOS, rows):
+        full = asr.transcribe(audio, init_prompt=PROMPTS[1])
+        assert result(asr, segments) == result(asr, [s for s in full if s.seek == 0])
+        if finished:
+            assert all(s.seek == 0 for s in full)
+
+
+def test_row_does_not_depend_on_the_rest_of_the_batch(asr):
+    asr.transcribe_kargs.update(NO_FALLBACK)
+    alone = asr.transcribe_batch(AUDIOS[:1], PROMPTS[1:2])
+    together = asr.transcribe_batch(AUDIOS, PROMPTS[1:] + PROMPTS[:1])
+    assert result(asr, alone[0]) == result(asr, together[0])
+
+
+def test_temperature_fallback(asr):
+    import ctranslate2
+    asr.transcribe_kargs.clear()
+    audio = speechlike(1, seed=5)
+    # above temperature 0 the decoder samples, the beam search at 0 draws no random numbers
+    ctranslate2.set_random_seed(0)
+    [got] = asr.transcribe_batch([audio], [""])
+    assert got[0].temperature > 0
+    ctranslate2.set_random_seed(0)
+    assert result(asr, got) == result(asr, asr.transcribe(audio))
@@ -0,0 +1,73 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import SAMPLING_RATE, voiced
+
+pytest.importorskip("torch")
+pytest.importorskip("silero_vad")
+
+from whisper_streamer.whisper_online import ASRBase, VACOnlineASRProcessor, load_vad_model
+
+
+class WindowASR(ASRBase):
+    """A word for every 0.4 s of audio, a segment for every two words"""
+
+    sep = ""
+
+    def __init__(self):
+        self.transcribe_kargs = {}
+
+    def transcribe(self, audio, init_prompt=""):
+        words = [(round(i * 0.4, 2), round(i * 0.4 + 0.3, 2), f" w{i}") for i in range(len(audio) // 6400)]
+        return [words[i:i+2] for i in range(0, len(words), 2)]
+
+    def ts_words(self, segments):
+        return [w for s in segments for w in s]
+
+    def segments_end_ts(self, res):
+        return [s[-1][1] for s in res]
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLING_RATE), dtype=np.float32)
+
+
+@pytest.fixture
+def online():
+    return VACOnlineASRProcessor(0.5, WindowASR(), None, vad_model=copy.deepcopy(load_vad_model()))
+
+
+def test_backlog_with_an_end_and_a_start(online):
+    # the VAD sees speech from 0.44 s, an end at 1.48 s and a new start at 2.97 s
+    online.insert_audio_chunk(np.concatenate([silence(0.5), voiced(1.5, seed=1), silence(1.0), voiced(1.5, seed=21),
+                                              silence(0.3)]))
+    assert online.is_currently_final
+    beg, end, text = online.process_iter()
+    assert text and 0.44 <= beg and end <= 1.48
+
+    # the second utterance was held back until the final flush, and goes on now
+    assert not online.is_currently_final
+    assert online.online.buffer_time_offset == pytest.approx(47552 / SAMPLING_RATE)
+    online.insert_audio_chunk(silence(1.0))
+    assert online.is_currently_final
+    beg, end, text = online.process_iter()
+    assert text and beg >= 47552 / SAMPLING_RATE
+
+
+def test_several_utterances_in_one_chunk(online):
+    audio = np.concatenate([silence(0.5), voiced(1.5, seed=3), silence(1.0), voiced(1.5, seed=23), silence(1.0)])
+    expected = online.vac.__class__(copy.deepcopy(online.vac.model)).events(audio)
+    starts = [e["start"] / SAMPLING_RATE for e in expected if "start" in e]
+    ends = [e["end"] / SAMPLING_RATE for e in expected if "end" in e]
+    assert len(starts) == len(ends) == 3
+
+    online.insert_audio_chunk(audio)
+    flushed = []
+    while online.is_currently_final:
+        flushed.append(online.process_iter())
+    assert len(flushed) == 3
+    for (beg, end, text), start, stop in zip(flushed, starts, ends):
+        assert text == "" or (start <= beg and end <= stop)
+    assert not online.pending
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Journal:
+    """The committed text of one session, appended as JSON lines {"seq", "beg", "end", "text"} to its file.
+
+    append() only queues the line, TranscriptJournals writes and fsyncs the queued lines of all journals off the
+    event loop. A resumed session starts a new processor whose timestamps start at 0 again, they are shifted by
+    the end of the journal so that the timeline goes on.
+    """
+
+    def __init__(self, token, path, seq=0, offset=0.0):
+        self.token = token
+        self.path = path
+        self.seq = seq  # of the last record
+        self.offset = offset
+        self.pending = []
+        self.closed = False
+        self.superseded = asyncio.Event()  # set when another connection resumes this session
+
+    def append(self, beg, end, text):
+        """Numbers the committed text and queues it for writing. Returns the record."""
+        self.seq += 1
+        record = {"seq": self.seq, "beg": round(beg + self.offset, 3), "end": round(end + self.offset, 3), "text": text}
+        if not self.closed:
+            self.pending.append(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+
+def _write(path, lines):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _load(path):
+    """The records of a journal file. A torn last line of a crash is cut off, so that appending goes on after
+    the last complete record."""
+    records = []
+    good = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                records.pop()
+                break
+            good += len(line)
+        f.truncate(good)
+    return records
+
+
+class TranscriptJournals:
+    """Journals of the transcription sessions in directory, one file per session token.
+
+    A client that lost its connection reconnects with the token and the seq of the last record it received, and
+    gets the records after it from the journal, without transcribing anything again. The session's own stream
+    goes on with the next seq. Journals not written for max_age seconds are deleted at startup.
+
+    fsync_interval: seconds between writes of the queued records, a crash loses at most this much
+    """
+
+    def __init__(self, directory, fsync_interval=1.0, max_age=24 * 3600):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.active = {}  # token -> Journal of the connected session
+        # one thread, so the writes of a journal happen in the order they were queued
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".jsonl") and now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+
+    def _path(self, token):
+        return os.path.join(self.directory, token + ".jsonl")
+
+    async def open(self, token=None, seq=0):
+        """The journal of a new session, or of the session token if it exists, and the records after seq.
+        Returns (journal, [record, ...]). A connection that still holds the session is superseded."""
+        loop = asyncio.get_running_loop()
+        records = []
+        if token and TOKEN_RE.match(token) and (token in self.active or os.path.exists(self._path(token))):
+            previous = self.active.get(token)
+            if previous is not None:
+                previous.superseded.set()
+                await self.close(previous)
+            if os.path.exists(self._path(token)):
+                records = await loop.run_in_executor(self.executor, _load, self._path(token))
+        else:
+            token = secrets.token_urlsafe(16)
+            seq = 0
+        last = records[-1] if records else {"seq": 0, "end": 0.0}
+        # the client may have received records that a crash lost before they were written
+        journal = Journal(token, self._path(token), seq=max(last["seq"], seq), offset=last["end"])
+        self.active[token] = journal
+        return journal, [r for r in records if r["seq"] > seq]
+
+    async def flush(self, journal):
+        if journal.pending:
+            lines, journal.pending = journal.pending, []
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, _write, journal.path, lines)
+            except OSError as e:
+                print(f"Could not write the journal {journal.token}: {e}")
+
+    async def close(self, journal):
+        """Writes the rest of the journal. Later records of the session are not written anymore."""
+        journal.closed = True
+        if self.active.get(journal.token) is journal:
+            del self.active[journal.token]
+        await self.flush(journal)
+
+    async def run(self):
+        """Writes the queued records every fsync_interval. Runs until cancelled."""
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            for journal in list(self.active.values()):
+                await self.flush(journal)
@@ -0,0 +1,107 @@
+import numpy as np
+
+
+class AudioBuffer:
+    """Growable buffer of audio samples with cheap appends at the end and cheap trimming at the front.
+
+    The samples live in one preallocated array between two cursors. append() writes behind the end cursor and
+    trim_front() only moves the start cursor. When the array is full, the live samples are moved to its beginning,
+    or to a twice as large array if more than half of it is in use. Both are amortized O(1) per sample, unlike
+    np.append and slicing, which copy the whole buffer on every chunk.
+
+    view() and indexing return zero-copy numpy views. They are valid until the next append(), which may move the data.
+
+    frame_shape: shape of one item. () for audio samples, e.g. (80,) for frames of a log-mel spectrogram.
+    """
+
+    def __init__(self, capacity=16000, dtype=np.float32, frame_shape=()):
+        self.dtype = dtype
+        self.frame_shape = tuple(frame_shape)
+        self._data = np.empty((max(1, capacity),) + self.frame_shape, dtype=dtype)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.view()
+        if dtype is not None and dtype != a.dtype:
+            return a.astype(dtype)
+        return a.copy() if copy else a
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def view(self):
+        """Contiguous array of all the samples in the buffer, without copying"""
+        return self._data[self._start:self._end]
+
+    def append(self, audio):
+        audio = np.asarray(audio, dtype=self.dtype).reshape((-1,) + self.frame_shape)
+        n = len(audio)
+        if self._end + n > len(self._data):
+            live = len(self)
+            if live + n > len(self._data) // 2:
+                data = np.empty((max(2*len(self._data), 2*(live+n)),) + self.frame_shape, dtype=self.dtype)
+            else:
+                # more than half of the array is trimmed space, reuse it
+                data = self._data
+            data[:live] = self._data[self._start:self._end]
+            self._data = data
+            self._start = 0
+            self._end = live
+        self._data[self._end:self._end+n] = audio
+        self._end += n
+
+    def trim_front(self, n):
+        """Drops the first n samples"""
+        self._start += min(max(0, int(n)), len(self))
+
+    def trim_back(self, n):
+        """Drops the last n samples"""
+        self._end -= min(max(0, int(n)), len(self))
+
+    def keep_last(self, n):
+        """Drops all but the last n samples"""
+        self.trim_front(len(self) - n)
+
+    def clear(self):
+        self._start = self._end = 0
+
+
+if __name__ == "__main__":
+    # microbenchmark: a stream of 4096-sample browser packets into a buffer that is trimmed every
+    # 15 seconds, the same pattern as in OnlineASRProcessor, with np.append + slicing and with AudioBuffer
+    import time
+
+    SAMPLING_RATE = 16000
+    packet = np.random.default_rng(0).standard_normal(4096).astype(np.float32)
+    packets = 60*60*SAMPLING_RATE // len(packet)  # one hour of audio
+    trim_at = 15*SAMPLING_RATE
+
+    t = time.perf_counter()
+    a = np.array([], dtype=np.float32)
+    for _ in range(packets):
+        a = np.append(a, packet)
+        if len(a) > trim_at:
+            a = a[len(a)-5*SAMPLING_RATE:]
+    t_append = time.perf_counter() - t
+
+    t = time.perf_counter()
+    b = AudioBuffer()
+    for _ in range(packets):
+        b.append(packet)
+        if len(b) > trim_at:
+            b.keep_last(5*SAMPLING_RATE)
+    t_buffer = time.perf_counter() - t
+
+    assert np.array_equal(a, b.view())
+    print(f"{packets} packets of {len(packet)} samples (1 hour of 16 kHz audio), trimmed to 5 s above 15 s")
+    print(f"np.append + slicing: {t_append*1000:8.1f} ms  ({t_append/packets*1e6:.2f} us per packet)")
+    print(f"AudioBuffer:         {t_buffer*1000:8.1f} ms  ({t_buffer/packets*1e6:.2f} us per packet)")
+    print(f"speedup: {t_append/t_buffer:.1f}x, final capacity {b.capacity} samples")
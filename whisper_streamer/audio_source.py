@@ -0,0 +1,204 @@
+"""Audio files as memory-mapped 16 kHz mono float32 samples.
+
+Whisper and the VAD read the audio as 16 kHz mono float32. A WAV file in exactly that format is mapped in place.
+Any other file (int16 PCM, other sample rates, stereo, FLAC, MP3, ...) is decoded once, block by block, into a
+raw float32 sidecar file in a cache directory, which is then mapped. Either way the samples are a plain numpy
+array over the mapping: slicing it is a zero-copy view, and the operating system pages the audio in as it is read
+and drops it under memory pressure. A multi-hour recording therefore costs only the windows in use, not the whole
+file decoded in memory.
+
+    source = audio_sources.open("lecture.mp3")
+    chunk = source.window(120.0, 121.5)  # seconds [beg, end), a view
+
+The sidecars are keyed by the path, size and modification time of the file, and the least recently used ones are
+deleted when they take more than max_cache_bytes.
+"""
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "whisper_streamer_audio")
+
+
+def wav_float32_data(path):
+    """(offset, bytes) of the samples if path is a 16 kHz mono float32 WAV file, that can be mapped as it is,
+    otherwise None"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) != b"RIFF":
+                return None
+            f.read(4)
+            if f.read(4) != b"WAVE":
+                return None
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    data = f.read(size)
+                    tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", data[:16])
+                    if tag == WAVE_FORMAT_EXTENSIBLE and len(data) >= 26:
+                        tag = struct.unpack("<H", data[24:26])[0]  # first bytes of the subformat GUID
+                    fmt = (tag, channels, rate, bits)
+                elif chunk_id == b"data":
+                    if fmt != (WAVE_FORMAT_IEEE_FLOAT, 1, SAMPLING_RATE, 32):
+                        return None
+                    offset = f.tell()
+                    # streamed WAV files may have a wrong size here, the data goes to the end of the file
+                    size = min(size, os.path.getsize(path) - offset)
+                    return offset, size - size % 4
+                else:
+                    f.seek(size + size % 2, os.SEEK_CUR)  # chunks are padded to an even size
+    except (OSError, struct.error):
+        return None
+
+
+def map_float32(path, offset=0, size=None):
+    """The float32 samples of the file as a writable (copy on write) array over a memory mapping"""
+    if size is None:
+        size = os.path.getsize(path) - offset
+    if size <= 0:
+        return np.zeros(0, dtype=np.float32)
+    with open(path, "rb") as f:
+        # the array keeps the mapping open, the file itself can be closed
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return np.frombuffer(mapped, dtype=np.float32, count=size // 4, offset=offset)
+
+
+def decode_to_float32(path, out, blocksize=2**20):
+    """Writes the audio of path as raw 16 kHz mono float32 to the binary file out, one block at a time. Formats
+    that libsndfile can not read are decoded with librosa, whole."""
+    import soundfile as sf
+    try:
+        info = sf.info(path)
+    except RuntimeError:
+        import librosa  # audioread, e.g. for m4a
+        a, _ = librosa.load(path, sr=SAMPLING_RATE, dtype=np.float32)
+        out.write(a.tobytes())
+        return
+    resampler = None
+    if info.samplerate != SAMPLING_RATE:
+        import soxr
+        # the same resampler and quality as librosa.load, but streaming
+        resampler = soxr.ResampleStream(info.samplerate, SAMPLING_RATE, 1, dtype="float32", quality="HQ")
+    for block in sf.blocks(path, blocksize=blocksize, dtype="float32", always_2d=True):
+        mono = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0]
+        if resampler is not None:
+            mono = resampler.resample_chunk(mono)
+        out.write(np.ascontiguousarray(mono, dtype=np.float32).tobytes())
+    if resampler is not None:
+        out.write(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True).tobytes())
+        # the length of librosa.resample
+        length = 4 * math.ceil(info.frames * SAMPLING_RATE / info.samplerate)
+        out.truncate(length)
+        out.seek(length)
+
+
+class AudioSource:
+    """The samples of one audio file, 16 kHz mono float32, memory-mapped"""
+
+    def __init__(self, path, samples):
+        self.path = path
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / SAMPLING_RATE
+
+    def window(self, beg, end):
+        """The samples of [beg, end) seconds, a view"""
+        return self.samples[int(beg*SAMPLING_RATE):int(end*SAMPLING_RATE)]
+
+
+class AudioSources:
+    """Opens audio files as AudioSource.
+
+    directory: where the decoded sidecars of the files that can not be mapped directly are kept
+    max_cache_bytes: the least recently used sidecars are deleted beyond this
+    max_open: number of recently opened sources kept, so that opening the same file again is free
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_cache_bytes=4 * 2**30, max_open=16):
+        self.directory = directory
+        self.max_cache_bytes = max_cache_bytes
+        self.max_open = max_open
+        self.opened = OrderedDict()
+
+    def open(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        source = self.opened.get(key)
+        if source is None:
+            data = wav_float32_data(path)
+            if data is not None:
+                samples = map_float32(path, *data)
+            else:
+                samples = map_float32(self._sidecar(path, key))
+            source = AudioSource(path, samples)
+            self.opened[key] = source
+        self.opened.move_to_end(key)
+        while len(self.opened) > self.max_open:
+            self.opened.popitem(last=False)
+        return source
+
+    def _sidecar(self, path, key):
+        sidecar = os.path.join(self.directory, hashlib.sha256(repr(key).encode("utf-8")).hexdigest() + ".f32")
+        if os.path.exists(sidecar):
+            os.utime(sidecar)
+            return sidecar
+        os.makedirs(self.directory, exist_ok=True)
+        logger.info(f"decoding {path} to {sidecar}")
+        # unique, several processes may decode the same file at once
+        tmp = f"{sidecar}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as out:
+                decode_to_float32(path, out)
+            os.replace(tmp, sidecar)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._evict(keep=sidecar)
+        return sidecar
+
+    def _evict(self, keep):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".f32"):
+                p = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(p)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, p, stat.st_size))
+        total = sum(size for _, _, size in files)
+        for _, p, size in sorted(files):
+            if total <= self.max_cache_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                # a source that still maps it keeps its samples until it is closed
+                os.remove(p)
+            except OSError:
+                continue
+            total -= size
+
+
+audio_sources = AudioSources()
@@ -0,0 +1,79 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """Collects the transcribe() calls of many streaming sessions and runs them as one batch.
+
+    It is a drop-in replacement of the ASR object given to OnlineASRProcessor: transcribe() blocks the calling
+    thread until the batch that contains its request has been transcribed by asr.transcribe_batch, and everything
+    else (ts_words, segments_end_ts, sep, ...) is forwarded to the wrapped asr. The word timestamps are therefore
+    in exactly the same format as without batching.
+
+    Every session must call process_iter from its own thread (e.g. an inference executor with at least as many
+    workers as sessions), otherwise there is nothing to batch.
+
+    asr: the shared ASR backend
+    max_batch_size: maximum number of requests transcribed at once
+    batch_window: seconds to wait for more requests after the first one arrives
+    """
+
+    def __init__(self, asr, max_batch_size=8, batch_window=0.03):
+        self.asr = asr
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+
+        self._pending = []  # [(audio, init_prompt, features, future), ...]
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        # only called for attributes that are not found on the scheduler itself
+        return getattr(self.asr, name)
+
+    def transcribe(self, audio, init_prompt=""):
+        return self._submit(audio, init_prompt, None)
+
+    def transcribe_features(self, features, audio, init_prompt=""):
+        return self._submit(audio, init_prompt, features)
+
+    def _submit(self, audio, init_prompt, features):
+        future = Future()
+        with self._cond:
+            self._pending.append((audio, init_prompt, features, future))
+            self._cond.notify()
+        return future.result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.batch_window
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            t = time.time()
+            try:
+                results = self.asr.transcribe_batch([a for a, _, _, _ in batch], [p for _, p, _, _ in batch],
+                                                    features=[f for _, _, f, _ in batch])
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            logger.debug(f"transcribed a batch of {len(batch)} in {time.time()-t:.2f} seconds")
+            for (_, _, _, future), res in zip(batch, results):
+                future.set_result(res)
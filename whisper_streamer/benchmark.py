@@ -0,0 +1,280 @@
+"""Streaming ASR benchmark.
+
+Replays every WAV file of a directory through OnlineASRProcessor and/or VACOnlineASRProcessor, in the
+computation unaware mode (the audio clock, as if decoding took no time) and/or in real time (the audio arrives as
+fast as it would from a microphone, decoding takes what it takes), and writes the metrics of every run to JSON:
+
+- first_word_latency: seconds from the start of the first committed text (Whisper's timestamp) to its emission
+- commit_latency: percentiles over the commits of the seconds from the end of the committed text to its emission
+- rtf: seconds spent in insert_audio_chunk/process_iter/finish per second of audio
+- cpu_time: CPU seconds of the whole process (all threads) during the run
+- peak_rss_mb: peak resident memory of the process during the run (sampled, Linux)
+- wer: word error rate against <name>.txt next to <name>.wav, if it exists
+
+The model options are the ones of whisper_online.py, e.g. on CPU with a small model:
+
+    python -m whisper_streamer.benchmark samples/ --model tiny.en --lan en --device cpu --out tiny.json
+"""
+import copy
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+from whisper_streamer.whisper_online import (
+    OnlineASRProcessor, VACOnlineASRProcessor, add_shared_args, asr_factory, create_tokenizer, load_audio,
+    load_vad_model, set_logging,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+PROCESSORS = ("online", "vac")
+MODES = ("comp_unaware", "realtime")
+
+
+class PeakRSS:
+    """Samples the resident memory of the process in a thread, to get the peak of one run"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # not Linux: the peak of the whole process so far, in KB on Linux and in bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def normalize_words(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """(substitutions + deletions + insertions) / reference words, on lowercased words without punctuation"""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if not ref:
+        return float(len(hyp) > 0)
+    # Levenshtein distance over words, one row at a time
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j-1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def create_processor(kind, asr, args, vad_model, logfile):
+    tokenizer = create_tokenizer(args.lan) if args.buffer_trimming == "sentence" else None
+    trimming = (args.buffer_trimming, args.buffer_trimming_sec)
+    if kind == "vac":
+        return VACOnlineASRProcessor(args.min_chunk_size, asr, tokenizer, logfile=logfile, buffer_trimming=trimming,
+                                     vad_model=copy.deepcopy(vad_model))
+    return OnlineASRProcessor(asr, tokenizer, logfile=logfile, buffer_trimming=trimming)
+
+
+def replay(online, audio, chunk, realtime):
+    """Feeds audio to online in chunks of `chunk` seconds. Returns [(emission time, beg, end, text), ...] and the
+    seconds spent in the processor. The emission time is on the audio clock in the computation unaware mode and
+    on the wall clock in real time."""
+    duration = len(audio) / SAMPLING_RATE
+    commits = []
+    busy = 0.0
+
+    def step(fn, *a):
+        nonlocal busy
+        t = time.perf_counter()
+        res = fn(*a)
+        busy += time.perf_counter() - t
+        return res
+
+    start = time.perf_counter()
+    beg = end = 0.0
+    while end < duration:
+        if realtime:
+            # wait for the next chunk to be "recorded", or take everything recorded while decoding
+            now = time.perf_counter() - start
+            if now < end + chunk:
+                time.sleep(end + chunk - now)
+            end = min(duration, time.perf_counter() - start)
+        else:
+            end = min(duration, end + chunk)
+        step(online.insert_audio_chunk, audio[int(beg*SAMPLING_RATE):int(end*SAMPLING_RATE)])
+        beg = end
+        try:
+            o = step(online.process_iter)
+        except AssertionError as e:
+            logger.error(f"assertion error: {e}")
+            continue
+        if o[0] is not None:
+            commits.append((time.perf_counter() - start if realtime else end, o[0], o[1], o[2]))
+
+    o = step(online.finish)
+    if o[0] is not None:
+        commits.append((time.perf_counter() - start if realtime else duration, o[0], o[1], o[2]))
+    return commits, busy
+
+
+def run_file(path, kind, mode, asr, args, vad_model, logfile):
+    audio = load_audio(path)
+    duration = len(audio) / SAMPLING_RATE
+    online = create_processor(kind, asr, args, vad_model, logfile)
+    chunk = args.vac_chunk_size if kind == "vac" else args.min_chunk_size
+
+    cpu = time.process_time()
+    with PeakRSS() as rss:
+        commits, busy = replay(online, audio, chunk, realtime=(mode == "realtime"))
+    cpu = time.process_time() - cpu
+
+    hypothesis = asr.sep.join(text for _, _, _, text in commits)
+    result = {
+        "file": os.path.basename(path),
+        "processor": kind,
+        "mode": mode,
+        "duration": duration,
+        "commits": len(commits),
+        "first_word_latency": commits[0][0] - commits[0][1] if commits else None,
+        "commit_latency": percentiles([emitted - end for emitted, _, end, _ in commits]),
+        "rtf": busy / duration if duration else None,
+        "cpu_time": cpu,
+        "peak_rss_mb": rss.peak / 2**20,
+        "wer": None,
+        "hypothesis": hypothesis,
+    }
+    reference = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(reference):
+        with open(reference, encoding="utf-8") as f:
+            result["wer"] = word_error_rate(f.read(), hypothesis)
+    return result
+
+
+def summarize(results):
+    """Averages of the runs of every processor and mode, the WER weighted by file duration"""
+    summary = {}
+    for kind in PROCESSORS:
+        for mode in MODES:
+            runs = [r for r in results if r["processor"] == kind and r["mode"] == mode]
+            if not runs:
+                continue
+            duration = sum(r["duration"] for r in runs)
+            first = [r["first_word_latency"] for r in runs if r["first_word_latency"] is not None]
+            p50 = [r["commit_latency"]["p50"] for r in runs if r["commit_latency"]]
+            p90 = [r["commit_latency"]["p90"] for r in runs if r["commit_latency"]]
+            scored = [r for r in runs if r["wer"] is not None]
+            summary[f"{kind}/{mode}"] = {
+                "files": len(runs),
+                "duration": duration,
+                "first_word_latency": float(np.mean(first)) if first else None,
+                "commit_latency_p50": float(np.mean(p50)) if p50 else None,
+                "commit_latency_p90": float(np.mean(p90)) if p90 else None,
+                "rtf": sum(r["rtf"] * r["duration"] for r in runs) / duration if duration else None,
+                "cpu_time": sum(r["cpu_time"] for r in runs),
+                "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+                "wer": (sum(r["wer"] * r["duration"] for r in scored) / sum(r["duration"] for r in scored)
+                        if scored else None),
+            }
+    return summary
+
+
+def config(args):
+    keys = ["backend", "model", "model_dir", "lan", "task", "device", "compute_type", "cpu_threads", "num_workers",
+            "min_chunk_size", "vac_chunk_size", "buffer_trimming", "buffer_trimming_sec", "vad"]
+    conf = {k: getattr(args, k, None) for k in keys}
+    conf.update(python=platform.python_version(), machine=platform.machine(), processor=platform.processor(),
+                cpus=os.cpu_count(), time=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    return conf
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark streaming ASR on a directory of 16 kHz WAV files.")
+    parser.add_argument('audio_dir', type=str, help="Directory with *.wav files and optionally reference transcripts <name>.txt")
+    add_shared_args(parser)
+    parser.add_argument('--processors', type=str, default="online,vac", help=f"Comma separated: {', '.join(PROCESSORS)}")
+    parser.add_argument('--modes', type=str, default="comp_unaware,realtime", help=f"Comma separated: {', '.join(MODES)}")
+    parser.add_argument('--out', type=str, default="benchmark.json", help="JSON file for the results")
+    parser.set_defaults(log_level="WARNING")
+    args = parser.parse_args()
+    set_logging(args, logger)
+
+    processors = [p for p in args.processors.split(",") if p]
+    modes = [m for m in args.modes.split(",") if m]
+    for name, values, allowed in (("processor", processors, PROCESSORS), ("mode", modes, MODES)):
+        for v in values:
+            if v not in allowed:
+                parser.error(f"unknown {name} {v}, choose from {', '.join(allowed)}")
+
+    files = sorted(os.path.join(args.audio_dir, f) for f in os.listdir(args.audio_dir) if f.lower().endswith(".wav"))
+    if not files:
+        parser.error(f"no .wav files in {args.audio_dir}")
+
+    args.vac = False  # the processors are created here, asr_factory only loads the model
+    asr, _ = asr_factory(args, logfile=open(os.devnull, "w"))
+    vad_model = load_vad_model() if "vac" in processors else None
+    # the first transcription is much slower than the others
+    asr.transcribe(load_audio(files[0])[:SAMPLING_RATE])
+
+    logfile = open(os.devnull, "w")
+    results = []
+    for path in files:
+        for kind in processors:
+            for mode in modes:
+                r = run_file(path, kind, mode, asr, args, vad_model, logfile)
+                results.append(r)
+                latency = r["commit_latency"]["p50"] if r["commit_latency"] else float("nan")
+                wer = f", WER {r['wer']:.3f}" if r["wer"] is not None else ""
+                print(f"{r['file']} {kind}/{mode}: RTF {r['rtf']:.3f}, commit latency p50 {latency:.2f} s, "
+                      f"CPU {r['cpu_time']:.1f} s, peak RSS {r['peak_rss_mb']:.0f} MB{wer}", flush=True)
+
+    report = {"config": config(args), "summary": summarize(results), "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
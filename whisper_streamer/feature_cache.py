@@ -0,0 +1,110 @@
+import numpy as np
+
+from whisper_streamer.audio_buffer import AudioBuffer
+
+
+class LogMelCache:
+    """Log-mel spectrogram of the streaming audio buffer, computed incrementally.
+
+    It produces the same features as faster-whisper's FeatureExtractor on the whole buffer, but keeps the frames
+    between calls and only computes the ones that changed:
+
+    - frame i is centered at sample i*hop_length and reads n_fft samples around it. After the buffer grows, only
+      the last frames, whose window reached the end of the old audio (the zero padding and the reflection),
+      are computed again, together with the frames of the new audio.
+    - after trim_front() by a multiple of hop_length, the frames are only shifted. The first two frames are
+      computed again, because their window reaches the reflection padding at the start of the buffer.
+      A trim that is not aligned to hop_length drops the cache.
+
+    The frames are kept as log10 of the mel spectrogram. The clamping to 8 below the maximum and the scaling
+    depend on the whole buffer, and are cheap, so they are applied in features().
+
+    feature_extractor: faster_whisper.feature_extractor.FeatureExtractor of the model
+    """
+
+    def __init__(self, feature_extractor):
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        self.mel_filters = feature_extractor.mel_filters
+        self.window = np.hanning(self.n_fft + 1)[:-1].astype("float32")
+
+        self.frames = AudioBuffer(3000, frame_shape=(self.mel_filters.shape[0],))
+        self.n_samples = 0  # length of the audio that the frames were computed for
+        self.head_dirty = False
+
+    def __len__(self):
+        return len(self.frames)
+
+    def clear(self):
+        self.frames.clear()
+        self.n_samples = 0
+        self.head_dirty = False
+
+    def trim_front(self, n):
+        """Drops the frames of the first n samples. Call it together with trimming the audio buffer."""
+        n = min(max(0, int(n)), self.n_samples)
+        if n % self.hop_length:
+            self.clear()
+            return
+        self.frames.trim_front(n // self.hop_length)
+        self.n_samples -= n
+        self.head_dirty = True
+
+    def update(self, audio):
+        """Brings the frames up to date with audio, the whole current buffer. It must be the audio of the
+        previous update(), without the trimmed samples, followed by the newly appended ones.
+        """
+        audio = np.asarray(audio, dtype=np.float32)
+        # the same padding as FeatureExtractor(audio, padding=160)
+        x = np.concatenate((audio, np.zeros(self.hop_length, dtype=np.float32)))
+        total = len(x) // self.hop_length
+
+        if len(audio) < self.n_fft or self.n_samples < self.n_fft:
+            self.frames.clear()
+            start = 0
+        else:
+            start = self._clean_frames(self.n_samples)
+            self.frames.trim_back(len(self.frames) - start)
+            if self.head_dirty:
+                head = min(2, start)
+                self.frames.view()[:head] = self._log_mel(x, 0, head)
+        self.frames.append(self._log_mel(x, start, total))
+        self.n_samples = len(audio)
+        self.head_dirty = False
+
+    def features(self):
+        """The log-mel spectrogram of the buffer, shape (n_mels, frames), as FeatureExtractor returns it"""
+        log_spec = self.frames.view()
+        log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        return np.ascontiguousarray(log_spec.T)
+
+    def _clean_frames(self, n_samples):
+        # frames whose window ends inside the audio, i.e. does not depend on what comes after it
+        if n_samples < self.n_fft // 2:
+            return 0
+        return (n_samples - self.n_fft // 2) // self.hop_length + 1
+
+    def _log_mel(self, x, a, b):
+        # frames a..b-1 of the zero padded audio x, with the reflection padding of a centered STFT
+        if b <= a:
+            return np.empty((0, self.mel_filters.shape[0]), dtype=np.float32)
+        pad = self.n_fft // 2
+        lo = a*self.hop_length - pad
+        hi = (b-1)*self.hop_length + pad
+        if len(x) <= pad:
+            segment = np.pad(x, pad, mode="reflect")[lo+pad:hi+pad]
+        else:
+            left = x[1:-lo+1][::-1] if lo < 0 else x[:0]
+            right = x[len(x)-1-(hi-len(x)):len(x)-1][::-1] if hi > len(x) else x[:0]
+            segment = np.concatenate((left, x[max(0, lo):min(len(x), hi)], right))
+
+        windows = np.lib.stride_tricks.as_strided(
+            segment,
+            (b - a, self.n_fft),
+            (self.hop_length * segment.strides[0], segment.strides[0]),
+        )
+        stft = np.fft.rfft(windows * self.window, n=self.n_fft, axis=-1).astype("complex64")
+        magnitudes = np.abs(stft) ** 2
+        mel_spec = magnitudes @ self.mel_filters.T
+        return np.log10(np.clip(mel_spec, a_min=1e-10, a_max=None))
@@ -0,0 +1,337 @@
+"""Whisper in a separate model server process, shared by the web workers of the same host.
+
+Every web worker that loads its own model multiplies RAM and VRAM. Instead, one or more model server processes own
+the models:
+
+    MODEL_SERVER_AUTHKEY=<secret> python -m whisper_streamer.model_server --socket /run/pensieve/asr.sock --model distil-large-v3 --device cuda
+
+and the web workers use RemoteASR, a drop-in replacement of the ASR object given to OnlineASRProcessor:
+
+    asr = RemoteASR(["/run/pensieve/asr.sock"], authkey=b"<secret>")
+    online = OnlineASRProcessor(asr)
+
+The audio does not go through the control channel. Every connection (channel) has a shared memory ring buffer created
+by the client: the client writes the audio buffer of a request into it and sends only the offset, the length and the
+prompt over a Unix socket. The server transcribes a numpy view of the shared memory, without copying or pickling the
+samples, and answers with the word timestamps and segment ends, i.e. what ts_words() and segments_end_ts() return.
+
+A channel carries one request at a time, RemoteASR opens one per thread that transcribes at once, and the server
+serves each channel in its own thread. With --batch_window_ms, the requests of all channels, i.e. of all web
+workers, are decoded in batches (BatchScheduler).
+
+The requests are pickled, and unpickling can run arbitrary code, so the server only accepts clients that prove they
+know its authkey (the HMAC challenge of multiprocessing.connection, before anything is unpickled). There is no
+default authkey, the server does not start without one.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from whisper_streamer.tracing import span
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+# what transcribe() of RemoteASR returns: the results of the server's ts_words() and segments_end_ts()
+RemoteResult = namedtuple("RemoteResult", ["words", "ends"])
+
+
+class ModelServerError(RuntimeError):
+    """The model server failed the request, or the connection to it broke"""
+
+
+class AudioRing:
+    """float32 samples in shared memory. Each write goes right after the previous one, and starts over at the
+    beginning when the rest of the buffer is too short, so the audio of a request is always contiguous."""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.samples = np.ndarray((shm.size // 4,), dtype=np.float32, buffer=shm.buf)
+        self.head = 0
+
+    @property
+    def capacity(self):
+        return len(self.samples)
+
+    def write(self, audio):
+        """Copies audio into the ring. Returns its offset, or None if it is longer than the ring."""
+        n = len(audio)
+        if n > self.capacity:
+            return None
+        if self.head + n > self.capacity:
+            self.head = 0
+        offset = self.head
+        self.samples[offset:offset + n] = audio
+        self.head += n
+        return offset
+
+    def read(self, offset, n):
+        """The samples written at offset, a view"""
+        return self.samples[offset:offset + n]
+
+    def close(self):
+        # the array must not outlive the buffer it points to
+        self.samples = None
+        self.shm.close()
+
+
+def attach_shared_memory(name):
+    """Attaches to the shared memory created by a client, which also removes it. Without this, the resource tracker
+    of the server would remove it when the server exits, and warn about a leak."""
+    try:
+        return SharedMemory(name, track=False)  # Python 3.13
+    except TypeError:
+        shm = SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Channel:
+    def __init__(self, address, authkey, ring_samples):
+        self.address = address
+        self.conn = Client(address, family="AF_UNIX", authkey=authkey)
+        self.ring = AudioRing(SharedMemory(create=True, size=4 * ring_samples))
+        try:
+            self.info = self.call(("attach", self.ring.shm.name))[1]
+        except Exception:
+            self.close()
+            raise
+
+    def call(self, request, payload=None):
+        self.conn.send(request)
+        if payload is not None:
+            self.conn.send_bytes(payload)
+        response = self.conn.recv()
+        if response[0] == "error":
+            raise ModelServerError(response[1])
+        return response
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            self.ring.close()
+            self.ring.shm.unlink()
+
+
+class RemoteASR:
+    """ASR backend that transcribes on model servers. It can be used wherever an ASR object is expected, e.g. by
+    OnlineASRProcessor and SessionManager, and is safe to call from many threads.
+
+    Every thread that calls transcribe() at the same time gets its own channel, on the server with the fewest
+    requests in flight. Idle channels are kept for the next requests.
+
+    addresses: Unix socket paths of the model servers
+    authkey: bytes, the authkey of the servers
+    ring_seconds: audio capacity of each channel's shared memory. Longer buffers are sent over the socket instead.
+    """
+
+    tracer = None  # whisper_streamer.tracing.Tracer, or None
+
+    def __init__(self, addresses, authkey, ring_seconds=60):
+        if not authkey:
+            raise ValueError("RemoteASR needs the authkey of the model servers")
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.ring_samples = int(ring_seconds * SAMPLING_RATE)
+        self._lock = threading.Lock()
+        self._idle = {address: [] for address in self.addresses}
+        self._busy = {address: 0 for address in self.addresses}
+
+        # opens a channel to every server, so that an unreachable one fails right away
+        for address in self.addresses:
+            self._release(self._acquire(address))
+        self.info = self._idle[self.addresses[0]][0].info
+        self.sep = self.info["sep"]
+        self.num_workers = sum(self._idle[address][0].info["num_workers"] for address in self.addresses)
+
+    def _acquire(self, address=None):
+        with self._lock:
+            if address is None:
+                address = min(self.addresses, key=lambda a: self._busy[a])
+            self._busy[address] += 1
+            channel = self._idle[address].pop() if self._idle[address] else None
+        if channel is None:
+            try:
+                channel = _Channel(address, self.authkey, self.ring_samples)
+            except Exception:
+                with self._lock:
+                    self._busy[address] -= 1
+                raise
+        return channel
+
+    def _release(self, channel, broken=False):
+        with self._lock:
+            self._busy[channel.address] -= 1
+            if not broken:
+                self._idle[channel.address].append(channel)
+        if broken:
+            channel.close()
+
+    def feature_cache(self):
+        # the features are computed on the server
+        return None
+
+    def transcribe(self, audio, init_prompt=""):
+        audio = np.asarray(audio, dtype=np.float32)
+        channel = self._acquire()
+        broken = False
+        try:
+            with span(self.tracer, "asr.remote", audio_seconds=len(audio)/SAMPLING_RATE, server=channel.address):
+                offset = channel.ring.write(audio)
+                if offset is None:
+                    response = channel.call(("transcribe_bytes", init_prompt), audio.tobytes())
+                else:
+                    response = channel.call(("transcribe", offset, len(audio), init_prompt))
+        except ModelServerError:
+            raise
+        except (OSError, EOFError) as e:
+            broken = True
+            raise ModelServerError(f"connection to the model server {channel.address} failed: {e!r}") from e
+        finally:
+            self._release(channel, broken)
+        _, words, ends = response
+        return RemoteResult(words, ends)
+
+    def ts_words(self, res):
+        return res.words
+
+    def segments_end_ts(self, res):
+        return res.ends
+
+    def close(self):
+        with self._lock:
+            channels = [c for idle in self._idle.values() for c in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for channel in channels:
+            channel.close()
+
+
+class ModelServer:
+    """Serves transcriptions of asr to RemoteASR clients on a Unix socket, one thread per channel.
+
+    asr: the loaded ASR backend
+    session_asr: what the requests are transcribed with, asr or a BatchScheduler of it
+    authkey: bytes that the clients must know, required because the requests are pickled
+    """
+
+    def __init__(self, address, asr, session_asr=None, authkey=None):
+        if not authkey:
+            raise ValueError("the model server needs an authkey: its requests are pickled, and anyone who can open "
+                             "the socket could run code in it by unpickling")
+        self.address = address
+        self.asr = asr
+        self.session_asr = session_asr or asr
+        self.listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        self.info = {"sep": asr.sep, "num_workers": getattr(asr, "num_workers", 1), "pid": os.getpid()}
+
+    def serve_forever(self):
+        logger.info(f"model server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except (OSError, EOFError) as e:
+                    # e.g. a client with a wrong authkey
+                    logger.warning(f"rejected a connection: {e!r}")
+                    continue
+                threading.Thread(target=self.serve, args=(conn,), name="channel", daemon=True).start()
+        finally:
+            self.listener.close()
+
+    def serve(self, conn):
+        ring = None
+        try:
+            request = conn.recv()
+            if request[0] != "attach":
+                conn.send(("error", f"expected attach, got {request[0]!r}"))
+                return
+            ring = AudioRing(attach_shared_memory(request[1]))
+            conn.send(("ok", self.info))
+            while True:
+                request = conn.recv()
+                try:
+                    if request[0] == "transcribe":
+                        _, offset, n, init_prompt = request
+                        audio = ring.read(offset, n)
+                    elif request[0] == "transcribe_bytes":
+                        _, init_prompt = request
+                        audio = np.frombuffer(conn.recv_bytes(), dtype=np.float32)
+                    else:
+                        raise ValueError(f"unknown request {request[0]!r}")
+                    t = time.time()
+                    res = self.session_asr.transcribe(audio, init_prompt=init_prompt)
+                    response = ("ok", self.asr.ts_words(res), self.asr.segments_end_ts(res))
+                    logger.debug(f"transcribed {len(audio)/SAMPLING_RATE:.2f} s in {time.time()-t:.2f} s")
+                except Exception as e:
+                    logger.exception("transcription failed")
+                    response = ("error", repr(e))
+                conn.send(response)
+        except (EOFError, OSError):
+            pass  # the client closed the channel
+        finally:
+            conn.close()
+            if ring is not None:
+                ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Owns a Whisper model and transcribes for the web workers of this host (RemoteASR).")
+    parser.add_argument('--socket', type=str, required=True, help='Path of the Unix socket to listen on.')
+    parser.add_argument('--authkey', type=str, default=os.environ.get("MODEL_SERVER_AUTHKEY"), help='Secret that the clients must know, required. Default: the MODEL_SERVER_AUTHKEY environment variable, which unlike the argument is not visible in the process list.')
+    parser.add_argument('--model', type=str, default='distil-large-v3', help='Whisper model name, downloaded on first use.')
+    parser.add_argument('--model_cache_dir', type=str, default=None, help='Overriding the default model cache dir where models downloaded from the hub are saved.')
+    parser.add_argument('--model_dir', type=str, default=None, help='Local CTranslate2 model directory. Overrides --model.')
+    parser.add_argument('--lan', '--language', type=str, default='en', help="Source language code, e.g. en,de,cs, or 'auto' for language detection.")
+    parser.add_argument('--device', type=str, default="cuda", choices=["cuda", "cpu", "auto"], help='Device for faster-whisper.')
+    parser.add_argument('--compute_type', type=str, default=None, help='Quantization, e.g. float16, int8_float16, int8. Default: float16 on cuda, int8 on cpu.')
+    parser.add_argument('--cpu_threads', type=int, default=0, help='Threads per faster-whisper worker on CPU. 0 means the ctranslate2 default.')
+    parser.add_argument('--num_workers', type=int, default=1, help='Number of transcriptions that can run in parallel on the model.')
+    parser.add_argument('--autotune', action="store_true", default=False, help='Benchmark a few --cpu_threads/--num_workers splits at startup and use the fastest one.')
+    parser.add_argument('--batch_window_ms', type=float, default=0, help='If > 0, the requests of all clients arriving within this many milliseconds are decoded as one batch.')
+    parser.add_argument('--max_batch_size', type=int, default=8, help='Maximum number of requests in one batch.')
+    parser.add_argument("-l", "--log-level", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Set the log level", default='INFO')
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error("set MODEL_SERVER_AUTHKEY or --authkey: the requests are pickled, and without an authkey any "
+                     "process that can open the socket could run code in the model server")
+
+    logging.basicConfig(format='%(levelname)s\t%(message)s')
+    logging.getLogger("whisper_streamer").setLevel(args.log_level)
+    logger.setLevel(args.log_level)  # __main__ when run with -m
+
+    from whisper_streamer.whisper_online import FasterWhisperASR
+    from whisper_streamer.batch_scheduler import BatchScheduler
+
+    t = time.time()
+    asr = FasterWhisperASR(args.lan, args.model, cache_dir=args.model_cache_dir, model_dir=args.model_dir,
+                           logfile=sys.stderr, device=args.device, compute_type=args.compute_type,
+                           cpu_threads=args.cpu_threads, num_workers=args.num_workers, autotune=args.autotune)
+    # the very first transcription is much slower than the others
+    asr.transcribe(np.zeros(SAMPLING_RATE, dtype=np.float32))
+    logger.info(f"model loaded and warmed up in {time.time()-t:.1f} seconds")
+
+    session_asr = asr
+    if args.batch_window_ms > 0:
+        session_asr = BatchScheduler(asr, max_batch_size=args.max_batch_size, batch_window=args.batch_window_ms/1000)
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)  # left over by a server that was killed
+    ModelServer(args.socket, asr, session_asr, authkey=args.authkey.encode("utf-8")).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Offline transcription of long recordings.
+
+Silero VAD first cuts the file into speech regions. Neighbouring regions are packed into chunks of up to
+max_chunk seconds, the chunks are transcribed independently, in parallel in a pool of processes (each with its own
+model) or in batches on one model, and the word timestamps are shifted back to the timeline of the file.
+Unlike the streaming modes, the chunks do not get the previous text as a prompt.
+"""
+import copy
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from whisper_streamer.whisper_online import asr_factory, load_audio, load_vad_model
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+
+def speech_regions(audio, vad_model=None, block=16):
+    """Returns [(beg, end), ...] in samples of the voiced regions of audio, as detected by FixedVADIterator.
+    The speech probabilities are computed for block windows of 512 samples at once, batched if the model allows it,
+    and then every probability goes through VADIterator.update on its own, so that a region that ends and the next
+    one that starts within the same block are both seen. A __call__ with the whole block would merge them.
+    """
+    from whisper_streamer.silero_vad_iterator import FixedVADIterator
+
+    if vad_model is None:
+        vad_model = load_vad_model()
+    vac = FixedVADIterator(vad_model)
+    window = vac.WINDOW
+
+    regions = []
+    beg = None
+    n = len(audio) // window  # the incomplete last window is not evaluated, as in streaming
+    for i in range(0, n, block):
+        windows = audio[i*window:min(n, i+block)*window].reshape(-1, window)
+        for speech_prob in vac.speech_probs(windows):
+            r = vac.update(speech_prob, window)
+            if r is None:
+                continue
+            if 'start' in r:
+                beg = max(0, r['start'])
+            elif beg is not None:
+                regions.append((beg, min(len(audio), r['end'])))
+                beg = None
+    if beg is not None:
+        regions.append((beg, len(audio)))
+    return regions
+
+
+def pack_regions(regions, max_samples):
+    """Merges consecutive regions (with the silence between them) while the merged span is at most max_samples.
+    A region longer than max_samples stays on its own.
+    """
+    chunks = []
+    for beg, end in regions:
+        if chunks and end - chunks[-1][0] <= max_samples:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((beg, end))
+    return chunks
+
+
+def _transcribe_chunks(asr, audios, offsets):
+    # [(beg, end, "word"), ...] on the global timeline, for each chunk
+    if len(audios) == 1:
+        results = [asr.transcribe(audios[0])]
+    else:
+        results = asr.transcribe_batch(audios, [""]*len(audios))
+    return [[(b+offset, e+offset, w) for b, e, w in asr.ts_words(res)] for res, offset in zip(results, offsets)]
+
+
+# the model of a pool process
+_worker_asr = None
+
+def _init_worker(args):
+    global _worker_asr
+    args = copy.copy(args)
+    args.vac = False  # the worker needs only the model, not a VAC processor
+    _worker_asr, _ = asr_factory(args)
+
+def _transcribe_in_worker(job):
+    # the worker maps the audio itself, so that the chunks are not pickled to it
+    audio_path, beg, end = job
+    audio = load_audio(audio_path)[beg:end]
+    return _worker_asr.sep, _transcribe_chunks(_worker_asr, [audio], [beg/SAMPLING_RATE])[0]
+
+
+def transcribe_offline(audio_path, args, asr=None, workers=1, batch_size=1, max_chunk=30.0, vad_model=None):
+    """Transcribes the whole file. Yields (beg, end, "text") of every chunk, in the order of the file.
+
+    asr: loaded ASR for workers=1. With more workers, every pool process loads its own model with asr_factory(args),
+        so set --cpu_threads to the number of cores divided by workers on CPU.
+    batch_size: with one worker, this many chunks are transcribed at once with asr.transcribe_batch
+    max_chunk: maximum length of a chunk in seconds. 30 seconds is one Whisper window.
+    """
+    audio = load_audio(audio_path)
+    regions = speech_regions(audio, vad_model=vad_model)
+    chunks = pack_regions(regions, int(max_chunk*SAMPLING_RATE))
+    logger.info(f"VAD found {len(regions)} speech regions, {sum(e-b for b, e in regions)/SAMPLING_RATE:.2f} of "
+                f"{len(audio)/SAMPLING_RATE:.2f} seconds, transcribing them in {len(chunks)} chunks")
+
+    if workers > 1:
+        jobs = [(audio_path, beg, end) for beg, end in chunks]
+        # spawn, because forked CUDA and thread pools of the parent do not work in the children
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(args,)) as pool:
+            for sep, words in pool.map(_transcribe_in_worker, jobs):
+                if words:
+                    yield (words[0][0], words[-1][1], sep.join(w for _, _, w in words))
+    else:
+        jobs = [(audio[beg:end], beg/SAMPLING_RATE) for beg, end in chunks]
+        for i in range(0, len(jobs), batch_size):
+            batch = jobs[i:i+batch_size]
+            for words in _transcribe_chunks(asr, [a for a, _ in batch], [o for _, o in batch]):
+                if words:
+                    yield (words[0][0], words[-1][1], asr.sep.join(w for _, _, w in words))
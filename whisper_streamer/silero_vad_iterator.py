@@ -1,6 +1,12 @@
+import logging
+
 import torch
 import numpy as np
 
+from whisper_streamer.audio_buffer import AudioBuffer
+
+logger = logging.getLogger(__name__)
+
 # This is copied from silero-vad's vad_utils.py:
 # https://github.com/snakers4/silero-vad/blob/f6b1294cb27590fb2452899df98fb234dfef1134/utils_vad.py#L340
 # (except changed defaults)
@@ -71,9 +77,12 @@ class VADIterator:
                 raise TypeError("Audio cannot be casted to tensor. Cast it manually")
 
         window_size_samples = len(x[0]) if x.dim() == 2 else len(x)
-        self.current_sample += window_size_samples
-
         speech_prob = self.model(x, self.sampling_rate).item()
+        return self.update(speech_prob, window_size_samples, return_seconds=return_seconds)
+
+    def update(self, speech_prob, window_size_samples, return_seconds=False):
+        """Advances the iterator by one window with the given speech probability. Returns the same as __call__."""
+        self.current_sample += window_size_samples
 
         if (speech_prob >= self.threshold) and self.temp_end:
             self.temp_end = 0
@@ -103,21 +112,109 @@ class FixedVADIterator(VADIterator):
     '''It fixes VADIterator by allowing to process any audio length, not only exactly 512 frames at once.
     If audio to be processed at once is long and multiple voiced segments detected, 
     then __call__ returns the start of the first segment, and end (or middle, which means no end) of the last segment. 
+
+    All the complete 512-sample windows of a chunk are evaluated together: the STFT, the encoder and the output layer
+    of the silero model run once on the batch of windows, only the LSTM cell runs window by window, carrying the
+    model's recurrent state and context like separate calls do. The batched convolutions may differ from the
+    single-window ones in the last bits (around 1e-5). If any probability is that close to a threshold, the chunk is
+    evaluated again window by window, so the start/end events are always the same as with one model call per window.
     '''
 
+    WINDOW = 512
+    # probabilities closer than this to a threshold are recomputed one window at a time
+    BATCH_TOLERANCE = 1e-3
+    # A browser packet of 4096 samples at 44.1 or 48 kHz is 1365-1486 samples at 16 kHz, so with the remainder of
+    # the previous packet it completes 2 or 3 windows. On one CPU core, 2 windows take 0.95 ms in separate calls and
+    # 1.4 ms batched, 3 windows about 1.2 ms both ways, 4 windows 1.9 ms and 1.6 ms, 8 windows 3.9 ms and 1.8 ms.
+    # The batch pays off for the backlog that the VAD stage inserts at once after waiting for an inference.
+    MIN_BATCH = 3
+    _warned = False
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.batched = self.sampling_rate == 16000 and self._has_silero_internals()
+
+    def _has_silero_internals(self):
+        try:
+            m = self.model._model
+            m.run_extractors, m.encoder, m.decoder.rnn.weight_ih, m.decoder.decoder
+            self.model._state, self.model._context
+        except AttributeError as e:
+            if not FixedVADIterator._warned:
+                FixedVADIterator._warned = True
+                logger.warning(f"the silero VAD model has other internals ({e}), its windows are evaluated one by one")
+            return False
+        return True
+
     def reset_states(self):
         super().reset_states()
-        self.buffer = np.array([],dtype=np.float32)
+        self.buffer = AudioBuffer(4096)
+
+    def speech_probs(self, windows):
+        """Speech probabilities of consecutive complete windows, an array of shape (n, WINDOW), batched if possible.
+        It advances the model state like one call per window."""
+        probs = None
+        if self.batched and len(windows) >= self.MIN_BATCH:
+            probs = self._batched_probs(windows)
+        if probs is None:
+            probs = self._window_probs(windows)
+        return probs
+
+    def _window_probs(self, windows):
+        # one model call per window, as VADIterator does
+        return [self.model(torch.Tensor(w), self.sampling_rate).item() for w in windows]
+
+    def _batched_probs(self, windows):
+        model = self.model
+        m = model._model
+        rnn = m.decoder.rnn
+        context_size = m.context_size_samples
+        n = len(windows)
+        with torch.no_grad():
+            context = model._context.reshape(1, -1) if len(model._context) else torch.zeros(1, context_size)
+            audio = torch.cat([context, torch.from_numpy(np.ascontiguousarray(windows)).reshape(1, -1)], 1).reshape(-1)
+            # every window with the context_size samples before it, like forward() prepends them
+            x = audio.unfold(0, self.WINDOW + context_size, self.WINDOW)
+            features = m.encoder(m.run_extractors(x)).squeeze(-1)
+
+            if len(model._state):
+                h, c = model._state[0], model._state[1]
+            else:
+                h = c = torch.zeros(1, rnn.weight_hh.shape[1])
+            hs = []
+            for i in range(n):
+                h, c = torch.lstm_cell(features[i:i+1], [h, c], rnn.weight_ih, rnn.weight_hh, rnn.bias_ih, rnn.bias_hh)
+                hs.append(h)
+            out = m.decoder.decoder(torch.cat(hs).unsqueeze(-1).float())
+            probs = out.squeeze(1).mean(1).tolist()
+
+        low = self.threshold - 0.15
+        if any(abs(p - self.threshold) < self.BATCH_TOLERANCE or abs(p - low) < self.BATCH_TOLERANCE for p in probs):
+            return None
+        model._state = torch.stack([h, c])
+        model._context = x[-1:, -context_size:]
+        model._last_sr = self.sampling_rate
+        model._last_batch_size = 1
+        return probs
+
+    def events(self, x, return_seconds=False):
+        """All the start and end events of the complete windows of x, in order, each as a dict like __call__ returns.
+        Unlike __call__, an end followed by a new start within x are both returned."""
+        self.buffer.append(x)
+        n = len(self.buffer) // self.WINDOW
+        if n == 0:
+            return []
+        probs = self.speech_probs(self.buffer[:n*self.WINDOW].reshape(n, self.WINDOW))
+        self.buffer.trim_front(n*self.WINDOW)
+        events = (self.update(speech_prob, self.WINDOW, return_seconds=return_seconds) for speech_prob in probs)
+        return [r for r in events if r is not None]
 
     def __call__(self, x, return_seconds=False):
-        self.buffer = np.append(self.buffer, x) 
         ret = None
-        while len(self.buffer) >= 512:
-            r = super().__call__(self.buffer[:512], return_seconds=return_seconds)
-            self.buffer = self.buffer[512:]
+        for r in self.events(x, return_seconds=return_seconds):
             if ret is None:
                 ret = r
-            elif r is not None:
+            else:
                 if 'end' in r:
                     ret['end'] = r['end']  # the latter end
                 if 'start' in r and 'end' in ret:  # there is an earlier start.
@@ -0,0 +1,118 @@
+"""Timed spans of the streaming pipeline, for finding out where an iteration spends its time.
+
+OnlineASRProcessor and the ASR backends have a `tracer` attribute, None by default. With a Tracer set, every
+process_iter emits nested spans (prompt, transcribe, ts_words, hypothesis, buffer trimming, and the backend's own
+steps) with attributes such as the buffer seconds, the words committed and the trim point:
+
+    tracer = ChromeTraceExporter("trace.json")
+    asr.tracer = online.tracer = tracer
+    ...
+    tracer.write()  # open in chrome://tracing or https://ui.perfetto.dev
+
+Without a tracer, span() returns a shared no-op context manager, so the instrumentation costs one call per step.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(tracer, name, **attrs):
+    """A span of tracer, or a no-op if tracer is None. Use as `with span(self.tracer, "step", key=value) as s:`
+    and add attributes known only at the end with s.set(key=value)."""
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, attrs)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "attrs", "start")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = repr(exc)
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """Receives the finished spans. Subclass it and override record() to send them anywhere."""
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def record(self, name, start, end, attrs):
+        """name: span name, start and end: time.perf_counter() seconds, attrs: dict of the span's attributes.
+        Called in the thread that ran the span, right when it ends."""
+        raise NotImplementedError
+
+
+class ChromeTraceExporter(Tracer):
+    """Collects the spans as Chrome trace events ("X" complete events, one track per thread) and writes them as
+    JSON for chrome://tracing, Perfetto or speedscope. Nested spans show as a flame graph.
+
+    max_events: the oldest events are dropped beyond this, so that a long session does not grow without bound
+    """
+
+    def __init__(self, path, max_events=1_000_000):
+        self.path = path
+        self.max_events = max_events
+        self.events = deque(maxlen=max_events)
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        # copying the deque in write() fails if another thread appends meanwhile
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end, attrs):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": attrs,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path=None):
+        """Writes the events collected so far"""
+        with self._lock:
+            events = list(self.events)
+        threads = {e["tid"] for e in events}
+        names = {t.ident: t.name for t in threading.enumerate()}
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+                    for tid in threads]
+        with open(path or self.path, "w") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, default=str)
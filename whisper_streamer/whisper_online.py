@@ -1,27 +1,26 @@
 #!/usr/bin/env python3
 import sys
 import numpy as np
-import librosa
-from functools import lru_cache
 import time
 import logging
 
-import io
-import soundfile as sf
 import math
+from collections import deque
+
+from whisper_streamer.audio_buffer import AudioBuffer
+from whisper_streamer.audio_source import audio_sources
+from whisper_streamer.feature_cache import LogMelCache
+from whisper_streamer.tracing import span
 
 logger = logging.getLogger(__name__)
 
-@lru_cache(10**6)
 def load_audio(fname):
-    a, _ = librosa.load(fname, sr=16000, dtype=np.float32)
-    return a
+    """The whole file as 16 kHz mono float32, memory-mapped: slices of it are views, and only the parts that are
+    read take memory (see audio_source.py)"""
+    return audio_sources.open(fname).samples
 
 def load_audio_chunk(fname, beg, end):
-    audio = load_audio(fname)
-    beg_s = int(beg*16000)
-    end_s = int(end*16000)
-    return audio[beg_s:end_s]
+    return audio_sources.open(fname).window(beg, end)
 
 
 # Whisper backend
@@ -31,6 +30,8 @@ class ASRBase:
     sep = " "   # join transcribe words with this character (" " for whisper_timestamped,
                 # "" for faster-whisper because it emits the spaces when neeeded)
 
+    tracer = None  # whisper_streamer.tracing.Tracer for spans of the backend's steps, or None
+
     def __init__(self, lan, modelsize=None, cache_dir=None, model_dir=None, logfile=sys.stderr):
         self.logfile = logfile
 
@@ -49,6 +50,19 @@ class ASRBase:
     def transcribe(self, audio, init_prompt=""):
         raise NotImplemented("must be implemented in the child class")
 
+    def transcribe_batch(self, audios, init_prompts, features=None):
+        """Transcribes several independent audio buffers. Returns one transcribe() result per buffer.
+        Backends that can run the buffers as one batch override this, the default runs them one by one.
+        features: precomputed features of the buffers, used only by backends with a feature_cache()
+        """
+        return [self.transcribe(audio, init_prompt=prompt) for audio, prompt in zip(audios, init_prompts)]
+
+    def feature_cache(self):
+        """Returns a LogMelCache for the streaming buffer if the backend can transcribe precomputed features
+        with transcribe_features(), otherwise None.
+        """
+        return None
+
     def use_vad(self):
         raise NotImplemented("must be implemented in the child class")
 
@@ -97,12 +111,108 @@ class WhisperTimestampedASR(ASRBase):
 
 
 
+# private methods of faster_whisper.WhisperModel that the batched transcription and transcribe_features call, with
+# their parameters
+FASTER_WHISPER_INTERNALS = {
+    "generate_segments": ["features", "tokenizer", "options", "log_progress", "encoder_output"],
+    "get_prompt": ["tokenizer", "previous_tokens", "without_timestamps", "prefix", "hotwords"],
+    "_split_segments_by_timestamps": ["tokenizer", "tokens", "time_offset", "segment_size", "segment_duration", "seek"],
+    "find_alignment": ["tokenizer", "text_tokens", "encoder_output", "num_frames", "median_filter_width"],
+    "add_word_timestamps": ["segments", "tokenizer", "encoder_output", "num_frames", "prepend_punctuations",
+                            "append_punctuations", "last_speech_timestamp"],
+}
+# faster_whisper.transcribe.TranscriptionOptions as WhisperModel.transcribe builds it with its defaults and with the
+# options of FasterWhisperASR.transcribe. initial_prompt and suppress_tokens are set per call.
+TRANSCRIPTION_OPTIONS = dict(
+    beam_size=5,
+    best_of=5,
+    patience=1,
+    length_penalty=1,
+    repetition_penalty=1,
+    no_repeat_ngram_size=0,
+    log_prob_threshold=-1.0,
+    no_speech_threshold=0.6,
+    compression_ratio_threshold=2.4,
+    condition_on_previous_text=True,
+    prompt_reset_on_temperature=0.5,
+    temperatures=[0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+    initial_prompt="",
+    prefix=None,
+    suppress_blank=True,
+    suppress_tokens=[-1],
+    without_timestamps=False,
+    max_initial_timestamp=1.0,
+    word_timestamps=True,
+    prepend_punctuations="\"'“¿([{-",
+    append_punctuations="\"'.。,，!！?？:：”)]}、",
+    multilingual=False,
+    max_new_tokens=None,
+    clip_timestamps="0",
+    hallucination_silence_threshold=None,
+    hotwords=None,
+)
+_internals_checked = None
+
+def faster_whisper_internals():
+    """True if the installed faster-whisper has the internals that FasterWhisperASR.transcribe_batch and
+    transcribe_features use. They are not a public API, with other versions it logs a warning once, the transcriptions
+    run one by one and the features are computed by faster-whisper."""
+    global _internals_checked
+    if _internals_checked is None:
+        import dataclasses
+        import inspect
+        import faster_whisper
+        from faster_whisper import WhisperModel
+        from faster_whisper import transcribe as fw_transcribe
+        missing = [name for name, params in FASTER_WHISPER_INTERNALS.items()
+                   if not hasattr(WhisperModel, name)
+                   or list(inspect.signature(getattr(WhisperModel, name)).parameters)[1:] != params]
+        missing += [name for name in ("Segment", "Word", "get_compression_ratio", "get_end", "get_suppressed_tokens")
+                    if not hasattr(fw_transcribe, name)]
+        options = getattr(fw_transcribe, "TranscriptionOptions", None)
+        if options is None or not dataclasses.is_dataclass(options) or \
+                [f.name for f in dataclasses.fields(options)] != list(TRANSCRIPTION_OPTIONS):
+            missing.append("TranscriptionOptions")
+        if missing:
+            logger.warning(f"faster-whisper {faster_whisper.__version__} has other internals ({', '.join(missing)}), "
+                           "batched transcription and the feature cache are off")
+        _internals_checked = not missing
+    return _internals_checked
+
+class _AlignedModel:
+    # stands in for the WhisperModel in WhisperModel.add_word_timestamps of one row, with its alignment computed in a batch
+    def __init__(self, model, alignment):
+        self.frames_per_second = model.frames_per_second
+        self.alignment = alignment
+
+    def find_alignment(self, *args, **kwargs):
+        return [self.alignment]
+
 class FasterWhisperASR(ASRBase):
     """Uses faster-whisper library as the backend. Works much faster, appx 4-times (in offline mode). For GPU, it requires installation with a specific CUDNN version.
+
+    device: "cuda", "cpu" or "auto"
+    compute_type: ctranslate2 quantization, e.g. "float16", "int8_float16", "int8". None means float16 on cuda and int8 on cpu.
+    cpu_threads: number of threads per worker on CPU, 0 means the ctranslate2 default
+    num_workers: number of transcribe() calls that can run in parallel on the model, from different threads
+    autotune: measure a few cpu_threads/num_workers splits at startup and use the one with the best real-time factor
+    autotune_audio: 16kHz audio for autotune. Defaults to 10 seconds of noise, a speech recording gives more realistic numbers.
     """
 
     sep = ""
 
+    def __init__(self, lan, modelsize=None, cache_dir=None, model_dir=None, logfile=sys.stderr,
+                 device="cuda", compute_type=None, cpu_threads=0, num_workers=1, autotune=False, autotune_audio=None):
+        self.device = device
+        if compute_type is None:
+            compute_type = "int8" if device == "cpu" else "float16"
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.autotune = autotune
+        self.autotune_audio = autotune_audio
+        super().__init__(lan, modelsize=modelsize, cache_dir=cache_dir, model_dir=model_dir, logfile=logfile)
+
     def load_model(self, modelsize=None, cache_dir=None, model_dir=None):
         from faster_whisper import WhisperModel
 #        logging.getLogger("faster_whisper").setLevel(logger.level)
@@ -114,26 +224,249 @@ class FasterWhisperASR(ASRBase):
         else:
             raise ValueError("modelsize or model_dir parameter must be set")
 
+        if self.autotune:
+            self.cpu_threads, self.num_workers = self.tune_threads(model_size_or_path, cache_dir)
 
-        # this worked fast and reliably on NVIDIA L40
-        model = WhisperModel(model_size_or_path, device="cuda", compute_type="float16", download_root=cache_dir)
-
-        # or run on GPU with INT8
-        # tested: the transcripts were different, probably worse than with FP16, and it was slightly (appx 20%) slower
-        #model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
-
-        # or run on CPU with INT8
-        # tested: works, but slow, appx 10-times than cuda FP16
-#        model = WhisperModel(modelsize, device="cpu", compute_type="int8") #, download_root="faster-disk-cache-dir/")
+        # device="cuda", compute_type="float16" worked fast and reliably on NVIDIA L40
+        # cuda with int8_float16: tested, the transcripts were different, probably worse than with FP16, and it was slightly (appx 20%) slower
+        # cpu with int8: tested, works, but slow, appx 10-times than cuda FP16
+        logger.info(f"faster-whisper on {self.device} with {self.compute_type}, cpu_threads={self.cpu_threads}, num_workers={self.num_workers}")
+        model = WhisperModel(model_size_or_path, device=self.device, compute_type=self.compute_type,
+                             cpu_threads=self.cpu_threads, num_workers=self.num_workers, download_root=cache_dir)
         return model
 
+    def tune_threads(self, model_size_or_path, cache_dir=None):
+        """Loads the model with a few cpu_threads/num_workers splits of the CPU cores and runs num_workers transcriptions
+        of the autotune audio in parallel on each. Returns the (cpu_threads, num_workers) with the lowest real-time factor,
+        i.e. processing time per second of audio over all workers.
+        """
+        from faster_whisper import WhisperModel
+        from concurrent.futures import ThreadPoolExecutor
+        import os
+
+        audio = self.autotune_audio
+        if audio is None:
+            audio = (np.random.default_rng(0).standard_normal(10*16000)*0.05).astype(np.float32)
+        duration = len(audio)/16000
+
+        cores = os.cpu_count() or 1
+        candidates = [(max(1, cores//w), w) for w in (1, 2, 4) if w == 1 or cores//w >= 2]
+        best = None
+        for cpu_threads, num_workers in candidates:
+            model = WhisperModel(model_size_or_path, device=self.device, compute_type=self.compute_type,
+                                 cpu_threads=cpu_threads, num_workers=num_workers, download_root=cache_dir)
+            def run(_):
+                segments, _ = model.transcribe(audio, language=self.original_language, beam_size=5, word_timestamps=True)
+                return list(segments)
+            run(0)  # warm up
+            with ThreadPoolExecutor(num_workers) as ex:
+                t = time.time()
+                list(ex.map(run, range(num_workers)))
+                rtf = (time.time()-t)/(duration*num_workers)
+            logger.info(f"autotune: cpu_threads={cpu_threads} num_workers={num_workers} real-time factor {rtf:.3f}")
+            if best is None or rtf < best[0]:
+                best = (rtf, cpu_threads, num_workers)
+            del model
+        _, cpu_threads, num_workers = best
+        logger.info(f"autotune: using cpu_threads={cpu_threads} num_workers={num_workers}")
+        return cpu_threads, num_workers
+
     def transcribe(self, audio, init_prompt=""):
 
         # tested: beam_size=5 is faster and better than 1 (on one 200 second document from En ESIC, min chunk 0.01)
-        segments, info = self.model.transcribe(audio, language=self.original_language, initial_prompt=init_prompt, beam_size=5, word_timestamps=True, condition_on_previous_text=True, **self.transcribe_kargs)
-        #print(info)  # info contains language detection result
+        with span(self.tracer, "asr.model_transcribe", audio_seconds=len(audio)/16000) as s:
+            segments, info = self.model.transcribe(audio, language=self.original_language, initial_prompt=init_prompt, beam_size=5, word_timestamps=True, condition_on_previous_text=True, **self.transcribe_kargs)
+            #print(info)  # info contains language detection result
+            # the segments are decoded lazily, while they are listed
+            segments = list(segments)
+            s.set(segments=len(segments))
+        return segments
+
+    def feature_cache(self):
+        if not faster_whisper_internals():
+            return None
+        return LogMelCache(self.model.feature_extractor)
+
+    def transcribe_features(self, features, audio, init_prompt=""):
+        """The same as transcribe(audio), but on the log-mel features of audio computed by a LogMelCache.
+        Language detection and the VAD filter need the audio, then it falls back to transcribe(audio), and so it does
+        with transcribe_kargs that are no TranscriptionOptions.
+        """
+        from faster_whisper.tokenizer import Tokenizer
+        from faster_whisper.transcribe import TranscriptionOptions, get_suppressed_tokens
+
+        if self.original_language is None:
+            return self.transcribe(audio, init_prompt=init_prompt)
+        options = dict(TRANSCRIPTION_OPTIONS, initial_prompt=init_prompt)
+        for name, value in self.transcribe_kargs.items():
+            if name == "temperature":
+                options["temperatures"] = value if isinstance(value, (list, tuple)) else [value]
+            elif name in options and name not in ("temperatures", "suppress_tokens"):
+                options[name] = value
+            elif name != "task":
+                return self.transcribe(audio, init_prompt=init_prompt)
+
+        tokenizer = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual,
+                              task=self.transcribe_kargs.get("task", "transcribe"), language=self.original_language)
+        options["suppress_tokens"] = get_suppressed_tokens(tokenizer, options["suppress_tokens"])
+        options = TranscriptionOptions(**options)
+        with span(self.tracer, "asr.generate_segments", frames=features.shape[-1]) as s:
+            segments = list(self.model.generate_segments(features, tokenizer, options, False))
+            s.set(segments=len(segments))
+        return segments
+
+    def transcribe_batch(self, audios, init_prompts, features=None):
+        """Runs the encoder and the beam search decoder on all the audio buffers at once, each with its own prompt.
+        Returns a list of segments per buffer, the same as transcribe() of each buffer.
+
+        The decoder needs <|startoftranscript|> at the same position in every row, so the buffers are batched in groups
+        whose prompts have the same number of tokens. Every buffer is decoded once, with beam search at temperature 0,
+        like the first window of transcribe(). When transcribe() would go on from there, with a higher temperature
+        because the result fails the compression ratio or log probability check, or with a second window because the
+        last segment is not finished, the buffer is transcribed with transcribe() instead.
+        Buffers longer than 30 seconds, language detection, the VAD filter and faster-whisper versions with other
+        internals are not supported, then it falls back to transcribing one by one.
+        features: optional list with the LogMelCache features of each buffer, or None where they have to be computed
+        """
+        from faster_whisper.tokenizer import Tokenizer
+        from faster_whisper.transcribe import get_suppressed_tokens
+
+        fe = self.model.feature_extractor
+        if (self.original_language is None or not set(self.transcribe_kargs) <= self.BATCH_KARGS
+                or any(len(a) > fe.n_samples for a in audios) or not faster_whisper_internals()):
+            return super().transcribe_batch(audios, init_prompts)
+        if features is None:
+            features = [None]*len(audios)
+
+        tokenizer = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual,
+                              task=self.transcribe_kargs.get("task", "transcribe"), language=self.original_language)
+        suppress_tokens = get_suppressed_tokens(tokenizer, [-1])
+
+        # the prompts as WhisperModel.transcribe builds them, an empty prompt is still a " " token
+        prompts = [self.model.get_prompt(tokenizer, tokenizer.encode(" " + p.strip())) for p in init_prompts]
+        groups = {}
+        for i, prompt in enumerate(prompts):
+            groups.setdefault(len(prompt), []).append(i)
+
+        out = [None]*len(audios)
+        for length, group in groups.items():
+            with span(self.tracer, "asr.transcribe_rows", rows=len(group), prompt_tokens=length) as s:
+                segments = self._transcribe_rows([audios[i] for i in group], [features[i] for i in group],
+                                                 [prompts[i] for i in group], tokenizer, suppress_tokens)
+                s.set(fallbacks=sum(not finished for _, finished in segments))
+            for i, (r, finished) in zip(group, segments):
+                # transcribe() would not finish this buffer with one window at temperature 0
+                out[i] = r if finished else self.transcribe(audios[i], init_prompt=init_prompts[i])
+        return out
 
-        return list(segments)
+    # transcribe_kargs that transcribe_batch applies like transcribe() does
+    BATCH_KARGS = {"task", "compression_ratio_threshold", "log_prob_threshold", "no_speech_threshold"}
+
+    def _transcribe_rows(self, audios, row_features, prompts, tokenizer, suppress_tokens):
+        # one batched encode + generate + word alignment, this mirrors the first window of WhisperModel.generate_segments.
+        # Returns (segments, finished) for every row: the segments of the window, and whether transcribe() would stop
+        # there too, instead of decoding again at a higher temperature or decoding a second window.
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.transcribe import Segment, Word, get_compression_ratio, get_end
+
+        model = self.model
+        fe = model.feature_extractor
+        compression_ratio_threshold = self.transcribe_kargs.get("compression_ratio_threshold", 2.4)
+        log_prob_threshold = self.transcribe_kargs.get("log_prob_threshold", -1.0)
+        no_speech_threshold = self.transcribe_kargs.get("no_speech_threshold", 0.6)
+
+        features = []
+        segment_sizes = []
+        with span(self.tracer, "asr.features", computed=sum(f is None for f in row_features)):
+            for audio, f in zip(audios, row_features):
+                if f is None:
+                    f = fe(audio)
+                segment_size = min(fe.nb_max_frames, f.shape[-1] - 1)
+                features.append(pad_or_trim(f[:, :segment_size]))
+                segment_sizes.append(segment_size)
+
+        with span(self.tracer, "asr.encode"):
+            encoder_output = model.encode(np.stack(features))
+        with span(self.tracer, "asr.generate"):
+            results = model.model.generate(
+                encoder_output,
+                prompts,
+                beam_size=5,
+                patience=1,
+                length_penalty=1,
+                repetition_penalty=1,
+                no_repeat_ngram_size=0,
+                max_length=model.max_length,
+                return_scores=True,
+                return_no_speech_prob=True,
+                suppress_blank=True,
+                suppress_tokens=suppress_tokens,
+                max_initial_timestamp_index=int(round(1.0 / model.time_precision)),
+            )
+
+        rows = []
+        for result, segment_size in zip(results, segment_sizes):
+            tokens = result.sequences_ids[0]
+            avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+            compression_ratio = get_compression_ratio(tokenizer.decode(tokens).strip())
+            # the checks of WhisperModel.generate_with_fallback, at temperature 0
+            too_low = log_prob_threshold is not None and avg_logprob < log_prob_threshold
+            needs_fallback = too_low or (compression_ratio_threshold is not None and compression_ratio > compression_ratio_threshold)
+            if no_speech_threshold is not None and result.no_speech_prob > no_speech_threshold and too_low:
+                needs_fallback = False  # silence
+            # and the no speech check of WhisperModel.generate_segments
+            skip = (no_speech_threshold is not None and result.no_speech_prob > no_speech_threshold
+                    and not (log_prob_threshold is not None and avg_logprob > log_prob_threshold))
+            subsegments, seek, single_timestamp_ending = model._split_segments_by_timestamps(
+                tokenizer=tokenizer,
+                tokens=tokens,
+                time_offset=0.0,
+                segment_size=segment_size,
+                segment_duration=segment_size * fe.time_per_frame,
+                seek=0,
+            )
+            rows.append(dict(result=result, avg_logprob=avg_logprob, compression_ratio=compression_ratio,
+                             needs_fallback=needs_fallback, skip=skip, subsegments=subsegments, seek=seek,
+                             single_timestamp_ending=single_timestamp_ending))
+
+        with span(self.tracer, "asr.word_timestamps"):
+            # aligned as one batch, the rest of WhisperModel.add_word_timestamps runs for every row on its own,
+            # because it carries the last speech timestamp from one segment list to the next
+            text_tokens = [[t for sub in row["subsegments"] for t in sub["tokens"] if t < tokenizer.eot] for row in rows]
+            alignments = model.find_alignment(tokenizer, text_tokens, encoder_output, segment_sizes)
+            for row, alignment, segment_size in zip(rows, alignments, segment_sizes):
+                if row["skip"]:
+                    continue
+                type(model).add_word_timestamps(_AlignedModel(model, alignment), [row["subsegments"]], tokenizer, None,
+                                                segment_size, "\"'“¿([{-", "\"'.。,，!！?？:：”)]}、", 0.0)
+                if not row["single_timestamp_ending"]:
+                    last_word_end = get_end(row["subsegments"])
+                    if last_word_end is not None and last_word_end > 0:
+                        row["seek"] = round(last_word_end * model.frames_per_second)
+
+        out = []
+        for row, segment_size in zip(rows, segment_sizes):
+            segments = []
+            for segment in ([] if row["skip"] else row["subsegments"]):
+                text = tokenizer.decode(segment["tokens"])
+                if segment["start"] == segment["end"] or not text.strip():
+                    continue
+                segments.append(Segment(
+                    id=len(segments) + 1,
+                    seek=0,
+                    start=segment["start"],
+                    end=segment["end"],
+                    text=text,
+                    tokens=segment["tokens"],
+                    avg_logprob=row["avg_logprob"],
+                    compression_ratio=row["compression_ratio"],
+                    no_speech_prob=row["result"].no_speech_prob,
+                    words=[Word(**w) for w in segment["words"]],
+                    temperature=0.0,
+                ))
+            finished = not row["needs_fallback"] and (row["skip"] or row["seek"] >= segment_size)
+            out.append((segments, finished))
+        return out
 
     def ts_words(self, segments):
         o = []
@@ -316,6 +649,9 @@ class OpenaiApiASR(ASRBase):
         return [s.end for s in res.words]
 
     def transcribe(self, audio_data, prompt=None, *args, **kwargs):
+        import io
+        import soundfile as sf
+
         # Write the audio data to a buffer
         buffer = io.BytesIO()
         buffer.name = "temp.wav"
@@ -342,7 +678,8 @@ class OpenaiApiASR(ASRBase):
             proc = self.client.audio.transcriptions
 
         # Process transcription/translation
-        transcript = proc.create(**params)
+        with span(self.tracer, "asr.api_request", audio_seconds=len(audio_data)/16000):
+            transcript = proc.create(**params)
         logger.debug(f"OpenAI API processed accumulated {self.transcribed_seconds} seconds")
 
         return transcript
@@ -359,7 +696,7 @@ class OpenaiApiASR(ASRBase):
 class HypothesisBuffer:
 
     def __init__(self, logfile=sys.stderr):
-        self.commited_in_buffer = []
+        self.commited_in_buffer = deque()
         self.buffer = []
         self.new = []
 
@@ -372,53 +709,41 @@ class HypothesisBuffer:
         # compare self.commited_in_buffer and new. It inserts only the words in new that extend the commited_in_buffer, it means they are roughly behind last_commited_time and new in content
         # the new tail is added to self.new
         
-        new = [(a+offset,b+offset,t) for a,b,t in new]
-        self.new = [(a,b,t) for a,b,t in new if a > self.last_commited_time-0.1]
+        self.new = [(a+offset,b+offset,t) for a,b,t in new if a+offset > self.last_commited_time-0.1]
 
         if len(self.new) >= 1:
             a,b,t = self.new[0]
             if abs(a - self.last_commited_time) < 1:
                 if self.commited_in_buffer:
                     # it's going to search for 1, 2, ..., 5 consecutive words (n-grams) that are identical in commited and new. If they are, they're dropped.
+                    # The words are compared one by one from the end of commited, no n-gram strings are built.
                     cn = len(self.commited_in_buffer)
                     nn = len(self.new)
-                    for i in range(1,min(min(cn,nn),5)+1):  # 5 is the maximum 
-                        c = " ".join([self.commited_in_buffer[-j][2] for j in range(1,i+1)][::-1])
-                        tail = " ".join(self.new[j-1][2] for j in range(1,i+1))
-                        if c == tail:
-                            words = []
-                            for j in range(i):
-                                words.append(repr(self.new.pop(0)))
-                            words_msg = " ".join(words)
+                    for i in range(1,min(cn,nn,5)+1):  # 5 is the maximum 
+                        if all(self.commited_in_buffer[cn-i+j][2] == self.new[j][2] for j in range(i)):
+                            words_msg = " ".join(repr(w) for w in self.new[:i])
+                            self.new = self.new[i:]
                             logger.debug(f"removing last {i} words: {words_msg}")
                             break
 
     def flush(self):
         # returns commited chunk = the longest common prefix of 2 last inserts. 
 
-        commit = []
-        while self.new:
-            na, nb, nt = self.new[0]
-
-            if len(self.buffer) == 0:
-                break
-
-            if nt == self.buffer[0][2]:
-                commit.append((na,nb,nt))
-                self.last_commited_word = nt
-                self.last_commited_time = nb
-                self.buffer.pop(0)
-                self.new.pop(0)
-            else:
-                break
-        self.buffer = self.new
+        n = min(len(self.new), len(self.buffer))
+        i = 0
+        while i < n and self.new[i][2] == self.buffer[i][2]:
+            i += 1
+        commit = self.new[:i]
+        if commit:
+            _, self.last_commited_time, self.last_commited_word = commit[-1]
+        self.buffer = self.new[i:]
         self.new = []
         self.commited_in_buffer.extend(commit)
         return commit
 
     def pop_commited(self, time):
         while self.commited_in_buffer and self.commited_in_buffer[0][1] <= time:
-            self.commited_in_buffer.pop(0)
+            self.commited_in_buffer.popleft()
 
     def complete(self):
         return self.buffer
@@ -427,16 +752,23 @@ class OnlineASRProcessor:
 
     SAMPLING_RATE = 16000
 
-    def __init__(self, asr, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr):
+    def __init__(self, asr, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr, tracer=None):
         """asr: WhisperASR object
         tokenizer: sentence tokenizer object for the target language. Must have a method *split* that behaves like the one of MosesTokenizer. It can be None, if "segment" buffer trimming option is used, then tokenizer is not used at all.
         ("segment", 15)
         buffer_trimming: a pair of (option, seconds), where option is either "sentence" or "segment", and seconds is a number. Buffer is trimmed if it is longer than "seconds" threshold. Default is the most recommended option.
         logfile: where to store the log. 
+        tracer: whisper_streamer.tracing.Tracer that gets timed spans of every process_iter step, or None
         """
         self.asr = asr
         self.tokenizer = tokenizer
         self.logfile = logfile
+        self.tracer = tracer
+        # log-mel frames of audio_buffer, if the backend can use them. Then only the new audio is featurized on every iteration.
+        self.feature_cache = asr.feature_cache()
+        # statistics for monitoring: seconds of the last hypothesis insert+flush, and the number of buffer trims
+        self.flush_time = 0.0
+        self.trims = 0
 
         self.init()
 
@@ -444,16 +776,20 @@ class OnlineASRProcessor:
 
     def init(self, offset=None):
         """run this when starting or restarting processing"""
-        self.audio_buffer = np.array([],dtype=np.float32)
+        self.audio_buffer = AudioBuffer()
+        if self.feature_cache is not None:
+            self.feature_cache.clear()
         self.transcript_buffer = HypothesisBuffer(logfile=self.logfile)
         self.buffer_time_offset = 0
         if offset is not None:
             self.buffer_time_offset = offset
         self.transcript_buffer.last_commited_time = self.buffer_time_offset
         self.commited = []
+        # (beg, end, "text") of the words after the committed ones in the last transcription, not confirmed yet
+        self.interim = (None, None, "")
 
     def insert_audio_chunk(self, audio):
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        self.audio_buffer.append(audio)
 
     def prompt(self):
         """Returns a tuple: (prompt, context), where "prompt" is a 200-character suffix of commited text that is inside of the scrolled away part of audio buffer. 
@@ -463,12 +799,13 @@ class OnlineASRProcessor:
         while k > 0 and self.commited[k-1][1] > self.buffer_time_offset:
             k -= 1
 
-        p = self.commited[:k]
-        p = [t for _,_,t in p]
+        # walk back from k instead of copying the whole commited prefix
         prompt = []
         l = 0
-        while p and l < 200:  # 200 characters prompt size
-            x = p.pop(-1)
+        j = k
+        while j > 0 and l < 200:  # 200 characters prompt size
+            j -= 1
+            x = self.commited[j][2]
             l += len(x)+1
             prompt.append(x)
         non_prompt = self.commited[k:]
@@ -480,28 +817,56 @@ class OnlineASRProcessor:
         The non-emty text is confirmed (committed) partial transcript.
         """
 
-        prompt, non_prompt = self.prompt()
+        with span(self.tracer, "process_iter", buffer_seconds=len(self.audio_buffer)/self.SAMPLING_RATE,
+                  buffer_offset=self.buffer_time_offset) as iteration:
+            o = self._process_iter()
+            iteration.set(words_committed=len(o))
+
+        logger.debug(f"len of buffer now: {len(self.audio_buffer)/self.SAMPLING_RATE:2.2f}")
+        return self.to_flush(o)
+
+    def _process_iter(self):
+        # the steps of process_iter, returns the newly committed words
+        with span(self.tracer, "prompt") as s:
+            prompt, non_prompt = self.prompt()
+            s.set(prompt_chars=len(prompt))
         logger.debug(f"PROMPT: {prompt}")
         logger.debug(f"CONTEXT: {non_prompt}")
         logger.debug(f"transcribing {len(self.audio_buffer)/self.SAMPLING_RATE:2.2f} seconds from {self.buffer_time_offset:2.2f}")
-        res = self.asr.transcribe(self.audio_buffer, init_prompt=prompt)
+        if self.feature_cache is not None:
+            with span(self.tracer, "features", cached_frames=len(self.feature_cache)):
+                self.feature_cache.update(self.audio_buffer.view())
+                features = self.feature_cache.features()
+            with span(self.tracer, "transcribe"):
+                res = self.asr.transcribe_features(features, self.audio_buffer.view(), init_prompt=prompt)
+        else:
+            with span(self.tracer, "transcribe"):
+                res = self.asr.transcribe(self.audio_buffer.view(), init_prompt=prompt)
 
         # transform to [(beg,end,"word1"), ...]
-        tsw = self.asr.ts_words(res)
-
-        self.transcript_buffer.insert(tsw, self.buffer_time_offset)
-        o = self.transcript_buffer.flush()
+        with span(self.tracer, "ts_words") as s:
+            tsw = self.asr.ts_words(res)
+            s.set(words=len(tsw))
+
+        with span(self.tracer, "hypothesis") as s:
+            t = time.perf_counter()
+            self.transcript_buffer.insert(tsw, self.buffer_time_offset)
+            o = self.transcript_buffer.flush()
+            self.flush_time = time.perf_counter() - t
+            s.set(words_committed=len(o))
         self.commited.extend(o)
         completed = self.to_flush(o)
         logger.debug(f">>>>COMPLETE NOW: {completed}")
         the_rest = self.to_flush(self.transcript_buffer.complete())
         logger.debug(f"INCOMPLETE: {the_rest}")
+        self.interim = the_rest
 
         # there is a newly confirmed text
 
         if o and self.buffer_trimming_way == "sentence":  # trim the completed sentences
             if len(self.audio_buffer)/self.SAMPLING_RATE > self.buffer_trimming_sec:  # longer than this
-                self.chunk_completed_sentence()
+                with span(self.tracer, "chunk_completed_sentence"):
+                    self.chunk_completed_sentence()
 
         
         if self.buffer_trimming_way == "segment":
@@ -510,7 +875,8 @@ class OnlineASRProcessor:
             s = 30 # if the audio buffer is longer than 30s, trim it
         
         if len(self.audio_buffer)/self.SAMPLING_RATE > s:
-            self.chunk_completed_segment(res)
+            with span(self.tracer, "chunk_completed_segment"):
+                self.chunk_completed_segment(res)
 
             # alternative: on any word
             #l = self.buffer_time_offset + len(self.audio_buffer)/self.SAMPLING_RATE - 10
@@ -522,8 +888,7 @@ class OnlineASRProcessor:
             logger.debug("chunking segment")
             #self.chunk_at(t)
 
-        logger.debug(f"len of buffer now: {len(self.audio_buffer)/self.SAMPLING_RATE:2.2f}")
-        return self.to_flush(o)
+        return o
 
     def chunk_completed_sentence(self):
         if self.commited == []: return
@@ -533,8 +898,6 @@ class OnlineASRProcessor:
             logger.debug(f"\t\tSENT: {s}")
         if len(sents) < 2:
             return
-        while len(sents) > 2:
-            sents.pop(0)
         # we will continue with audio processing at this timestamp
         chunk_at = sents[-2][1]
 
@@ -569,27 +932,38 @@ class OnlineASRProcessor:
     def chunk_at(self, time):
         """trims the hypothesis and audio buffer at "time"
         """
-        self.transcript_buffer.pop_commited(time)
-        cut_seconds = time - self.buffer_time_offset
-        self.audio_buffer = self.audio_buffer[int(cut_seconds*self.SAMPLING_RATE):]
-        self.buffer_time_offset = time
+        with span(self.tracer, "chunk_at", trim_point=time, buffer_offset=self.buffer_time_offset):
+            self.transcript_buffer.pop_commited(time)
+            cut_seconds = time - self.buffer_time_offset
+            if self.feature_cache is not None:
+                # rounded, so that cuts at Whisper's 20 ms timestamps keep the feature cache aligned to its 10 ms frames
+                # (truncating (7.3-2.1)*16000 gives 83199 samples and would drop the cache). Without the cache the cut
+                # truncates, as it always did.
+                cut = int(round(cut_seconds*self.SAMPLING_RATE))
+                self.feature_cache.trim_front(cut)
+            else:
+                cut = int(cut_seconds*self.SAMPLING_RATE)
+            self.audio_buffer.trim_front(cut)
+            self.buffer_time_offset = time
+            self.trims += 1
 
     def words_to_sentences(self, words):
         """Uses self.tokenizer for sentence segmentation of words.
         Returns: [(beg,end,"sentence 1"),...]
         """
         
-        cwords = [w for w in words]
-        t = " ".join(o[2] for o in cwords)
+        t = " ".join(o[2] for o in words)
         s = self.tokenizer.split(t)
         out = []
-        while s:
+        i = 0  # cursor into words
+        for sent in s:
             beg = None
             end = None
-            sent = s.pop(0).strip()
+            sent = sent.strip()
             fsent = sent
-            while cwords:
-                b,e,w = cwords.pop(0)
+            while i < len(words):
+                b,e,w = words[i]
+                i += 1
                 w = w.strip()
                 if beg is None and sent.startswith(w):
                     beg = b
@@ -608,6 +982,7 @@ class OnlineASRProcessor:
         f = self.to_flush(o)
         logger.debug(f"last, noncommited: {f}")
         self.buffer_time_offset += len(self.audio_buffer)/16000
+        self.interim = (None, None, "")
         return f
 
 
@@ -626,31 +1001,68 @@ class OnlineASRProcessor:
             e = offset + sents[-1][1]
         return (b,e,t)
 
+def load_vad_model(path=None):
+    """Loads the silero VAD model used by VACOnlineASRProcessor: the TorchScript file at path if given, otherwise
+    the model bundled with the installed silero-vad package. Only without the package, it is downloaded from
+    GitHub with torch.hub, which needs the network.
+    """
+    import torch
+    if path:
+        model = torch.jit.load(path, map_location="cpu")
+        model.eval()
+        return model
+    try:
+        from silero_vad import load_silero_vad
+    except ImportError:
+        logger.warning("silero-vad is not installed, loading the VAD model from GitHub with torch.hub")
+        model, _ = torch.hub.load(
+            repo_or_dir='snakers4/silero-vad',
+            model='silero_vad'
+        )
+        return model
+    return load_silero_vad()
+
 class VACOnlineASRProcessor(OnlineASRProcessor):
     '''Wraps OnlineASRProcessor with VAC (Voice Activity Controller). 
 
     It works the same way as OnlineASRProcessor: it receives chunks of audio (e.g. 0.04 seconds), 
     it runs VAD and continuously detects whether there is speech or not. 
     When it detects end of speech (non-voice for 500ms), it makes OnlineASRProcessor to end the utterance immediately.
+
+    A chunk may hold several ends and starts, e.g. a backlog inserted at once. Every event is acted on. An utterance
+    that starts before process_iter has finished the previous one waits in self.pending with its audio, and goes to
+    OnlineASRProcessor after the final flush of the previous one.
     '''
 
-    def __init__(self, online_chunk_size, *a, **kw):
+    def __init__(self, online_chunk_size, *a, vad_model=None, **kw):
+        """vad_model: preloaded silero VAD model. The model is stateful, so every processor needs its own instance
+        (see load_vad_model). It is loaded here if None.
+        """
         self.online_chunk_size = online_chunk_size
 
         self.online = OnlineASRProcessor(*a, **kw)
 
         # VAC:
-        import torch
-        model, _ = torch.hub.load(
-            repo_or_dir='snakers4/silero-vad',
-            model='silero_vad'
-        )
+        if vad_model is None:
+            vad_model = load_vad_model()
         from whisper_streamer.silero_vad_iterator import FixedVADIterator
-        self.vac = FixedVADIterator(model)  # we use the default options there: 500ms silence, 100ms padding, etc.  
+        self.vac = FixedVADIterator(vad_model)  # we use the default options there: 500ms silence, 100ms padding, etc.  
 
         self.logfile = self.online.logfile
         self.init()
 
+    @property
+    def tracer(self):
+        return self.online.tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        self.online.tracer = tracer
+
+    @property
+    def interim(self):
+        return self.online.interim
+
     def init(self):
         self.online.init()
         self.vac.reset_states()
@@ -659,59 +1071,78 @@ class VACOnlineASRProcessor(OnlineASRProcessor):
         self.is_currently_final = False
 
         self.status = None  # or "voice" or "nonvoice"
-        self.audio_buffer = np.array([],dtype=np.float32)
+        self.audio_buffer = AudioBuffer()
         self.buffer_offset = 0  # in frames
+        # utterances that started while the one in self.online waits for its final flush:
+        # [offset in seconds, AudioBuffer, whether it has ended too]
+        self.pending = deque()
 
     def clear_buffer(self):
         self.buffer_offset += len(self.audio_buffer)
-        self.audio_buffer = np.array([],dtype=np.float32)
+        self.audio_buffer.clear()
 
 
     def insert_audio_chunk(self, audio):
-        res = self.vac(audio)
-        self.audio_buffer = np.append(self.audio_buffer, audio)
-
-        if res is not None:
-            frame = list(res.values())[0]-self.buffer_offset
-            if 'start' in res and 'end' not in res:
+        with span(self.tracer, "vad", samples=len(audio)) as s:
+            events = self.vac.events(audio)
+            s.set(events=len(events))
+        self.audio_buffer.append(audio)
+
+        for res in events:
+            # the padding may put a start before the beginning of the stream
+            frame = max(0, list(res.values())[0]-self.buffer_offset)
+            if 'start' in res:
                 self.status = 'voice'
-                send_audio = self.audio_buffer[frame:]
-                self.online.init(offset=(frame+self.buffer_offset)/self.SAMPLING_RATE)
-                self.online.insert_audio_chunk(send_audio)
-                self.current_online_chunk_buffer_size += len(send_audio)
-                self.clear_buffer()
-            elif 'end' in res and 'start' not in res:
-                self.status = 'nonvoice'
-                send_audio = self.audio_buffer[:frame]
-                self.online.insert_audio_chunk(send_audio)
-                self.current_online_chunk_buffer_size += len(send_audio)
-                self.is_currently_final = True
-                self.clear_buffer()
+                self._start_utterance((frame+self.buffer_offset)/self.SAMPLING_RATE)
+                self._drop_front(frame)
             else:
-                beg = res["start"]-self.buffer_offset
-                end = res["end"]-self.buffer_offset
                 self.status = 'nonvoice'
-                send_audio = self.audio_buffer[beg:end]
-                self.online.init(offset=(beg+self.buffer_offset)/self.SAMPLING_RATE)
-                self.online.insert_audio_chunk(send_audio)
-                self.current_online_chunk_buffer_size += len(send_audio)
-                self.is_currently_final = True
-                self.clear_buffer()
+                self._send(self.audio_buffer[:frame])
+                self._drop_front(frame)
+                self._end_utterance()
+
+        if self.status == 'voice':
+            self._send(self.audio_buffer.view())
+            self.clear_buffer()
         else:
-            if self.status == 'voice':
-                self.online.insert_audio_chunk(self.audio_buffer)
-                self.current_online_chunk_buffer_size += len(self.audio_buffer)
-                self.clear_buffer()
-            else:
-                # We keep 1 second because VAD may later find start of voice in it.
-                # But we trim it to prevent OOM. 
-                self.buffer_offset += max(0,len(self.audio_buffer)-self.SAMPLING_RATE)
-                self.audio_buffer = self.audio_buffer[-self.SAMPLING_RATE:]
+            # We keep 1 second because VAD may later find start of voice in it.
+            # But we trim it to prevent OOM. 
+            self.buffer_offset += max(0,len(self.audio_buffer)-self.SAMPLING_RATE)
+            self.audio_buffer.keep_last(self.SAMPLING_RATE)
+
+    def _drop_front(self, frames):
+        self.audio_buffer.trim_front(frames)
+        self.buffer_offset += frames
+
+    def _start_utterance(self, offset):
+        if self.is_currently_final or self.pending:
+            self.pending.append([offset, AudioBuffer(), False])
+        else:
+            self.online.init(offset=offset)
 
+    def _send(self, audio):
+        if self.pending:
+            self.pending[-1][1].append(audio)
+        else:
+            self.online.insert_audio_chunk(audio)
+            self.current_online_chunk_buffer_size += len(audio)
+
+    def _end_utterance(self):
+        if self.pending:
+            self.pending[-1][2] = True
+        else:
+            self.is_currently_final = True
 
     def process_iter(self):
         if self.is_currently_final:
-            return self.finish()
+            ret = self.finish()
+            if self.pending:
+                offset, audio, ended = self.pending.popleft()
+                self.online.init(offset=offset)
+                self.online.insert_audio_chunk(audio.view())
+                self.current_online_chunk_buffer_size = len(audio)
+                self.is_currently_final = ended
+            return ret
         elif self.current_online_chunk_buffer_size > self.SAMPLING_RATE*self.online_chunk_size:
             self.current_online_chunk_buffer_size = 0
             ret = self.online.process_iter()
@@ -721,7 +1152,12 @@ class VACOnlineASRProcessor(OnlineASRProcessor):
             return (None, None, "")
 
     def finish(self):
-        ret = self.online.finish()
+        # the audio inserted since the last process_iter is transcribed too
+        flushed = []
+        if self.current_online_chunk_buffer_size > 0:
+            flushed.append(self.online.process_iter())
+        flushed.append(self.online.finish())
+        ret = self.online.to_flush([o for o in flushed if o[2]])
         self.current_online_chunk_buffer_size = 0
         self.is_currently_final = False
         return ret
@@ -772,6 +1208,11 @@ def add_shared_args(parser):
     parser.add_argument('--lan', '--language', type=str, default='auto', help="Source language code, e.g. en,de,cs, or 'auto' for language detection.")
     parser.add_argument('--task', type=str, default='transcribe', choices=["transcribe","translate"],help="Transcribe or translate.")
     parser.add_argument('--backend', type=str, default="faster-whisper", choices=["faster-whisper", "whisper_timestamped", "mlx-whisper", "openai-api"],help='Load only this backend for Whisper processing.')
+    parser.add_argument('--device', type=str, default="cuda", choices=["cuda", "cpu", "auto"], help='Device for the faster-whisper backend.')
+    parser.add_argument('--compute_type', type=str, default=None, help='Quantization for the faster-whisper backend, e.g. float16, int8_float16, int8. Default: float16 on cuda, int8 on cpu.')
+    parser.add_argument('--cpu_threads', type=int, default=0, help='Threads per faster-whisper worker on CPU. 0 means the ctranslate2 default.')
+    parser.add_argument('--num_workers', type=int, default=1, help='Number of transcriptions that can run in parallel on the faster-whisper model.')
+    parser.add_argument('--autotune', action="store_true", default=False, help='Benchmark a few --cpu_threads/--num_workers splits at startup and use the fastest one (faster-whisper backend).')
     parser.add_argument('--vac', action="store_true", default=False, help='Use VAC = voice activity controller. Recommended. Requires torch.')
     parser.add_argument('--vac-chunk-size', type=float, default=0.04, help='VAC sample size in seconds.')
     parser.add_argument('--vad', action="store_true", default=False, help='Use VAD = voice activity detection, with the default parameters.')
@@ -799,7 +1240,12 @@ def asr_factory(args, logfile=sys.stderr):
         size = args.model
         t = time.time()
         logger.info(f"Loading Whisper {size} model for {args.lan}...")
-        asr = asr_cls(modelsize=size, lan=args.lan, cache_dir=args.model_cache_dir, model_dir=args.model_dir)
+        kwargs = {}
+        if asr_cls is FasterWhisperASR:
+            kwargs = dict(device=getattr(args, 'device', "cuda"), compute_type=getattr(args, 'compute_type', None),
+                          cpu_threads=getattr(args, 'cpu_threads', 0), num_workers=getattr(args, 'num_workers', 1),
+                          autotune=getattr(args, 'autotune', False))
+        asr = asr_cls(modelsize=size, lan=args.lan, cache_dir=args.model_cache_dir, model_dir=args.model_dir, **kwargs)
         e = time.time()
         logger.info(f"done. It took {round(e-t,2)} seconds.")
 
@@ -848,14 +1294,19 @@ if __name__ == "__main__":
     parser.add_argument('--start_at', type=float, default=0.0, help='Start processing audio at this time.')
     parser.add_argument('--offline', action="store_true", default=False, help='Offline mode.')
     parser.add_argument('--comp_unaware', action="store_true", default=False, help='Computationally unaware simulation.')
+    parser.add_argument('--parallel_offline', action="store_true", default=False, help='Offline mode for long recordings: VAD cuts the file into speech regions that are transcribed in parallel.')
+    parser.add_argument('--offline_workers', type=int, default=1, help='--parallel_offline: number of processes, each loads its own model. On CPU, divide the cores among them with --cpu_threads.')
+    parser.add_argument('--offline_batch_size', type=int, default=1, help='--parallel_offline with one worker: number of speech chunks transcribed as one batch.')
+    parser.add_argument('--offline_max_chunk', type=float, default=30.0, help='--parallel_offline: speech regions are packed into chunks of up to this many seconds.')
+    parser.add_argument('--trace', type=str, default=None, help='Write timed spans of every processing step to this file as Chrome trace-event JSON (open in chrome://tracing or ui.perfetto.dev).')
     
     args = parser.parse_args()
 
     # reset to store stderr to different file stream, e.g. open(os.devnull,"w")
     logfile = sys.stderr
 
-    if args.offline and args.comp_unaware:
-        logger.error("No or one option from --offline and --comp_unaware are available, not both. Exiting.")
+    if args.offline + args.comp_unaware + args.parallel_offline > 1:
+        logger.error("No or one option from --offline, --comp_unaware and --parallel_offline are available, not more. Exiting.")
         sys.exit(1)
 
 #    if args.log_level:
@@ -870,17 +1321,30 @@ if __name__ == "__main__":
     duration = len(load_audio(audio_path))/SAMPLING_RATE
     logger.info("Audio duration is: %2.2f seconds" % duration)
 
-    asr, online = asr_factory(args, logfile=logfile)
+    if args.parallel_offline and args.offline_workers > 1:
+        asr = online = None  # every worker process loads its own model
+    else:
+        asr, online = asr_factory(args, logfile=logfile)
     if args.vac:
         min_chunk = args.vac_chunk_size
     else:
         min_chunk = args.min_chunk_size
 
-    # load the audio into the LRU cache before we start the timer
+    # decode the audio (if it is not 16 kHz mono float32 WAV) before we start the timer
     a = load_audio_chunk(audio_path,0,1)
 
     # warm up the ASR because the very first transcribe takes much more time than the other
-    asr.transcribe(a)
+    if asr is not None:
+        asr.transcribe(a)
+
+    tracer = None
+    if args.trace:
+        from whisper_streamer.tracing import ChromeTraceExporter
+        tracer = ChromeTraceExporter(args.trace)
+        if asr is not None:
+            asr.tracer = tracer
+        if online is not None:
+            online.tracer = tracer
 
     beg = args.start_at
     start = time.time()-beg
@@ -901,7 +1365,13 @@ if __name__ == "__main__":
             # No text, so no output
             pass
 
-    if args.offline: ## offline mode processing (for testing/debugging)
+    if args.parallel_offline:
+        from whisper_streamer.offline import transcribe_offline
+        for o in transcribe_offline(audio_path, args, asr=asr, workers=args.offline_workers,
+                                    batch_size=args.offline_batch_size, max_chunk=args.offline_max_chunk):
+            output_transcript(o)
+        now = None
+    elif args.offline: ## offline mode processing (for testing/debugging)
         a = load_audio(audio_path)
         online.insert_audio_chunk(a)
         try:
@@ -962,5 +1432,10 @@ if __name__ == "__main__":
                 break
         now = None
 
-    o = online.finish()
-    output_transcript(o, now=now)
+    if online is not None:
+        o = online.finish()
+        output_transcript(o, now=now)
+
+    if tracer is not None:
+        tracer.write()
+        logger.info(f"trace written to {args.trace}")